@@ -36,6 +36,11 @@ from swapper import load_model
 from openwisp_utils.admin import CopyableFieldsAdmin
 
 from . import settings as app_settings
+from .api.authentication import (
+    invalidate_cached_sesame_tokens,
+    invalidate_cached_user_tokens,
+)
+from .api.conditional import invalidate_versions
 from .multitenancy import MultitenantAdminMixin, MultitenantOrgFilter
 from .utils import BaseAdmin
 
@@ -270,8 +275,14 @@ class UserAdmin(MultitenantAdminMixin, BaseUserAdmin, BaseAdmin):
     )
     @require_confirmation
     def make_inactive(self, request, queryset):
+        # QuerySet.update() doesn't send signals,
+        # hence the caches are invalidated here
+        user_pks = list(queryset.values_list("pk", flat=True))
         queryset.update(is_active=False)
-        count = queryset.count()
+        invalidate_versions(self.model, epoch=True)
+        invalidate_cached_user_tokens(user_pks)
+        invalidate_cached_sesame_tokens(user_pks)
+        count = len(user_pks)
         if count:
             self.message_user(
                 request,
@@ -290,6 +301,7 @@ class UserAdmin(MultitenantAdminMixin, BaseUserAdmin, BaseAdmin):
         # Clear past expiration dates before reactivating users.
         today = localdate()
         queryset = queryset.filter(is_active=False)
+        user_pks = list(queryset.values_list("pk", flat=True))
         expired_count = queryset.filter(expiration_date__lt=today).update(
             is_active=True, expiration_date=None
         )
@@ -298,6 +310,9 @@ class UserAdmin(MultitenantAdminMixin, BaseUserAdmin, BaseAdmin):
         ).update(is_active=True)
         count += expired_count
         if count:
+            invalidate_versions(self.model, epoch=True)
+            invalidate_cached_user_tokens(user_pks)
+            invalidate_cached_sesame_tokens(user_pks)
             message = _("Successfully activated %(count)d %(model_name)s") % {
                 "count": count,
                 "model_name": model_ngettext(self.opts, count),
@@ -1,3 +1,8 @@
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
 from django.utils.translation import gettext as _
 from rest_framework import exceptions
 from rest_framework.authentication import (
@@ -9,10 +14,89 @@ from sesame import settings as sesame_settings
 from sesame.utils import get_token as get_one_time_auth_token_for_user  # noqa
 from sesame.utils import get_user as get_user_from_one_time_auth_token
 
+from .. import settings as app_settings
+
+
+def get_token_cache_key(key):
+    # the raw key is not used in the cache key to avoid exposing it
+    return f"bearer_token_{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+def invalidate_cached_token(key, using=None):
+    """
+    Invalidates the token cached by ``BearerAuthentication`` once the current
+    transaction is committed, this way concurrent requests can't cache it
+    again with the data which is being changed.
+    """
+    if app_settings.BEARER_TOKEN_CACHE_TIMEOUT:
+        cache_key = get_token_cache_key(key)
+        transaction.on_commit(lambda: cache.delete(cache_key), using=using)
+
+
+def invalidate_cached_user_tokens(user_pks, using=None):
+    """
+    Invalidates the tokens of the given users cached by ``BearerAuthentication``
+    once the current transaction is committed: the user is cached along with
+    its token, hence changes to the user (eg: deactivation) invalidate it.
+    """
+    if not app_settings.BEARER_TOKEN_CACHE_TIMEOUT:
+        return
+    from rest_framework.authtoken.models import Token
+
+    cache_keys = [
+        get_token_cache_key(key)
+        for key in Token.objects.using(using)
+        .filter(user_id__in=user_pks)
+        .values_list("key", flat=True)
+    ]
+    if cache_keys:
+        transaction.on_commit(lambda: cache.delete_many(cache_keys), using=using)
+
+
+def get_sesame_token_cache_key(key):
+    return f"sesame_token_{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+def get_sesame_user_cache_key(user_pk):
+    return f"sesame_user_{user_pk}_version"
+
+
+def invalidate_cached_sesame_tokens(user_pks, using=None):
+    """
+    Invalidates the sesame tokens of the given users cached by
+    ``SesameAuthentication`` (see ``SESAME_TOKEN_CACHE_TIMEOUT``) by
+    discarding the version of the users once the current transaction
+    is committed.
+    """
+    if not app_settings.SESAME_TOKEN_CACHE_TIMEOUT:
+        return
+    cache_keys = [get_sesame_user_cache_key(user_pk) for user_pk in user_pks]
+    if cache_keys:
+        transaction.on_commit(lambda: cache.delete_many(cache_keys), using=using)
+
 
 class BearerAuthentication(TokenAuthentication):
+    """
+    Token authentication using the ``Bearer`` keyword.
+
+    When ``OPENWISP_USERS_BEARER_TOKEN_CACHE_TIMEOUT`` is set, the token
+    and its user are cached, which saves a database query per request.
+    """
+
     keyword = "Bearer"
 
+    def authenticate_credentials(self, key):
+        timeout = app_settings.BEARER_TOKEN_CACHE_TIMEOUT
+        if not timeout:
+            return super().authenticate_credentials(key)
+        cache_key = get_token_cache_key(key)
+        token = cache.get(cache_key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            # the user is cached along with the token (select_related)
+            cache.set(cache_key, token, timeout)
+        return (token.user, token)
+
 
 class SesameAuthentication(BaseAuthentication):
     keyword = sesame_settings.TOKEN_NAME
@@ -41,7 +125,55 @@ class SesameAuthentication(BaseAuthentication):
         return self.authenticate_credentials(token)
 
     def authenticate_credentials(self, key):
+        timeout = self.get_cache_timeout()
+        if not timeout:
+            return self._verify_token(key)
+        cache_key = get_sesame_token_cache_key(key)
+        entry = cache.get(cache_key)
+        if entry is not None:
+            user, version = entry
+            if version == cache.get(get_sesame_user_cache_key(user.pk)):
+                return (user, key)
+        max_age = sesame_settings.MAX_AGE
+        if max_age is not None:
+            # the token is cached only if it's valid for the whole timeout
+            max_age -= timeout
+            if max_age <= 0:
+                return self._verify_token(key)
+        user = get_user_from_one_time_auth_token(key, max_age=max_age)
+        if user is None:
+            if max_age is None:
+                self._fail()
+            # the token may be valid but about to expire
+            return self._verify_token(key)
+        version = self._get_user_version(user.pk, timeout)
+        if version is not None:
+            cache.set(cache_key, (user, version), timeout)
+        return (user, key)
+
+    def get_cache_timeout(self):
+        """
+        Returns the number of seconds for which verified tokens are cached,
+        one-time tokens are never cached because they're invalidated on use.
+        """
+        if sesame_settings.ONE_TIME:
+            return 0
+        return app_settings.SESAME_TOKEN_CACHE_TIMEOUT
+
+    def _get_user_version(self, user_pk, timeout):
+        # changes to the user discard the version, which invalidates
+        # all the cached tokens of the user at once
+        version_key = get_sesame_user_cache_key(user_pk)
+        version = uuid.uuid4().hex
+        if cache.add(version_key, version, timeout):
+            return version
+        return cache.get(version_key)
+
+    def _verify_token(self, key):
         user = get_user_from_one_time_auth_token(key)
         if user is None:
-            raise exceptions.AuthenticationFailed(_("Invalid or expired token."))
+            self._fail()
         return (user, key)
+
+    def _fail(self):
+        raise exceptions.AuthenticationFailed(_("Invalid or expired token."))
@@ -0,0 +1,66 @@
+"""
+Version stamps of the resources of the REST API, which are used to compute
+the ``ETag`` header of ``ConditionalGetMixin``.
+
+Each stamp is a random token stored in the Django cache, which is deleted by
+the signal receivers of the app once the transaction which changes the
+resource is committed: the next request generates a new stamp. The time of
+the changes is not tracked, since timestamps with the resolution of the
+``Last-Modified`` header (one second) can't tell apart the stamps generated
+within the same second. Three kinds of stamps exist for each model:
+
+- the stamp of each instance, used by the detail endpoints;
+- the stamp of the collection, changed by any change to the
+  instances of the model, used by the list endpoints;
+- the epoch of the model, changed when instances are changed in bulk
+  (eg: ``QuerySet.update()``), which is part of the ``ETag`` of the
+  detail endpoints.
+"""
+
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_CACHE_TIMEOUT = 86400
+_COLLECTION = "all"
+_EPOCH = "epoch"
+
+
+def get_version_cache_key(model, pk=_COLLECTION):
+    opts = model._meta.concrete_model._meta
+    return f"openwisp_users_version_{opts.label_lower}_{pk}"
+
+
+def get_epoch_cache_key(model):
+    return get_version_cache_key(model, _EPOCH)
+
+
+def get_versions(keys):
+    """
+    Returns the version stamps of the given cache keys, in the same order,
+    generating the missing ones.
+    """
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, VERSION_CACHE_TIMEOUT)
+        versions.update(cache.get_many(missing))
+    # a stamp evicted in the meantime is replaced by
+    # one which doesn't match any previous validator
+    return [versions.get(key) or uuid.uuid4().hex for key in keys]
+
+
+def invalidate_versions(model, pks=(), collection=True, epoch=False, using=None):
+    """
+    Invalidates the stamps of the given instances of the model, of its
+    collection and of its epoch once the current transaction is committed.
+    """
+    keys = [get_version_cache_key(model, pk) for pk in pks]
+    if collection:
+        keys.append(get_version_cache_key(model))
+    if epoch:
+        keys.append(get_epoch_cache_key(model))
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys), using=using)
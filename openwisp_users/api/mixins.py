@@ -1,18 +1,129 @@
+import hashlib
+
 import swapper
+from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.db.models import ForeignKey, ManyToManyField, Q
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django_filters import rest_framework as filters
 from django_filters.filters import QuerySetRequestMixin as BaseQuerySetRequestMixin
 from rest_framework.authentication import SessionAuthentication
 from rest_framework.exceptions import NotFound
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 
 from .authentication import BearerAuthentication
+from .conditional import get_epoch_cache_key, get_version_cache_key, get_versions
 from .permissions import DjangoModelPermissions, IsOrganizationManager
 
 Organization = swapper.load_model("openwisp_users", "Organization")
 
 
+def get_requested_fields(request):
+    """
+    Returns the set of fields requested with the ``fields`` query string
+    parameter (eg: ``?fields=id,username``) or ``None`` if all the fields
+    shall be returned; sparse fieldsets apply only to read requests.
+    """
+    if request is None or request.method not in ("GET", "HEAD"):
+        return None
+    fields = request.query_params.get("fields")
+    if not fields:
+        return None
+    return frozenset(field.strip() for field in fields.split(","))
+
+
+class SparseFieldsetsMixin:
+    """
+    View mixin which loads only the columns of the fields requested with
+    ``?fields=``, see ``SparseFieldsetsSerializerMixin``.
+    """
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        fields = get_requested_fields(self.request)
+        if qs is None or fields is None:
+            return qs
+        columns = [
+            field.name
+            for field in qs.model._meta.concrete_fields
+            if field.name in fields
+        ]
+        # the fields read by the paginator (eg: the keyset of the
+        # last item of the page) are loaded along with the requested ones
+        ordering = getattr(getattr(self, "paginator", None), "ordering", None) or ()
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        columns.extend(field.lstrip("-") for field in ordering)
+        return qs.only(*columns or [qs.model._meta.pk.name])
+
+
+class ConditionalGetMixin:
+    """
+    Adds the ``ETag`` header to the responses of the list and detail
+    endpoints and answers ``304 Not Modified`` to conditional requests
+    without serializing the data, see ``openwisp_users.api.conditional``.
+
+    The ``ETag`` depends also on the version of the request user,
+    the serializer class and the query string.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not self._is_conditional_get_supported(request):
+            return super().list(request, *args, **kwargs)
+        etag = self._get_etag([get_version_cache_key(self._get_version_model())])
+        response = self._get_not_modified_response(request, etag)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        return self._set_etag(response, etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self._is_conditional_get_supported(request):
+            return super().retrieve(request, *args, **kwargs)
+        model = self._get_version_model()
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        # the versions are read before the data, hence changes
+        # committed in the meantime can't be hidden by a 304
+        etag = self._get_etag(
+            [get_version_cache_key(model, pk), get_epoch_cache_key(model)]
+        )
+        instance = self.get_object()
+        response = self._get_not_modified_response(request, etag)
+        if response is None:
+            response = Response(self.get_serializer(instance).data)
+        return self._set_etag(response, etag)
+
+    def _is_conditional_get_supported(self, request):
+        # the browsable API renders forms which depend on the session
+        return request.accepted_renderer.format != "api"
+
+    def _get_version_model(self):
+        return self.get_serializer_class().Meta.model
+
+    def _get_etag(self, keys):
+        user = self.request.user
+        if user.is_authenticated:
+            keys.append(get_version_cache_key(get_user_model(), user.pk))
+        basis = get_versions(keys)
+        basis += [
+            self.get_serializer_class().__qualname__,
+            self.request.accepted_media_type,
+            self.request.get_full_path(),
+            str(user.pk),
+        ]
+        digest = hashlib.md5("|".join(basis).encode(), usedforsecurity=False)
+        return quote_etag(digest.hexdigest())
+
+    def _get_not_modified_response(self, request, etag):
+        return get_conditional_response(request, etag=etag)
+
+    def _set_etag(self, response, etag):
+        if response.status_code in (200, 304):
+            response.headers.setdefault("ETag", etag)
+        return response
+
+
 class OrgLookup:
     @property
     def org_field(self):
@@ -0,0 +1,144 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from openwisp_utils.api.pagination import OpenWispPagination
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only cursor pagination on a pair of fields, the second of which
+    must be unique (eg: ``("-date_joined", "-id")``): each page is selected
+    with an index-friendly ``WHERE`` clause on the last item of the previous
+    page instead of an offset, hence the cost of a page does not depend on
+    its depth, pages are stable under concurrent inserts and no ``COUNT(*)``
+    query is performed.
+    """
+
+    ordering = None
+    cursor_query_param = "cursor"
+    page_size = OpenWispPagination.page_size
+    max_page_size = OpenWispPagination.max_page_size
+    page_size_query_param = "page_size"
+    invalid_cursor_message = _("Invalid cursor")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self._get_position_filter(position))
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+        results = list(queryset[: self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[: self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        position = [
+            self._get_value(last, field_name) for field_name in self._field_names
+        ]
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(position),
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        except (binascii.Error, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != 2:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, position):
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    @property
+    def _field_names(self):
+        return [field.lstrip("-") for field in self.ordering]
+
+    def _get_value(self, instance, field_name):
+        value = getattr(instance, field_name)
+        if hasattr(value, "isoformat"):
+            return value.isoformat()
+        return str(value)
+
+    def _get_position_filter(self, position):
+        first, second = self._field_names
+        lookup = "lt" if self.ordering[0].startswith("-") else "gt"
+        return Q(**{f"{first}__{lookup}": position[0]}) | Q(
+            **{first: position[0], f"{second}__{lookup}": position[1]}
+        )
+
+
+class UserKeysetPagination(KeysetPagination):
+    ordering = ("-date_joined", "-id")
+
+
+class OrganizationKeysetPagination(KeysetPagination):
+    ordering = ("-created", "-id")
+
+
+class OptionalKeysetPaginationMixin:
+    """
+    List view mixin which uses ``keyset_pagination_class`` instead of
+    ``pagination_class`` when it's requested by the client with
+    ``?pagination=cursor`` or when a cursor is passed.
+    """
+
+    keyset_pagination_class = None
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator") and self._is_keyset_pagination_requested():
+            self._paginator = self.keyset_pagination_class()
+        return super().paginator
+
+    def _is_keyset_pagination_requested(self):
+        query_params = self.request.query_params
+        return (
+            query_params.get("pagination") == "cursor"
+            or self.keyset_pagination_class.cursor_query_param in query_params
+        )
@@ -0,0 +1,38 @@
+import csv
+import io
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class NDJSONRenderer(JSONRenderer):
+    """
+    Newline delimited JSON: streaming views write one object per line,
+    other responses (eg: errors) are rendered as a single line.
+    """
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        content = super().render(data, accepted_media_type, renderer_context)
+        return content + b"\n" if content else content
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    CSV format of streaming views, other responses (eg: errors)
+    are rendered as a header row followed by a row of values.
+    """
+
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, dict):
+            return ""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(data.keys())
+        writer.writerow(data.values())
+        return buffer.getvalue()
@@ -1,4 +1,5 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 
 from allauth.account.models import EmailAddress
@@ -10,18 +11,26 @@ from dj_rest_auth.serializers import (
 )
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import Permission
 from django.contrib.sites.shortcuts import get_current_site
-from django.db import transaction
-from django.db.models import Q
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, router, transaction
+from django.db.models import Prefetch, Q
+from django.db.models.signals import m2m_changed, post_save
+from django.utils import timezone
 from django.utils.module_loading import import_string
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from swapper import load_model
 
 from openwisp_utils.api.serializers import ValidatedModelSerializer
 
 from .. import settings as app_settings
+from ..membership import bulk_membership_changes
+from ..tasks import get_request_environ, send_email_confirmations
+from .mixins import get_requested_fields
 
 Group = load_model("openwisp_users", "Group")
 Organization = load_model("openwisp_users", "Organization")
@@ -31,7 +40,21 @@ logger = logging.getLogger(__name__)
 OrganizationOwner = load_model("openwisp_users", "OrganizationOwner")
 
 
-class OrganizationSerializer(ValidatedModelSerializer):
+class SparseFieldsetsSerializerMixin:
+    """
+    Returns only the fields requested with the ``fields``
+    query string parameter (eg: ``?fields=id,username``).
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = get_requested_fields(self.context.get("request"))
+        if requested is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in requested}
+
+
+class OrganizationSerializer(SparseFieldsetsSerializerMixin, ValidatedModelSerializer):
     class Meta:
         model = Organization
         fields = (
@@ -89,7 +112,9 @@ class OrganizationOwnerSerializer(serializers.ModelSerializer):
         extra_kwargs = {"organization_user": {"allow_null": True}}
 
 
-class OrganizationDetailSerializer(serializers.ModelSerializer):
+class OrganizationDetailSerializer(
+    SparseFieldsetsSerializerMixin, serializers.ModelSerializer
+):
     owner = OrganizationOwnerSerializer(required=False)
 
     class Meta:
@@ -213,7 +238,23 @@ class OrganizationUserSerializer(serializers.ModelSerializer):
         return super().to_internal_value(data)
 
 
-class BaseSuperUserSerializer(ValidatedModelSerializer):
+def get_organization_users_prefetch():
+    """
+    Returns the ``Prefetch`` of the organization memberships of users
+    used by ``BaseSuperUserSerializer``, which loads only the fields
+    returned in ``organization_users``.
+    """
+    accessor_name = OrganizationUser._meta.get_field(
+        "user"
+    ).remote_field.get_accessor_name()
+    return Prefetch(
+        accessor_name,
+        queryset=OrganizationUser.objects.only("user", "organization", "is_admin"),
+        to_attr="prefetched_organization_users",
+    )
+
+
+class BaseSuperUserSerializer(SparseFieldsetsSerializerMixin, ValidatedModelSerializer):
     _skip_validation_fields = [
         "groups",
         "user_permissions",
@@ -224,12 +265,19 @@ class BaseSuperUserSerializer(ValidatedModelSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        org_users = OrganizationUser.objects.filter(user=instance).select_related()
+        if "organization_users" not in self.fields:
+            return data
+        # memberships prefetched by the list views are used when available
+        org_users = getattr(instance, "prefetched_organization_users", None)
+        if org_users is None:
+            org_users = OrganizationUser.objects.filter(user=instance).only(
+                "user", "organization", "is_admin"
+            )
         list_of_org_users = []
         for org_user in org_users:
             user = dict()
             user["is_admin"] = org_user.is_admin
-            user["organization"] = org_user.organization.id
+            user["organization"] = org_user.organization_id
             list_of_org_users.append(user)
         data["organization_users"] = list_of_org_users
         return data
@@ -405,6 +453,289 @@ class UserListSerializer(SuperUserListSerializer):
         }
 
 
+def hash_passwords(passwords):
+    """
+    Hashes the passwords in a pool of threads, the password hashers
+    of Django release the GIL while computing the hashes.
+    """
+    workers = min(app_settings.BULK_CREATE_HASHING_WORKERS, len(passwords))
+    if workers <= 1:
+        return [make_password(password) for password in passwords]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(make_password, passwords))
+
+
+class BaseBulkUserSerializer(serializers.ListSerializer):
+    """
+    Validates the whole batch of users before saving any of them:
+    if any item is invalid, the errors of each item are returned.
+    """
+
+    unique_fields = ("username", "email", "phone_number")
+
+    def to_internal_value(self, data):
+        # validated items (or None for the invalid ones) in the order of data
+        self._validated_items = []
+        try:
+            validated_data = super().to_internal_value(data)
+            errors = [{} for _ in validated_data]
+        except serializers.ValidationError as e:
+            # errors which don't concern the items (eg: the batch is too large)
+            if not isinstance(e.detail, list):
+                raise
+            validated_data, errors = None, e.detail
+        self.validate_batch(self._validated_items, errors)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return validated_data
+
+    def run_child_validation(self, data):
+        try:
+            validated = super().run_child_validation(data)
+        except serializers.ValidationError:
+            self._validated_items.append(None)
+            raise
+        self._validated_items.append(validated)
+        return validated
+
+    def validate_batch(self, validated_items, errors):
+        """
+        Adds the errors which can be detected only by looking at the
+        whole batch to the ``errors`` of each item.
+        """
+        self._validate_unique_in_batch(validated_items, errors)
+
+    def _validate_unique_in_batch(self, validated_items, errors):
+        """
+        The uniqueness validation of each item can't detect the duplicates
+        within the batch, which are looked up among the validated values
+        (eg: usernames stripped of whitespace, phone numbers in E.164).
+        """
+        for field_name in self.unique_fields:
+            seen = set()
+            for attrs, item_errors in zip(validated_items, errors):
+                value = attrs.get(field_name) if attrs else None
+                if not value:
+                    continue
+                if field_name == "email":
+                    value = value.lower()
+                elif field_name == "phone_number":
+                    # the model field converts the value to a phone number
+                    value = User._meta.get_field(field_name).to_python(value)
+                    value = getattr(value, "as_e164", value)
+                if value in seen and field_name not in item_errors:
+                    item_errors[field_name] = [
+                        _("This value is repeated in the batch.")
+                    ]
+                seen.add(value)
+
+    def save_atomically(self, func, *args):
+        try:
+            with transaction.atomic():
+                # the membership cache of the users is invalidated at once
+                with bulk_membership_changes():
+                    return func(*args)
+        except IntegrityError:
+            # conflicts with the users created or changed concurrently,
+            # which the validation of the batch couldn't detect
+            raise serializers.ValidationError(
+                {
+                    api_settings.NON_FIELD_ERRORS_KEY: [
+                        _(
+                            "The users conflict with the users created or "
+                            "changed in the meantime, please try again."
+                        )
+                    ]
+                }
+            )
+
+
+class BulkUserCreateSerializer(BaseBulkUserSerializer):
+    """
+    Creates a batch of users validated by ``SuperUserListSerializer`` or
+    ``UserListSerializer``: the whole batch is validated before creating
+    any user, then the users, their groups, memberships and email addresses
+    are inserted with ``bulk_create`` in a single transaction.
+
+    The ``save()`` method of the models is not called and ``pre_save`` is
+    not sent, while ``post_save`` (and ``m2m_changed`` for the groups) is
+    sent for the users and their memberships once all of them have been
+    inserted. The verification emails are sent by a background task.
+    """
+
+    def validate_batch(self, validated_items, errors):
+        super().validate_batch(validated_items, errors)
+        self._validate_organization_users(validated_items, errors)
+
+    def _validate_organization_users(self, validated_items, errors):
+        """
+        Performs the model validation of the memberships, which
+        ``SuperUserListSerializer`` performs after creating the user.
+        """
+        for attrs, item_errors in zip(validated_items, errors):
+            org_user_data = (attrs or {}).get("organization_users") or {}
+            if org_user_data.get("organization") is None:
+                continue
+            try:
+                # the user doesn't exist yet
+                OrganizationUser(**org_user_data).full_clean(exclude=["user"])
+            except DjangoValidationError as e:
+                item_errors.setdefault(
+                    "organization_users", serializers.as_serializer_error(e)
+                )
+
+    def create(self, validated_data):
+        users, passwords, groups, org_users, emails = [], [], [], [], []
+        for attrs in validated_data:
+            attrs = dict(attrs)
+            group_data = attrs.pop("groups", None) or []
+            org_user_data = attrs.pop("organization_users", None) or {}
+            passwords.append(attrs.pop("password"))
+            email_verified = attrs.pop("email_verified", False)
+            user = User(**attrs)
+            # same normalization of ``AbstractUser.clean``
+            user.email = user.email or None
+            user.phone_number = user.phone_number or None
+            users.append(user)
+            if group_data:
+                groups.append((user, group_data))
+            if org_user_data.get("organization") is not None:
+                org_users.append(OrganizationUser(user=user, **org_user_data))
+            if user.email:
+                emails.append(
+                    EmailAddress(
+                        user=user,
+                        email=user.email.lower(),
+                        primary=email_verified,
+                        verified=email_verified,
+                    )
+                )
+        password_updated = timezone.now().date()
+        for user, password in zip(users, hash_passwords(passwords)):
+            user.password = password
+            user.password_updated = password_updated
+        self.save_atomically(self._bulk_create, users, groups, org_users, emails)
+        return users
+
+    def _bulk_create(self, users, groups, org_users, emails):
+        User.objects.bulk_create(users)
+        self._send_post_save(User, users)
+        self._add_groups(groups)
+        # the first manager of an organization without owner becomes its
+        # owner by the ``post_save`` receiver of ``OrganizationUser``
+        OrganizationUser.objects.bulk_create(org_users)
+        self._send_post_save(OrganizationUser, org_users)
+        EmailAddress.objects.bulk_create(emails)
+        unverified = [str(email.user.pk) for email in emails if not email.verified]
+        if unverified:
+            environ = get_request_environ(self.context["request"])
+            transaction.on_commit(
+                lambda: send_email_confirmations.delay(unverified, environ)
+            )
+
+    def _send_post_save(self, model, instances):
+        # signals are not sent by bulk_create
+        for instance in instances:
+            post_save.send(
+                sender=model,
+                instance=instance,
+                created=True,
+                update_fields=None,
+                raw=False,
+                using=instance._state.db,
+            )
+
+    def _add_groups(self, groups):
+        UserGroup = User.groups.through
+        using = router.db_for_write(UserGroup)
+        signal_kwargs = [
+            dict(
+                sender=UserGroup,
+                instance=user,
+                reverse=False,
+                model=User._meta.get_field("groups").related_model,
+                pk_set={group.pk for group in group_data},
+                using=using,
+            )
+            for user, group_data in groups
+        ]
+        for kwargs in signal_kwargs:
+            m2m_changed.send(action="pre_add", **kwargs)
+        UserGroup.objects.using(using).bulk_create(
+            UserGroup(user_id=kwargs["instance"].pk, group_id=group_pk)
+            for kwargs in signal_kwargs
+            for group_pk in kwargs["pk_set"]
+        )
+        for kwargs in signal_kwargs:
+            m2m_changed.send(action="post_add", **kwargs)
+
+
+class BulkUserUpdateSerializer(BaseBulkUserSerializer):
+    """
+    Updates a batch of users with ``SuperUserDetailSerializer`` or
+    ``UserDetailSerializer``: each item contains the ``id`` of the user
+    and the fields to change. The whole batch is validated before
+    changing any user, then the users are saved one at a time (sending
+    the model signals) in a single transaction.
+
+    ``instance`` is the queryset of the users which can be changed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("partial", True)
+        super().__init__(*args, **kwargs)
+
+    def to_internal_value(self, data):
+        # the users of the items, loaded with a single query
+        self._found, self._instances, self._seen = {}, [], set()
+        if isinstance(data, list):
+            pks = []
+            for item in data:
+                try:
+                    pks.append(User._meta.pk.to_python(item.get("id")))
+                except (AttributeError, DjangoValidationError):
+                    continue
+            self._found = {
+                str(user.pk): user for user in self.instance.filter(pk__in=pks)
+            }
+        return super().to_internal_value(data)
+
+    def run_child_validation(self, data):
+        if not isinstance(data, dict) or "id" not in data:
+            self._validated_items.append(None)
+            raise serializers.ValidationError({"id": [_("This field is required.")]})
+        instance = self._found.get(str(data["id"]))
+        if instance is None:
+            self._validated_items.append(None)
+            raise serializers.ValidationError({"id": [_("Not found.")]})
+        if instance.pk in self._seen:
+            self._validated_items.append(None)
+            raise serializers.ValidationError(
+                {"id": [_("This value is repeated in the batch.")]}
+            )
+        self._seen.add(instance.pk)
+        self._instances.append(instance)
+        self.child.instance = instance
+        self.child.initial_data = data
+        return super().run_child_validation(data)
+
+    @property
+    def validated_instances(self):
+        """
+        The users of the items, in the same order.
+        """
+        return self._instances
+
+    def update(self, queryset, validated_data):
+        return self.save_atomically(self._update, self._instances, validated_data)
+
+    def _update(self, instances, validated_data):
+        return [
+            self.child.update(instance, attrs)
+            for instance, attrs in zip(instances, validated_data)
+        ]
+
+
 def get_userdetail_fields(fields):
     """
     Returns the fields for `UserDetailSerializer`.
@@ -1,9 +1,59 @@
-from rest_framework.throttling import UserRateThrottle
+import math
+
+from rest_framework.throttling import SimpleRateThrottle, UserRateThrottle
 
 from openwisp_users import settings as app_settings
 
 
-class AuthRateThrottle(UserRateThrottle):
+class GCRARateThrottle(SimpleRateThrottle):
+    """
+    Throttle implementing the generic cell rate algorithm (GCRA): instead of
+    the list of timestamps stored by ``SimpleRateThrottle``, the cache entry
+    of each client holds a single integer, the theoretical arrival time (in
+    milliseconds) of its next request, which is updated with the atomic
+    ``incr`` operation of the cache backend (Redis, Memcached, LocMem).
+
+    The rate allows bursts of up to ``num_requests`` requests,
+    which are then replenished at a constant pace.
+    """
+
+    cache_format = "throttle_gcra_%(scope)s_%(ident)s"
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        self.now = self.timer()
+        now = int(self.now * 1000)
+        # milliseconds between requests at the sustained rate
+        interval = math.ceil(self.duration * 1000 / self.num_requests)
+        try:
+            arrival = self.cache.incr(self.key, interval)
+        except ValueError:
+            # first request of the client or the entry has expired
+            if self.cache.add(self.key, now + interval, self.duration):
+                return True
+            arrival = self.cache.incr(self.key, interval)
+        if arrival - interval < now:
+            # the client was idle, the burst is fully available again;
+            # concurrent requests can only undercount a single interval
+            self.cache.set(self.key, now + interval, self.duration)
+            return True
+        self.wait_time = (arrival - now - self.duration * 1000) / 1000
+        if self.wait_time > 0:
+            self.cache.decr(self.key, interval)
+            return False
+        # the entry must outlive the theoretical arrival time
+        self.cache.touch(self.key, math.ceil((arrival - now) / 1000))
+        return True
+
+    def wait(self):
+        return self.wait_time
+
+
+class AuthRateThrottle(GCRARateThrottle, UserRateThrottle):
     """
     Throttle authentication endpoints by IP for anonymous requests and by user
     for authenticated requests, covering the self-service password-change API.
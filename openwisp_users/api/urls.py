@@ -30,6 +30,12 @@ def get_api_urls(api_views=None):
             get_view("user_list"),
             name="user_list",
         ),
+        path("users/user/export/", get_view("user_export"), name="user_export"),
+        path(
+            "users/user/bulk/",
+            get_view("user_bulk_create"),
+            name="user_bulk_create",
+        ),
         path("users/user/<uuid:pk>/", get_view("user_detail"), name="user_detail"),
         path(
             "users/user/<uuid:pk>/password/",
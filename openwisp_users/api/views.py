@@ -1,9 +1,15 @@
+import csv
+import io
+import json
+
 from allauth.account.models import EmailAddress
 from allauth.account.utils import user_pk_to_url_str
 from dj_rest_auth.views import PasswordChangeView as BasePasswordChangeView
 from dj_rest_auth.views import PasswordResetConfirmView as BasePasswordResetConfirmView
 from dj_rest_auth.views import PasswordResetView as BasePasswordResetView
 from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from drf_yasg.utils import swagger_auto_schema
@@ -18,16 +24,31 @@ from rest_framework.mixins import UpdateModelMixin
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
 from swapper import load_model
 
+from openwisp_users import settings as app_settings
 from openwisp_users.api.permissions import DjangoModelPermissions
 from openwisp_users.auth import create_auth_token
 from openwisp_users.backends import UsersAuthenticationBackend
+from openwisp_users.management.commands.export_users import (
+    UserExporter,
+    normalize_field,
+)
 from openwisp_utils.api.pagination import OpenWispPagination
 
-from .mixins import FilterByParent
+from .mixins import ConditionalGetMixin, FilterByParent
 from .mixins import ProtectedAPIMixin as BaseProtectedAPIMixin
+from .mixins import SparseFieldsetsMixin, get_requested_fields
+from .pagination import (
+    OptionalKeysetPaginationMixin,
+    OrganizationKeysetPagination,
+    UserKeysetPagination,
+)
+from .renderers import CSVRenderer, NDJSONRenderer
 from .serializers import (
+    BulkUserCreateSerializer,
+    BulkUserUpdateSerializer,
     ChangePasswordSerializer,
     EmailAddressSerializer,
     GroupSerializer,
@@ -39,6 +60,7 @@ from .serializers import (
     SuperUserListSerializer,
     UserDetailSerializer,
     UserListSerializer,
+    get_organization_users_prefetch,
 )
 from .swagger import ObtainTokenRequest, ObtainTokenResponse
 from .throttling import AuthRateThrottle
@@ -141,11 +163,23 @@ class BaseOrganizationView(ProtectedAPIMixin):
         )
 
 
-class OrganizationListCreateView(BaseOrganizationView, ListCreateAPIView):
+class OrganizationListCreateView(
+    ConditionalGetMixin,
+    OptionalKeysetPaginationMixin,
+    SparseFieldsetsMixin,
+    BaseOrganizationView,
+    ListCreateAPIView,
+):
     pagination_class = OpenWispPagination
+    keyset_pagination_class = OrganizationKeysetPagination
 
 
-class OrganizationDetailView(BaseOrganizationView, RetrieveUpdateDestroyAPIView):
+class OrganizationDetailView(
+    ConditionalGetMixin,
+    SparseFieldsetsMixin,
+    BaseOrganizationView,
+    RetrieveUpdateDestroyAPIView,
+):
     serializer_class = OrganizationDetailSerializer
 
 
@@ -156,19 +190,41 @@ class BaseUserView(ProtectedAPIMixin):
             return User.objects.order_by("-date_joined")
 
         if not user.is_superuser and not user.is_anonymous:
-            org_users = OrganizationUser.objects.filter(user=user).select_related(
-                "organization"
+            # a single subquery, regardless of the number of managed
+            # organizations, without duplicates for the users which are
+            # members of more than one of them
+            user_ids = (
+                OrganizationUser.objects.filter(
+                    organization_id__in=user.organizations_managed
+                )
+                .values_list("user_id")
+                .distinct()
+            )
+            return User.objects.filter(id__in=user_ids, is_superuser=False).order_by(
+                "-date_joined"
             )
-            qs = User.objects.none()
-            for org_user in org_users:
-                if org_user.is_admin:
-                    qs = qs | org_user.organization.users.all().distinct()
-            qs = qs.filter(is_superuser=False)
-            return qs.order_by("-date_joined")
 
 
-class UsersListCreateView(BaseUserView, ListCreateAPIView):
+class UsersListCreateView(
+    ConditionalGetMixin,
+    OptionalKeysetPaginationMixin,
+    SparseFieldsetsMixin,
+    BaseUserView,
+    ListCreateAPIView,
+):
     pagination_class = OpenWispPagination
+    keyset_pagination_class = UserKeysetPagination
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if qs is None:
+            return qs
+        fields = get_requested_fields(self.request)
+        if fields is None or "organization_users" in fields:
+            qs = qs.prefetch_related(get_organization_users_prefetch())
+        if fields is None or "groups" in fields:
+            qs = qs.prefetch_related("groups")
+        return qs
 
     def get_serializer_class(self):
         user = self.request.user
@@ -177,7 +233,68 @@ class UsersListCreateView(BaseUserView, ListCreateAPIView):
         return UserListSerializer
 
 
-class UserDetailView(BaseUserView, RetrieveUpdateDestroyAPIView):
+class UserBulkCreateView(BaseUserView, GenericAPIView):
+    """
+    Creates (``POST``) or changes (``PATCH``) a list of users in a single
+    request, see ``BulkUserCreateSerializer`` and ``BulkUserUpdateSerializer``:
+    if any item is invalid no user is saved and the errors of each item
+    are returned.
+    """
+
+    def get_serializer_class(self):
+        if self.request.method == "PATCH":
+            if self.request.user.is_superuser:
+                return SuperUserDetailSerializer
+            return UserDetailSerializer
+        if self.request.user.is_superuser:
+            return SuperUserListSerializer
+        return UserListSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = BulkUserCreateSerializer(
+            child=self.get_serializer(),
+            data=request.data,
+            context=self.get_serializer_context(),
+            allow_empty=False,
+            max_length=app_settings.BULK_CREATE_MAX_SIZE,
+        )
+        serializer.is_valid(raise_exception=True)
+        users = serializer.save()
+        return self.get_bulk_response(serializer, users, status=201)
+
+    def patch(self, request, *args, **kwargs):
+        serializer = BulkUserUpdateSerializer(
+            self.get_queryset(),
+            child=self.get_serializer(),
+            data=request.data,
+            context=self.get_serializer_context(),
+            allow_empty=False,
+            max_length=app_settings.BULK_CREATE_MAX_SIZE,
+        )
+        serializer.is_valid(raise_exception=True)
+        for user in serializer.validated_instances:
+            self.check_object_permissions(request, user)
+        users = serializer.save()
+        return self.get_bulk_response(serializer, users)
+
+    def get_bulk_response(self, serializer, users, status=200):
+        # the representation of all the saved users takes three queries
+        saved = {
+            user.pk: user
+            for user in User.objects.filter(
+                pk__in=[user.pk for user in users]
+            ).prefetch_related(get_organization_users_prefetch(), "groups")
+        }
+        serializer.instance = [saved[user.pk] for user in users]
+        return Response(serializer.data, status=status)
+
+
+class UserDetailView(
+    ConditionalGetMixin,
+    SparseFieldsetsMixin,
+    BaseUserView,
+    RetrieveUpdateDestroyAPIView,
+):
     def get_serializer_class(self):
         user = self.request.user
         if user.is_superuser:
@@ -185,7 +302,112 @@ class UserDetailView(BaseUserView, RetrieveUpdateDestroyAPIView):
         return UserDetailSerializer
 
 
-class GroupListCreateView(ProtectedAPIMixin, ListCreateAPIView):
+class ExportJSONEncoder(JSONEncoder):
+    """
+    Encodes the values which have no JSON type
+    (eg: phone numbers) as strings.
+    """
+
+    def default(self, o):
+        try:
+            return super().default(o)
+        except TypeError:
+            return str(o)
+
+
+class UserExportView(UserExporter, BaseUserView, GenericAPIView):
+    """
+    Streams the users visible to the request user with the fields of
+    ``EXPORT_USERS_COMMAND_CONFIG``, as NDJSON (default) or as CSV
+    (``?format=csv``), loading ``chunk_size`` users at a time.
+    """
+
+    renderer_classes = (NDJSONRenderer, CSVRenderer)
+    swagger_schema = None
+    chunk_size = 1000
+    # password hashes are never exported through the API
+    exclude_fields = ("password",)
+    filename = "openwisp_exported_users"
+
+    def get(self, request, *args, **kwargs):
+        exclude_fields = set(self.exclude_fields)
+        exclude_fields.update(
+            field.strip()
+            for field in request.query_params.get("exclude_fields", "").split(",")
+            if field.strip()
+        )
+        fields = self.get_export_fields(exclude_fields)
+        queryset = self.get_export_queryset(self.get_queryset())
+        renderer = request.accepted_renderer
+        if renderer.format == "csv":
+            content = self._stream_csv(queryset, fields)
+        else:
+            content = self._stream_ndjson(queryset, fields)
+        response = StreamingHttpResponse(
+            content, content_type=f"{renderer.media_type}; charset=utf-8"
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{self.filename}.{renderer.format}"'
+        )
+        return response
+
+    def get_export_prefetch_related(self):
+        lookups = super().get_export_prefetch_related()
+        user = self.request.user
+        if user.is_superuser:
+            return lookups
+        # organization managers see only the memberships
+        # of the organizations which they manage
+        accessor_name = OrganizationUser._meta.get_field(
+            "user"
+        ).remote_field.get_accessor_name()
+        memberships = OrganizationUser.objects.filter(
+            organization_id__in=user.organizations_managed
+        )
+        return [
+            (
+                Prefetch(lookup, queryset=memberships)
+                if lookup == accessor_name
+                else lookup
+            )
+            for lookup in lookups
+        ]
+
+    def _iter_chunks(self, queryset, get_row, fields):
+        # each chunk is written at once rather than row by row
+        rows = []
+        for user in queryset.iterator(chunk_size=self.chunk_size):
+            rows.append(get_row(user, fields))
+            if len(rows) == self.chunk_size:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+    def _stream_ndjson(self, queryset, fields):
+        names = [normalize_field(field)["name"] for field in fields]
+        # the values are exported with their JSON types (eg: booleans)
+        for rows in self._iter_chunks(queryset, self.get_native_row, fields):
+            yield "".join(
+                json.dumps(dict(zip(names, row)), cls=ExportJSONEncoder) + "\n"
+                for row in rows
+            )
+
+    def _stream_csv(self, queryset, fields):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.get_header_row(fields))
+        for rows in self._iter_chunks(queryset, self.get_row, fields):
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # the header is sent also when there are no users
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
+class GroupListCreateView(ConditionalGetMixin, ProtectedAPIMixin, ListCreateAPIView):
     queryset = Group.objects.prefetch_related(
         "permissions", "permissions__content_type"
     ).order_by("name")
@@ -193,7 +415,9 @@ class GroupListCreateView(ProtectedAPIMixin, ListCreateAPIView):
     pagination_class = OpenWispPagination
 
 
-class GroupDetailView(ProtectedAPIMixin, RetrieveUpdateDestroyAPIView):
+class GroupDetailView(
+    ConditionalGetMixin, ProtectedAPIMixin, RetrieveUpdateDestroyAPIView
+):
     queryset = Group.objects.prefetch_related(
         "permissions", "permissions__content_type"
     ).order_by("name")
@@ -338,6 +562,8 @@ organization_list = OrganizationListCreateView.as_view()
 organization_detail = OrganizationDetailView.as_view()
 user_list = UsersListCreateView.as_view()
 user_detail = UserDetailView.as_view()
+user_export = UserExportView.as_view()
+user_bulk_create = UserBulkCreateView.as_view()
 group_list = GroupListCreateView.as_view()
 group_detail = GroupDetailView.as_view()
 change_password = ChangePasswordView.as_view()
@@ -1,13 +1,13 @@
 import logging
 
 from allauth.account.signals import user_logged_in as allauth_user_logged_in
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.signals import user_logged_in
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError, transaction
-from django.db.models.signals import post_delete, post_save, pre_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.utils.translation import gettext_lazy as _
 from swapper import get_model_name, load_model
 
@@ -16,6 +16,7 @@ from openwisp_utils.admin_theme.menu import register_menu_group
 
 from . import settings as app_settings
 from .auth import SESAME_BACKEND, record_password_based_login
+from .membership import bump_membership_epoch, invalidate_user_organizations
 
 logger = logging.getLogger(__name__)
 
@@ -141,6 +142,150 @@ class OpenwispUsersConfig(AppConfig):
             dispatch_uid="make_first_org_user_org_owner",
         )
         self.connect_password_based_login_signals()
+        self.connect_token_cache_signals()
+        self.connect_resource_version_signals()
+
+    def connect_token_cache_signals(self):
+        """
+        Connect signal handlers that invalidate the tokens cached by
+        ``BearerAuthentication`` (see ``BEARER_TOKEN_CACHE_TIMEOUT``)
+        and ``SesameAuthentication`` (see ``SESAME_TOKEN_CACHE_TIMEOUT``).
+        """
+        from rest_framework.authtoken.models import Token
+
+        ApiKey = apps.get_model(get_user_model()._meta.app_label, "ApiKey")
+        # deleting a token through the ApiKey proxy model
+        # sends signals with ApiKey as sender
+        for model in [Token, ApiKey]:
+            post_delete.connect(
+                self.invalidate_cached_token,
+                sender=model,
+                dispatch_uid=f"{model.__name__}_invalidate_cached_token",
+            )
+        post_save.connect(
+            self.invalidate_cached_user_tokens,
+            sender=get_user_model(),
+            dispatch_uid="user_invalidate_cached_tokens",
+        )
+        post_save.connect(
+            self.invalidate_cached_sesame_tokens,
+            sender=get_user_model(),
+            dispatch_uid="user_invalidate_cached_sesame_tokens",
+        )
+
+    @classmethod
+    def invalidate_cached_token(cls, instance, using=None, **kwargs):
+        from .api.authentication import invalidate_cached_token
+
+        invalidate_cached_token(instance.key, using=using)
+
+    @classmethod
+    def invalidate_cached_user_tokens(cls, instance, using=None, **kwargs):
+        """
+        The user is cached along with its token, hence changes
+        to the user (eg: deactivation) invalidate the token.
+        """
+        from .api.authentication import invalidate_cached_user_tokens
+
+        invalidate_cached_user_tokens([instance.pk], using=using)
+
+    @classmethod
+    def invalidate_cached_sesame_tokens(cls, instance, using=None, **kwargs):
+        """
+        Changes to the user (eg: password, email) revoke its sesame tokens,
+        hence the tokens cached by ``SesameAuthentication`` are invalidated.
+        """
+        from .api.authentication import invalidate_cached_sesame_tokens
+
+        invalidate_cached_sesame_tokens([instance.pk], using=using)
+
+    def connect_resource_version_signals(self):
+        """
+        Connect signal handlers that invalidate the version stamps used by
+        the ``ETag`` header of the REST API.
+        """
+        from django.contrib.auth.models import Permission
+
+        User = get_user_model()
+        Group = load_model("openwisp_users", "Group")
+        # Group is a proxy model, groups changed through the concrete
+        # model send the signals with the concrete model as sender
+        for model in {
+            User,
+            Group,
+            Group._meta.concrete_model,
+            Permission,
+            load_model("openwisp_users", "Organization"),
+            load_model("openwisp_users", "OrganizationUser"),
+            load_model("openwisp_users", "OrganizationOwner"),
+        }:
+            for signal, name in [
+                (post_save, "post_save"),
+                (post_delete, "post_delete"),
+            ]:
+                signal.connect(
+                    self.invalidate_resource_versions,
+                    sender=model,
+                    dispatch_uid=f"{name}_{model._meta.label}_invalidate_versions",
+                )
+        for through in [
+            User.groups.through,
+            User.user_permissions.through,
+            Group.permissions.through,
+        ]:
+            m2m_changed.connect(
+                self.invalidate_m2m_resource_versions,
+                sender=through,
+                dispatch_uid=f"{through.__name__}_invalidate_versions",
+            )
+
+    @classmethod
+    def invalidate_resource_versions(cls, instance, signal, using=None, **kwargs):
+        from django.contrib.auth.models import Permission
+
+        from .api.conditional import invalidate_versions
+
+        User = get_user_model()
+        Group = load_model("openwisp_users", "Group")
+        Organization = load_model("openwisp_users", "Organization")
+        OrganizationUser = load_model("openwisp_users", "OrganizationUser")
+        if isinstance(instance, User):
+            invalidate_versions(User, [instance.pk], using=using)
+        elif isinstance(instance, OrganizationUser):
+            invalidate_versions(User, [instance.user_id], using=using)
+            invalidate_versions(Organization, using=using)
+        elif isinstance(instance, Organization):
+            # the organizations managed by users may change (eg: is_active)
+            invalidate_versions(Organization, [instance.pk], using=using)
+            invalidate_versions(User, using=using)
+        elif isinstance(instance, Group._meta.concrete_model):
+            invalidate_versions(Group, [instance.pk], using=using)
+            if signal is post_delete:
+                # the memberships of users are deleted without signals
+                invalidate_versions(User, epoch=True, using=using)
+        elif isinstance(instance, Permission):
+            invalidate_versions(Group, epoch=True, using=using)
+            invalidate_versions(User, epoch=True, using=using)
+        else:
+            # OrganizationOwner
+            invalidate_versions(Organization, [instance.organization_id], using=using)
+
+    @classmethod
+    def invalidate_m2m_resource_versions(
+        cls, instance, action, reverse, model, pk_set, using=None, **kwargs
+    ):
+        if action not in ("post_add", "post_remove", "post_clear"):
+            return
+        from .api.conditional import invalidate_versions
+
+        if not reverse:
+            invalidate_versions(type(instance), [instance.pk], using=using)
+            return
+        # eg: group.user_set.add(user), the changed objects are the users
+        if pk_set is None:
+            invalidate_versions(model, epoch=True, using=using)
+        else:
+            invalidate_versions(model, pk_set, using=using)
 
     def connect_password_based_login_signals(self):
         """
@@ -183,10 +328,14 @@ class OpenwispUsersConfig(AppConfig):
             old_instance = Organization.objects.only("is_active").get(pk=instance.pk)
         except Organization.DoesNotExist:
             return
-        from .tasks import invalidate_org_membership_cache
-
         if instance.is_active != old_instance.is_active:
-            invalidate_org_membership_cache.delay(instance.pk)
+            # Changing the membership epoch invalidates the membership
+            # cache of all the users at once with a single cache write.
+            # The epoch is changed again after the transaction is
+            # committed, otherwise concurrent requests could cache the
+            # old status of the organization before it's committed.
+            bump_membership_epoch()
+            transaction.on_commit(bump_membership_epoch)
 
     @classmethod
     def pre_save_update_organizations_dict(cls, instance, **kwargs):
@@ -205,7 +354,9 @@ class OpenwispUsersConfig(AppConfig):
                 return
             else:
                 if getattr(db_obj, check_field) != getattr(instance, check_field):
-                    cls._invalidate_user_cache(getattr(db_obj, check_field))
+                    cls._invalidate_user_cache(
+                        getattr(db_obj, check_field), using=kwargs.get("using")
+                    )
 
         if hasattr(instance, "user"):
             _invalidate_old_related_obj_cache(instance, "user")
@@ -213,22 +364,19 @@ class OpenwispUsersConfig(AppConfig):
             _invalidate_old_related_obj_cache(instance, "organization_user")
 
     @classmethod
-    def _invalidate_user_cache(cls, user):
+    def _invalidate_user_cache(cls, user, using=None):
         User = get_user_model()
-        if not isinstance(user, User):
-            user = user.user
-        # Invalidate the organizations cache of the user
-        user._invalidate_user_organizations_dict()
+        user_pk = user.pk if isinstance(user, User) else user.user_id
+        # Invalidate the organizations cache of the user, the cache
+        # is rebuilt once the transaction is committed
+        invalidate_user_organizations(user_pk, using=using)
 
     @classmethod
-    def update_organizations_dict(cls, instance, signal, **kwargs):
+    def update_organizations_dict(cls, instance, signal, using=None, **kwargs):
         if hasattr(instance, "user"):
-            user = instance.user
+            cls._invalidate_user_cache(instance, using=using)
         else:
-            user = instance.organization_user.user
-        cls._invalidate_user_cache(user)
-        # forces caching
-        user.organizations_dict
+            cls._invalidate_user_cache(instance.organization_user, using=using)
 
     @classmethod
     def create_organization_owner(cls, instance, created, **kwargs):
@@ -1,11 +1,21 @@
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY
 from django.contrib.auth import SESSION_KEY as AUTH_SESSION_KEY
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_delete, post_save
 from django.urls import reverse, reverse_lazy
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from . import settings as app_settings
 
 SESSION_KEY = "openwisp_password_based_login"
+PASSWORD_EXPIRY_SESSION_KEY = "openwisp_password_expiry"
 SESAME_BACKEND = "sesame.backends.ModelBackend"
 
 # Used by PasswordExpirationMiddleware to know where to redirect
@@ -54,23 +64,83 @@ def create_auth_token(request, user=None, renew=False):
 
     ``renew=True`` replaces the existing token. Persisting provenance on the
     user lets stateless requests classify the token after the session is gone.
+
+    The token and its provenance are stored atomically. Reusing an existing
+    token whose provenance is unchanged (e.g. clients logging in again) takes
+    a single query, renewing a token replaces its key with a single UPDATE
+    (see ``_renew_auth_token``) and the provenance is written only when it
+    changes.
     """
     from rest_framework.authtoken.models import Token
 
+    from .api.authentication import invalidate_cached_token
+
     user = user if user is not None else getattr(request, "user", None)
     if user is None or not user.is_authenticated:
         return None
-    if renew:
-        Token.objects.filter(user=user).delete()
-    token, _created = Token.objects.get_or_create(user=user)
     password_based = _is_password_based_request(request, user)
-    user.password_based_token = password_based
-    get_user_model().objects.filter(pk=user.pk).update(
-        password_based_token=password_based
+    token = None
+    if not renew:
+        token = Token.objects.filter(user=user).first()
+        if token is not None and user.password_based_token == password_based:
+            return token
+    old_keys = []
+    with transaction.atomic():
+        if renew:
+            token = _renew_auth_token(Token, user)
+        elif token is None:
+            token = _create_auth_token(Token, user)
+        if user.password_based_token != password_based:
+            user.password_based_token = password_based
+            get_user_model().objects.filter(pk=user.pk).update(
+                password_based_token=password_based
+            )
+            # the cached token would carry the previous provenance
+            old_keys.append(token.key)
+    for key in old_keys:
+        invalidate_cached_token(key)
+    return token
+
+
+def _renew_auth_token(Token, user):
+    """
+    Replaces the key of the token of the user, which is its primary key:
+    the ``post_delete`` signal of the old token and the ``post_save``
+    signal of the new one are sent as if the token had been deleted and
+    created again (eg: the old key is removed from the cache of
+    ``BearerAuthentication``), must be called within a transaction.
+    """
+    old_token = Token.objects.select_for_update().filter(user=user).first()
+    if old_token is None:
+        return _create_auth_token(Token, user)
+    token = Token(key=Token.generate_key(), user=user, created=timezone.now())
+    Token.objects.filter(pk=old_token.pk).update(key=token.key, created=token.created)
+    # the token is stored in the database
+    token._state.adding = False
+    token._state.db = old_token._state.db
+    post_delete.send(
+        sender=Token, instance=old_token, using=old_token._state.db, origin=old_token
+    )
+    post_save.send(
+        sender=Token,
+        instance=token,
+        created=True,
+        update_fields=None,
+        raw=False,
+        using=token._state.db,
     )
     return token
 
 
+def _create_auth_token(Token, user):
+    try:
+        with transaction.atomic():
+            return Token.objects.create(user=user)
+    except IntegrityError:
+        # the token has been created by a concurrent request
+        return Token.objects.get(user=user)
+
+
 def is_password_based_user(user):
     """
     Return whether the user's last token used the local password.
@@ -85,6 +155,50 @@ def record_password_based_login(request, password_based):
     Record on the session whether the user logged in with the local password.
     """
     request.session[SESSION_KEY] = password_based
+    # the cached verdict depends on how the user logged in
+    request.session.pop(PASSWORD_EXPIRY_SESSION_KEY, None)
+
+
+def _get_password_expiry_version(request, user):
+    # the session auth hash changes when the password changes
+    return [
+        request.session.get(HASH_SESSION_KEY),
+        user.is_staff,
+        user.password_updated.toordinal() if user.password_updated else None,
+        app_settings.USER_PASSWORD_EXPIRATION,
+        app_settings.STAFF_USER_PASSWORD_EXPIRATION,
+    ]
+
+
+def is_expired_password_session(request, user):
+    """
+    Return whether the session was authenticated with a local password
+    which has expired.
+
+    The verdict is cached in the session as the timestamp from which the
+    password is expired, ``None`` if the password never expires or the
+    session is not password based, hence further requests compare one
+    integer against the current time. The verdict is stamped with a version
+    which changes when the password (or its update date) of the user, the
+    staff status of the user or the expiration settings change.
+    """
+    version = _get_password_expiry_version(request, user)
+    stamp = request.session.get(PASSWORD_EXPIRY_SESSION_KEY)
+    if stamp is None or stamp[0] != version:
+        expired_at = None
+        expiry_date = user.get_password_expiry_date()
+        if expiry_date is not None and is_password_based_login(request, user=user):
+            expired_at = _get_midnight_timestamp(expiry_date + timedelta(days=1))
+        stamp = [version, expired_at]
+        request.session[PASSWORD_EXPIRY_SESSION_KEY] = stamp
+    return stamp[1] is not None and time.time() >= stamp[1]
+
+
+def _get_midnight_timestamp(day):
+    # the date returned by timezone.now() is in UTC
+    # when USE_TZ is enabled, in local time otherwise
+    tzinfo = dt_timezone.utc if settings.USE_TZ else None
+    return int(datetime.combine(day, datetime.min.time(), tzinfo=tzinfo).timestamp())
 
 
 def is_password_based_login(request=None, user=None):
@@ -1,10 +1,22 @@
+import re
+from functools import lru_cache
+
 import phonenumbers
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
-from django.db.models import Q
+from django.db.models import Case, IntegerField, Q, Value, When
 from phonenumbers.phonenumberutil import NumberParseException
 
 from . import settings as app_settings
+from .lockout import (
+    ais_locked_out,
+    arecord_login_failure,
+    arecord_login_success,
+    is_locked_out,
+    record_login_failure,
+    record_login_success,
+)
 
 User = get_user_model()
 
@@ -16,31 +28,132 @@ class UsersAuthenticationBackend(ModelBackend):
         # the database with a `None` username, which can be inefficient.
         if not username:
             return
-        for user in self.get_users(username):
-            if user.check_password(password) and self.user_can_authenticate(user):
-                return user
+        # locked out identifiers and IP addresses are rejected
+        # before querying the database and hashing the password
+        if is_locked_out(username, request):
+            return
+        # only the user with the highest precedence is checked,
+        # so that at most one password hash is computed per attempt
+        user = self.get_authentication_candidates(username).first()
+        if user is None:
+            # Run the default password hasher once to reduce the timing
+            # difference between an existing and a nonexistent user
+            User().set_password(password)
+            record_login_failure(username, request)
+            return
+        if not user.check_password(password):
+            record_login_failure(username, request)
+            return
+        record_login_success(username)
+        if self.user_can_authenticate(user):
+            return user
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        """
+        Async version of ``authenticate``, which queries the database
+        with the async ORM API instead of running in a worker thread.
+        """
+        if not username:
+            return
+        if await ais_locked_out(username, request):
+            return
+        user = await self.get_authentication_candidates(username).afirst()
+        if user is None:
+            # the hash is computed in a worker thread, this way
+            # it doesn't block the event loop
+            await sync_to_async(User().set_password, thread_sensitive=False)(password)
+            await arecord_login_failure(username, request)
+            return
+        if not await self._acheck_password(user, password):
+            await arecord_login_failure(username, request)
+            return
+        await arecord_login_success(username)
+        if self.user_can_authenticate(user):
+            return user
+
+    async def _acheck_password(self, user, password):
+        # AbstractBaseUser.acheck_password is not available on Django < 5.0
+        if hasattr(user, "acheck_password"):
+            return await user.acheck_password(password)
+        return await sync_to_async(user.check_password)(password)
 
     def get_users(self, identifier):
+        """
+        Returns the users matching the identifier, ordered by precedence:
+        phone number first, then email and lastly username; users with
+        the same precedence are ordered by primary key, so that the user
+        which is checked is always the same.
+        """
         conditions = Q(email__iexact=identifier) | Q(username=identifier)
+        precedence = [When(email__iexact=identifier, then=Value(1))]
         # if the identifier is a phone number, use the phone number as primary condition
-        for phone_number in self._get_phone_numbers(identifier):
-            conditions = Q(phone_number=phone_number) | conditions
-        return User.objects.filter(conditions)
+        phone_numbers = self._get_phone_numbers(identifier)
+        if phone_numbers:
+            conditions = Q(phone_number__in=phone_numbers) | conditions
+            precedence.insert(0, When(phone_number__in=phone_numbers, then=Value(0)))
+        return (
+            User.objects.filter(conditions)
+            .annotate(
+                _identifier_precedence=Case(
+                    *precedence, default=Value(2), output_field=IntegerField()
+                )
+            )
+            .order_by("_identifier_precedence", "pk")
+        )
+
+    def get_authentication_candidates(self, identifier):
+        """
+        Returns the users matching the identifier which can authenticate,
+        ordered by precedence like ``get_users``: inactive users are
+        excluded, otherwise they would shadow the active users with a
+        lower precedence (eg: an inactive user whose email is the
+        username of an active user).
+        """
+        return self.get_users(identifier).filter(is_active=True)
 
     def _get_phone_numbers(self, identifier):
-        prefixes = [""] + list(app_settings.AUTH_BACKEND_AUTO_PREFIXES)
-        numbers = [identifier]
-        found = []
-        # support those countries which use
-        # leading zeros for their local numbers
-        if str(identifier).startswith("0"):
-            numbers.append(identifier[1:])
-        for prefix in prefixes:
-            for number in numbers:
-                value = f"{prefix}{number}"
-                try:
-                    phonenumbers.parse(value)
-                    found.append(value)
-                except NumberParseException:
-                    continue
-        return found
+        return _parse_phone_numbers(
+            str(identifier), tuple(app_settings.AUTH_BACKEND_AUTO_PREFIXES)
+        )
+
+
+# digits, optionally preceded by "+" and separated by spaces, dots, dashes,
+# slashes or parenthesis, eg: "+39 (366) 52.43-702"; identifiers which
+# do not match (eg: usernames, emails) are never parsed as phone numbers
+_PHONE_NUMBER_RE = re.compile(r"\+?[\d\s.\-/()]{1,40}")
+
+
+@lru_cache(maxsize=8)
+def _get_prefixes(auto_prefixes):
+    # built once for each value of AUTH_BACKEND_AUTO_PREFIXES
+    return ("",) + tuple(dict.fromkeys(auto_prefixes))
+
+
+@lru_cache(maxsize=4096)
+def _parse_phone_numbers(identifier, auto_prefixes):
+    """
+    Returns the phone numbers (E.164) which the identifier may represent.
+    """
+    if not _PHONE_NUMBER_RE.fullmatch(identifier):
+        return ()
+    # numbers which already include the international
+    # prefix are parsed only once, without any prefix
+    prefixes = ("",) if identifier.startswith("+") else _get_prefixes(auto_prefixes)
+    numbers = [identifier]
+    # support those countries which use
+    # leading zeros for their local numbers
+    if identifier.startswith("0"):
+        numbers.append(identifier[1:])
+    found = []
+    for prefix in prefixes:
+        for number in numbers:
+            try:
+                phone_number = phonenumbers.parse(f"{prefix}{number}")
+            except NumberParseException:
+                continue
+            value = phonenumbers.format_number(
+                phone_number, phonenumbers.PhoneNumberFormat.E164
+            )
+            if value not in found:
+                found.append(value)
+    return tuple(found)
@@ -1,4 +1,5 @@
 import logging
+import time
 import uuid
 from smtplib import SMTPException
 
@@ -6,13 +7,12 @@ from allauth.account.models import EmailAddress
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser as BaseUser
 from django.contrib.auth.models import UserManager as BaseUserManager
-from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db import models, transaction
 from django.db.models import OuterRef, Subquery
 from django.template.loader import render_to_string
 from django.utils import timezone, translation
-from django.utils.functional import cached_property
+from django.utils.crypto import salted_hmac
 from django.utils.timezone import localdate, timedelta
 from django.utils.translation import gettext_lazy as _
 from phonenumber_field.modelfields import PhoneNumberField
@@ -22,11 +22,28 @@ from swapper import load_model
 from openwisp_utils.admin_theme.email import send_email
 
 from .. import settings as app_settings
+from ..membership import (
+    aget_organizations,
+    build_organizations_memo,
+    delete_cached_organizations,
+    get_local_version,
+    get_many_cached_organizations,
+    get_organizations,
+    init_membership_epoch,
+    load_organizations,
+    set_many_cached_organizations,
+)
 from ..utils import throttle_email_batch
 
 logger = logging.getLogger(__name__)
 
 
+def _get_password_digest(raw_password):
+    if raw_password is None:
+        return None
+    return salted_hmac("openwisp_users.password_check", raw_password).digest()
+
+
 class UserManager(BaseUserManager):
     def _create_user(self, *args, **kwargs):
         """
@@ -37,6 +54,35 @@ class UserManager(BaseUserManager):
         self._create_email(user)
         return user
 
+    def prefetch_organizations(self, users):
+        """
+        Loads the organization membership data of multiple users at once:
+        the cache is read with a single round trip, the data of the users
+        missing from the cache is loaded with one database query and then
+        stored in the cache with a single round trip.
+
+        Returns a list of the users, which can be then checked with
+        ``is_member``, ``is_manager``, ``is_owner``, etc. without any
+        additional cache lookup.
+        """
+        users = list(users)
+        if not users:
+            return users
+        version = get_local_version()
+        user_pks = {user.pk for user in users}
+        organizations_by_user, epoch = get_many_cached_organizations(user_pks)
+        missing = user_pks - organizations_by_user.keys()
+        if missing:
+            if epoch is None:
+                epoch = init_membership_epoch()
+            start = time.monotonic()
+            loaded = load_organizations(missing)
+            set_many_cached_organizations(loaded, epoch, time.monotonic() - start)
+            organizations_by_user.update(loaded)
+        for user in users:
+            user._memoize_organizations(organizations_by_user[user.pk], version)
+        return users
+
     def _create_email(self, user):
         """
         creates verified and primary email address objects
@@ -132,38 +178,66 @@ class AbstractUser(BaseUser):
         self.password_updated = timezone.now().date()
         return super().set_password(*args, **kwargs)
 
+    def check_password(self, raw_password):
+        """
+        Memoizes the verification of passwords on the user instance, so that
+        the same password is hashed at most once per request even when it's
+        checked by multiple components (eg: serializers, forms and password
+        validators like ``PasswordReuseValidator``).
+
+        The memo is keyed on the password hash of the user and on a digest of
+        the password, hence it's discarded when the password changes.
+        """
+        key = (self.password, _get_password_digest(raw_password))
+        checks = self.__dict__.setdefault("_password_checks", {})
+        try:
+            return checks[key]
+        except KeyError:
+            pass
+        result = checks[key] = super().check_password(raw_password)
+        return result
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # the memo must not outlive the request (eg: users stored in the cache)
+        state.pop("_password_checks", None)
+        return state
+
     def has_password_expired(self):
-        if not self.has_usable_password() or self.password_updated is None:
+        expiry_date = self.get_password_expiry_date()
+        if expiry_date is None:
             return False
+        return expiry_date < timezone.now().date()
+
+    def get_password_expiry_date(self):
+        """
+        Returns the last day on which the password of the user is valid,
+        ``None`` if the password does not expire.
+        """
+        if not self.has_usable_password() or self.password_updated is None:
+            return None
         if self.is_staff and app_settings.STAFF_USER_PASSWORD_EXPIRATION:
-            expiry_date = self.password_updated + timezone.timedelta(
+            return self.password_updated + timezone.timedelta(
                 days=app_settings.STAFF_USER_PASSWORD_EXPIRATION
             )
-        elif app_settings.USER_PASSWORD_EXPIRATION:
-            expiry_date = self.password_updated + timezone.timedelta(
+        if app_settings.USER_PASSWORD_EXPIRATION:
+            return self.password_updated + timezone.timedelta(
                 days=app_settings.USER_PASSWORD_EXPIRATION
             )
-        else:
-            return False
-        return expiry_date < timezone.now().date()
+        return None
 
     def is_member(self, organization):
-        return self._get_pk(organization) in self.organizations_dict
+        return self._organizations_memo.is_member(self._get_pk(organization))
 
     def is_manager(self, organization):
-        org_dict = self.organizations_dict.get(self._get_pk(organization))
-        return org_dict is not None and (org_dict["is_admin"] or org_dict["is_owner"])
+        return self._organizations_memo.is_manager(self._get_pk(organization))
 
     def is_owner(self, organization):
-        org_dict = self.organizations_dict.get(self._get_pk(organization))
-        return org_dict is not None and org_dict["is_owner"]
+        return self._organizations_memo.is_owner(self._get_pk(organization))
 
-    @cached_property
+    @property
     def is_owner_of_any_organization(self):
-        for value in self.organizations_dict.values():
-            if value["is_owner"]:
-                return True
-        return False
+        return bool(self._organizations_memo.owned_pks)
 
     @property
     def organizations_dict(self):
@@ -171,42 +245,65 @@ class AbstractUser(BaseUser):
         Returns a dictionary which represents the organizations which
         the user is member of, or which the user manages or owns.
         """
-        cache_key = "user_{}_organizations".format(self.pk)
-        organizations = cache.get(cache_key)
-        if organizations is not None:
-            return organizations
-
-        manager = load_model("openwisp_users", "OrganizationUser").objects
-        org_users = manager.filter(
-            user=self, organization__is_active=True
-        ).select_related("organization", "organizationowner")
-
-        organizations = {}
-        for org_user in org_users:
-            org = org_user.organization
-            org_id = str(org.pk)
-            organizations[org_id] = {
-                "is_admin": org_user.is_admin,
-                "is_owner": hasattr(org_user, "organizationowner"),
-            }
-
-        cache.set(cache_key, organizations, 86400 * 2)  # Cache for two days
-        return organizations
-
-    def __get_orgs(self, attribute):
-        org_list = []
-        for org_pk, options in self.organizations_dict.items():
-            if options[attribute]:
-                org_list.append(org_pk)
-        return org_list
-
-    @cached_property
+        return self._organizations_memo.organizations
+
+    @property
+    def _organizations_memo(self):
+        """
+        Memoizes the membership data on the user instance, which avoids
+        hitting the cache every time the membership of the user is
+        checked while processing a request. The memo is discarded when
+        the membership cache of any user is invalidated by this process.
+        """
+        memo = getattr(self, "_membership_memo", None)
+        version = get_local_version()
+        if memo is not None and memo.version == version:
+            return memo
+        return self._memoize_organizations(self._get_organizations_dict(), version)
+
+    async def _aorganizations_memo(self):
+        """
+        Async version of ``_organizations_memo``.
+        """
+        memo = getattr(self, "_membership_memo", None)
+        version = get_local_version()
+        if memo is not None and memo.version == version:
+            return memo
+        return self._memoize_organizations(await aget_organizations(self.pk), version)
+
+    async def aorganizations_dict(self):
+        """
+        Async version of ``organizations_dict``, which can be awaited
+        in async views and consumers (eg: ASGI deployments).
+        """
+        return (await self._aorganizations_memo()).organizations
+
+    async def ais_member(self, organization):
+        memo = await self._aorganizations_memo()
+        return memo.is_member(self._get_pk(organization))
+
+    async def ais_manager(self, organization):
+        memo = await self._aorganizations_memo()
+        return memo.is_manager(self._get_pk(organization))
+
+    async def ais_owner(self, organization):
+        memo = await self._aorganizations_memo()
+        return memo.is_owner(self._get_pk(organization))
+
+    def _memoize_organizations(self, organizations, version):
+        self._membership_memo = build_organizations_memo(organizations, version)
+        return self._membership_memo
+
+    def _get_organizations_dict(self):
+        return get_organizations(self.pk)
+
+    @property
     def organizations_managed(self):
-        return self.__get_orgs("is_admin")
+        return list(self._organizations_memo.managed_pks)
 
-    @cached_property
+    @property
     def organizations_owned(self):
-        return self.__get_orgs("is_owner")
+        return list(self._organizations_memo.owned_pks)
 
     def clean(self):
         if self.email == "":
@@ -271,15 +368,8 @@ class AbstractUser(BaseUser):
         """
         Invalidate the organizations cache of the user
         """
-        cache.delete(f"user_{self.pk}_organizations")
-        try:
-            del self.organizations_managed
-        except AttributeError:
-            pass
-        try:
-            del self.organizations_owned
-        except AttributeError:
-            pass
+        delete_cached_organizations(self.pk)
+        self.__dict__.pop("_membership_memo", None)
 
     @classmethod
     def deactivate_expired_users(cls):
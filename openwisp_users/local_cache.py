@@ -0,0 +1,336 @@
+"""
+In-process tier of the membership cache and the broadcast channels
+used to propagate invalidations across the processes (workers)
+which share the same Django cache.
+"""
+
+import os
+import random
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+# message which invalidates all the entries (eg: membership epoch change)
+INVALIDATE_ALL = "*"
+
+
+class BaseChannel:
+    """
+    Base class of the broadcast channels: ``publish`` sends a list of
+    invalidated keys (or ``[INVALIDATE_ALL]``) to every process, while
+    ``poll`` returns the lists of keys published since the last call.
+    Messages published by the current process are received as well.
+    Subclasses may return ``[[INVALIDATE_ALL]]`` from ``poll`` whenever
+    some messages may have been lost.
+
+    ``cross_host`` tells whether the messages reach the processes running
+    on other hosts, which is required to enable the in-process cache.
+    """
+
+    cross_host = False
+
+    def __init__(self, poll_interval=1):
+        self.poll_interval = poll_interval
+
+    def publish(self, keys):
+        raise NotImplementedError()
+
+    def poll(self):
+        raise NotImplementedError()
+
+
+class CacheChannel(BaseChannel):
+    """
+    Delivers messages to the processes of every host which share the
+    Django cache named ``cache`` (eg: Redis, Memcached).
+
+    The messages are stored in a log of numbered cache entries which
+    expire after ``timeout`` seconds, the number of the last message is
+    a counter incremented atomically. Each process reads the messages
+    published since its last poll, if some of them can't be read (eg:
+    they have expired) or they're more than ``max_backlog``, all the
+    keys are invalidated.
+    """
+
+    def __init__(
+        self,
+        cache="default",
+        key_prefix="openwisp_users_invalidations",
+        timeout=300,
+        max_backlog=1000,
+        poll_interval=1,
+    ):
+        super().__init__(poll_interval)
+        self.cache = caches[cache]
+        self.key_prefix = key_prefix
+        self.timeout = timeout
+        self.max_backlog = max_backlog
+        self._counter_key = f"{key_prefix}_last"
+        self._offset = self._get_counter()
+
+    @property
+    def cross_host(self):
+        return not isinstance(self.cache, (LocMemCache, DummyCache))
+
+    def _get_counter(self):
+        counter = self.cache.get(self._counter_key)
+        if counter is None:
+            # the counter starts from a random value, this way if it's
+            # evicted, the new counter doesn't match the offset of the
+            # processes, which detect that messages may have been lost
+            self.cache.add(self._counter_key, random.randrange(2**48), None)
+            counter = self.cache.get(self._counter_key, 0)
+        return counter
+
+    def _get_message_key(self, number):
+        return f"{self.key_prefix}_{number}"
+
+    def publish(self, keys):
+        try:
+            number = self.cache.incr(self._counter_key)
+        except ValueError:
+            self._get_counter()
+            number = self.cache.incr(self._counter_key)
+        self.cache.set(self._get_message_key(number), list(keys), self.timeout)
+
+    def poll(self):
+        counter = self.cache.get(self._counter_key)
+        if counter == self._offset:
+            return []
+        if counter is None or not 0 < counter - self._offset <= self.max_backlog:
+            self._offset = self._get_counter()
+            return [[INVALIDATE_ALL]]
+        keys = [
+            self._get_message_key(number)
+            for number in range(self._offset + 1, counter + 1)
+        ]
+        messages = self.cache.get_many(keys)
+        self._offset = counter
+        if len(messages) < len(keys):
+            # expired or not written yet (the counter is
+            # incremented before the message is stored)
+            return [[INVALIDATE_ALL]]
+        return [messages[key] for key in keys]
+
+
+class LocMemChannel(BaseChannel):
+    """
+    Delivers messages only within the current process,
+    meant for testing.
+    """
+
+    _messages = []
+    _lock = threading.Lock()
+
+    def __init__(self, poll_interval=0):
+        super().__init__(poll_interval)
+        self._offset = len(self._messages)
+
+    def publish(self, keys):
+        with self._lock:
+            self._messages.append(list(keys))
+
+    def poll(self):
+        with self._lock:
+            messages = self._messages[self._offset :]
+            self._offset = len(self._messages)
+        return messages
+
+
+def _get_private_dir():
+    """
+    Returns the directory of the default file of ``FileChannel``, located in
+    the temporary directory of the system and accessible only by the user
+    running the processes, creating it if needed.
+    """
+    path = os.path.join(tempfile.gettempdir(), f"openwisp-users-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    # the directory may have been created by another user
+    # to tamper with the messages (eg: symlinking the file)
+    info = os.lstat(path)
+    if (
+        not stat.S_ISDIR(info.st_mode)
+        or info.st_uid != os.getuid()
+        or stat.S_IMODE(info.st_mode) & 0o077
+    ):
+        raise ImproperlyConfigured(
+            f'"{path}" is not a directory accessible only by the current '
+            'user, set the "path" option of FileChannel explicitly.'
+        )
+    return path
+
+
+class FileChannel(BaseChannel):
+    """
+    Delivers messages to the processes running on the same host by
+    appending them to a file, which is rotated when it grows bigger
+    than ``max_size`` bytes, meant for testing.
+
+    Unless ``path`` is given, the file is located in a directory
+    private to the user running the processes.
+    """
+
+    def __init__(self, path=None, max_size=1024 * 1024, poll_interval=1):
+        super().__init__(poll_interval)
+        self.path = path or os.path.join(_get_private_dir(), "membership-invalidations")
+        self.max_size = max_size
+        self._inode, self._offset = self._stat()
+
+    def _stat(self):
+        try:
+            info = os.stat(self.path)
+        except FileNotFoundError:
+            return None, 0
+        return info.st_ino, info.st_size
+
+    def publish(self, keys):
+        # writes in append mode smaller than the size of a pipe
+        # buffer are not interleaved with writes of other processes
+        with open(self.path, "a") as file:
+            file.write(",".join(str(key) for key in keys) + "\n")
+            size = file.tell()
+        if size > self.max_size:
+            self._rotate()
+
+    def _rotate(self):
+        fd, path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        os.close(fd)
+        os.replace(path, self.path)
+
+    def poll(self):
+        inode, size = self._stat()
+        if self._inode is None:
+            # the file has been created after the last poll
+            self._inode = inode
+        if inode != self._inode or size < self._offset:
+            # the file has been rotated: the messages written to the
+            # old file after the last poll can't be read anymore
+            self._inode, self._offset = inode, size
+            return [[INVALIDATE_ALL]]
+        if size == self._offset:
+            return []
+        with open(self.path) as file:
+            file.seek(self._offset)
+            data = file.read(size - self._offset)
+        # incomplete lines are read on the next poll
+        data = data[: data.rfind("\n") + 1]
+        self._offset += len(data.encode())
+        return [line.split(",") for line in data.splitlines()]
+
+
+def load_channel(config):
+    """
+    Instantiates the channel described by ``config``, a dict
+    containing the ``BACKEND`` dotted path and its ``OPTIONS``.
+    """
+    return import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+
+
+class LocalCache:
+    """
+    Thread-safe LRU cache whose entries expire after ``timeout`` seconds
+    or when their keys are invalidated through ``channel``. Keys are
+    converted to strings, so that they can be sent over the channel.
+
+    ``on_invalidate`` is called whenever entries are invalidated
+    by messages received from the channel.
+    """
+
+    def __init__(self, maxsize, timeout, channel, on_invalidate=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.channel = channel
+        self.on_invalidate = on_invalidate
+        self.hits = 0
+        self.misses = 0
+        # incremented at every invalidation, see ``set``
+        self.generation = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self._next_poll = 0
+
+    def poll(self):
+        if time.monotonic() < self._next_poll:
+            return
+        with self._lock:
+            self._next_poll = time.monotonic() + self.channel.poll_interval
+            messages = self.channel.poll()
+            if not messages:
+                return
+            for keys in messages:
+                if INVALIDATE_ALL in keys:
+                    self._data.clear()
+                    break
+                for key in keys:
+                    self._data.pop(key, None)
+            self.generation += 1
+        if self.on_invalidate:
+            self.on_invalidate()
+
+    def get(self, key):
+        self.poll()
+        key = str(key)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+        return None
+
+    def set(self, key, value, generation=None):
+        """
+        Stores ``value``, unless ``generation`` (the value of the
+        ``generation`` attribute read before loading ``value``) shows
+        that an invalidation happened in the meantime, in which case
+        ``value`` may be stale.
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            key = str(key)
+            self._data[key] = (time.monotonic() + self.timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete_many(self, keys):
+        keys = [str(key) for key in keys]
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+            self.generation += 1
+        self.channel.publish(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+        self.channel.publish([INVALIDATE_ALL])
+
+    def get_stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": get_hit_ratio(self.hits, self.misses),
+            "size": len(self._data),
+        }
+
+
+def get_hit_ratio(hits, misses):
+    total = hits + misses
+    return hits / total if total else None
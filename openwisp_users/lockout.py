@@ -0,0 +1,215 @@
+"""
+Counts the failed login attempts of each identifier and of each IP address
+in the Django cache, locking them out with an exponential backoff once the
+configured thresholds are reached, see ``OPENWISP_USERS_LOGIN_LOCKOUT_*``.
+
+Each counter is an integer incremented atomically, the timestamp until
+which it's locked out is stored in a separate key.
+
+Locked out attempts are rejected before querying the
+database and before computing any password hash.
+"""
+
+import hashlib
+import time
+
+from django.core.cache import cache
+
+from . import settings as app_settings
+
+_IDENTIFIER = "identifier"
+_IP = "ip"
+
+
+class _LockoutStats:
+    failures = 0
+    rejected = 0
+
+
+_stats = _LockoutStats()
+
+
+def get_login_lockout_stats():
+    """
+    Returns the failed login attempts recorded and the attempts rejected
+    because of a lockout, which corresponds to the number of password
+    hashes avoided, counted by the current process.
+    """
+    return {"failures": _stats.failures, "hashes_avoided": _stats.rejected}
+
+
+def is_login_lockout_enabled():
+    return bool(
+        app_settings.LOGIN_LOCKOUT_THRESHOLD or app_settings.LOGIN_LOCKOUT_IP_THRESHOLD
+    )
+
+
+def get_lockout_cache_key(kind, value):
+    # the digest keeps the key short and safe for any cache backend
+    value = _normalize_identifier(value) if kind == _IDENTIFIER else str(value)
+    digest = hashlib.sha256(value.encode()).hexdigest()
+    return f"openwisp_users_login_lockout_{kind}_{digest}"
+
+
+def _normalize_identifier(identifier):
+    """
+    Identifiers are normalized like ``UsersAuthenticationBackend``
+    matches them, so that their variants share the same counter:
+    phone numbers are converted to E.164 (eg: "+39 366 524 3702"
+    and "+393665243702"), emails are matched case insensitively.
+    """
+    from .backends import _parse_phone_numbers
+
+    identifier = str(identifier).strip()
+    phone_numbers = _parse_phone_numbers(
+        identifier, tuple(app_settings.AUTH_BACKEND_AUTO_PREFIXES)
+    )
+    if phone_numbers:
+        return phone_numbers[0]
+    return identifier.lower()
+
+
+def _get_ip(request):
+    if request is None:
+        return None
+    return request.META.get("REMOTE_ADDR") or None
+
+
+def _get_thresholds(identifier, request):
+    """
+    Returns a dict which maps the cache key of each
+    enabled counter to its lockout threshold.
+    """
+    thresholds = {}
+    if app_settings.LOGIN_LOCKOUT_THRESHOLD:
+        key = get_lockout_cache_key(_IDENTIFIER, identifier)
+        thresholds[key] = app_settings.LOGIN_LOCKOUT_THRESHOLD
+    ip = _get_ip(request)
+    if ip and app_settings.LOGIN_LOCKOUT_IP_THRESHOLD:
+        key = get_lockout_cache_key(_IP, ip)
+        thresholds[key] = app_settings.LOGIN_LOCKOUT_IP_THRESHOLD
+    return thresholds
+
+
+def get_lockout_deadline_cache_key(key):
+    """
+    Returns the cache key of the timestamp until which the identifier
+    or IP address of the given counter is locked out, which is stored
+    apart from the counter so that the latter can be incremented atomically.
+    """
+    return f"{key}_until"
+
+
+def _get_deadline_keys(thresholds):
+    return [get_lockout_deadline_cache_key(key) for key in thresholds]
+
+
+def _is_locked(deadlines):
+    now = time.time()
+    for locked_until in deadlines.values():
+        if locked_until > now:
+            _stats.rejected += 1
+            return True
+    return False
+
+
+def _get_deadline(failures, threshold):
+    """
+    Returns the timestamp until which the counter which reached
+    the given number of consecutive failures is locked out.
+    """
+    if failures < threshold:
+        return None
+    # the lockout doubles at each failure past the threshold
+    backoff = app_settings.LOGIN_LOCKOUT_TIMEOUT * 2 ** min(failures - threshold, 32)
+    return time.time() + min(backoff, app_settings.LOGIN_LOCKOUT_MAX_TIMEOUT)
+
+
+def _increment(key):
+    # incr is atomic in the cache backends (Redis, Memcached, LocMem),
+    # hence concurrent failures are all counted
+    timeout = app_settings.LOGIN_LOCKOUT_MAX_TIMEOUT
+    try:
+        failures = cache.incr(key)
+    except ValueError:
+        # first failure or the counter has expired
+        if cache.add(key, 1, timeout):
+            return 1
+        failures = cache.incr(key)
+    # the failures are forgotten if no further failure is recorded
+    cache.touch(key, timeout)
+    return failures
+
+
+async def _aincrement(key):
+    timeout = app_settings.LOGIN_LOCKOUT_MAX_TIMEOUT
+    try:
+        failures = await cache.aincr(key)
+    except ValueError:
+        if await cache.aadd(key, 1, timeout):
+            return 1
+        failures = await cache.aincr(key)
+    await cache.atouch(key, timeout)
+    return failures
+
+
+def is_locked_out(identifier, request=None):
+    """
+    Returns ``True`` if either the identifier or the IP address
+    of the request is currently locked out.
+    """
+    thresholds = _get_thresholds(identifier, request)
+    if not thresholds:
+        return False
+    return _is_locked(cache.get_many(_get_deadline_keys(thresholds)))
+
+
+def record_login_failure(identifier, request=None):
+    thresholds = _get_thresholds(identifier, request)
+    if not thresholds:
+        return
+    _stats.failures += 1
+    deadlines = {}
+    for key, threshold in thresholds.items():
+        locked_until = _get_deadline(_increment(key), threshold)
+        if locked_until is not None:
+            deadlines[get_lockout_deadline_cache_key(key)] = locked_until
+    if deadlines:
+        cache.set_many(deadlines, app_settings.LOGIN_LOCKOUT_MAX_TIMEOUT)
+
+
+def record_login_success(identifier):
+    """
+    Resets the failures of the identifier, the counter of the IP address
+    is not reset because it may be shared by different users.
+    """
+    if app_settings.LOGIN_LOCKOUT_THRESHOLD:
+        key = get_lockout_cache_key(_IDENTIFIER, identifier)
+        cache.delete_many([key, get_lockout_deadline_cache_key(key)])
+
+
+async def ais_locked_out(identifier, request=None):
+    thresholds = _get_thresholds(identifier, request)
+    if not thresholds:
+        return False
+    return _is_locked(await cache.aget_many(_get_deadline_keys(thresholds)))
+
+
+async def arecord_login_failure(identifier, request=None):
+    thresholds = _get_thresholds(identifier, request)
+    if not thresholds:
+        return
+    _stats.failures += 1
+    deadlines = {}
+    for key, threshold in thresholds.items():
+        locked_until = _get_deadline(await _aincrement(key), threshold)
+        if locked_until is not None:
+            deadlines[get_lockout_deadline_cache_key(key)] = locked_until
+    if deadlines:
+        await cache.aset_many(deadlines, app_settings.LOGIN_LOCKOUT_MAX_TIMEOUT)
+
+
+async def arecord_login_success(identifier):
+    if app_settings.LOGIN_LOCKOUT_THRESHOLD:
+        key = get_lockout_cache_key(_IDENTIFIER, identifier)
+        await cache.adelete_many([key, get_lockout_deadline_cache_key(key)])
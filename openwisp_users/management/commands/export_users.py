@@ -19,8 +19,49 @@ def normalize_field(field):
     return {"name": field}
 
 
-class Command(BaseCommand):
-    help = _("Exports user data to a CSV file")
+class UserExporter:
+    """
+    Converts users to rows of strings (or of native values) according to
+    the field definitions of ``EXPORT_USERS_COMMAND_CONFIG``, used by the
+    ``export_users`` command and by the user export API endpoint.
+    """
+
+    def get_export_fields(self, exclude_fields=()):
+        """Returns the configured fields, excluding the given field names."""
+        return [
+            field
+            for field in app_settings.EXPORT_USERS_COMMAND_CONFIG.get("fields", [])
+            if normalize_field(field)["name"] not in exclude_fields
+        ]
+
+    def get_export_prefetch_related(self):
+        return app_settings.EXPORT_USERS_COMMAND_CONFIG.get("prefetch_related", [])
+
+    def get_export_queryset(self, queryset=None):
+        if queryset is None:
+            queryset = User.objects.all()
+        return (
+            queryset.select_related(
+                *app_settings.EXPORT_USERS_COMMAND_CONFIG.get("select_related", []),
+            )
+            .prefetch_related(*self.get_export_prefetch_related())
+            .order_by("date_joined")
+        )
+
+    def get_header_row(self, fields):
+        return [self._get_header(field) for field in fields]
+
+    def get_row(self, user, fields):
+        return [self._get_field_value(user, field) for field in fields]
+
+    def get_native_row(self, user, fields):
+        """
+        Returns the values of the fields without converting them to
+        strings: related objects are returned as dicts of their subfields,
+        querysets as lists and callables are replaced by ``native_callable``
+        when defined.
+        """
+        return [self._get_field_value(user, field, native=True) for field in fields]
 
     @staticmethod
     def _normalize_value(value):
@@ -38,68 +79,6 @@ class Command(BaseCommand):
             return f"{normalized['name']} ({', '.join(header_fields)})"
         return normalized["name"]
 
-    def add_arguments(self, parser):
-        parser.add_argument(
-            "--exclude-fields",
-            dest="exclude_fields",
-            default="",
-            help=_("Comma-separated list of fields to exclude from export"),
-        )
-        parser.add_argument(
-            "--filename",
-            dest="filename",
-            default="openwisp_exported_users.csv",
-            help=_(
-                "Filename for the exported CSV, defaults to"
-                ' "openwisp_exported_users.csv"'
-            ),
-        )
-
-    def handle(self, *args, **options):
-        raw_fields = app_settings.EXPORT_USERS_COMMAND_CONFIG.get("fields", [])
-        # Get the fields to be excluded from the command-line argument
-        exclude_fields = [
-            t.strip() for t in options.get("exclude_fields").split(",") if t.strip()
-        ]
-        # Remove excluded fields from the export fields (match on the field name)
-        fields = [
-            field
-            for field in raw_fields
-            if normalize_field(field)["name"] not in exclude_fields
-        ]
-        # Fetch all user data using select_related and prefetch_related
-        queryset = (
-            User.objects.select_related(
-                *app_settings.EXPORT_USERS_COMMAND_CONFIG.get("select_related", []),
-            )
-            .prefetch_related(
-                *app_settings.EXPORT_USERS_COMMAND_CONFIG.get("prefetch_related", []),
-            )
-            .order_by("date_joined")
-        )
-
-        # Prepare a CSV writer
-        filename = options.get("filename")
-        with open(filename, "w", newline="", encoding="utf-8") as csv_file:
-            csv_writer = csv.writer(csv_file)
-            # Write header row using the name of each field
-            csv_writer.writerow([self._get_header(f) for f in fields])
-
-            # Write data rows
-            for user in queryset.iterator(chunk_size=1000):
-                row = []
-                for field in fields:
-                    val = self._get_field_value(user, field)
-                    row.append(val)
-                csv_writer.writerow(row)
-        self.stdout.write(
-            self.style.SUCCESS(
-                _("User data exported successfully to {filename}!").format(
-                    filename=filename
-                )
-            )
-        )
-
     def _format_rows(self, rows):
         """Format rows into a cell string.
 
@@ -114,8 +93,13 @@ class Command(BaseCommand):
             return f"({values})" if len(rows) > 1 else values
         return "\n".join("(" + ",".join(row) + ")" for row in rows)
 
-    def serialize_related(self, manager, subfields):
+    def serialize_related(self, manager, subfields, native=False):
         """Serialize a RelatedManager queryset using the given subfields."""
+        if native:
+            return [
+                {f: self._get_nested_attr(obj, f, native) for f in subfields}
+                for obj in manager.all()
+            ]
         rows = []
         # We use manager.all() instead of manager.iterator() to utilize the
         # prefetch_related queryset cache. The iterator() method would bypass the cache
@@ -129,7 +113,7 @@ class Command(BaseCommand):
             rows.append(row)
         return self._format_rows(rows)
 
-    def _get_nested_attr(self, obj, attr_path):
+    def _get_nested_attr(self, obj, attr_path, native=False):
         """Resolve a dotted attribute path on an object.
 
         Returns the resolved value or None when an intermediate attribute
@@ -154,17 +138,21 @@ class Command(BaseCommand):
                 # We use current.all() instead of current.iterator() to utilize
                 # the prefetch_related queryset cache. The iterator() method
                 # would bypass the cache and cause additional queries.
-                rows = []
-                for item in current.all():
-                    v = self._get_nested_attr(item, remaining_path)
-                    rows.append([self._normalize_value(v)])
-                return self._format_rows(rows)
+                values = [
+                    self._get_nested_attr(item, remaining_path, native)
+                    for item in current.all()
+                ]
+                if native:
+                    return values
+                return self._format_rows([[self._normalize_value(v)] for v in values])
         return current
 
-    def _get_field_value(self, user, field):
+    def _get_field_value(self, user, field, native=False):
         normalized = normalize_field(field)
         name = normalized["name"]
         callable_fn = normalized.get("callable")
+        if native and normalized.get("native_callable") is not None:
+            callable_fn = normalized["native_callable"]
         subfields = normalized.get("fields")
         # Priority: callable > fields > name
         if callable_fn is not None:
@@ -180,18 +168,69 @@ class Command(BaseCommand):
                         "Error calling function {func_name!r} for field '{name}': {e}"
                     ).format(func_name=func_name, name=name, e=e)
                 )
-            return self._normalize_value(val)
+            return val if native else self._normalize_value(val)
         if subfields is not None:
-            attr = self._get_nested_attr(user, name)
+            attr = self._get_nested_attr(user, name, native)
             if attr is None:
-                return ""
+                return None if native else ""
             if isinstance(attr, (QuerySet, BaseManager)):
-                return self.serialize_related(attr, subfields)
+                return self.serialize_related(attr, subfields, native)
+            if native:
+                return {f: self._get_nested_attr(attr, f, native) for f in subfields}
             row = [
                 self._normalize_value(self._get_nested_attr(attr, f)) for f in subfields
             ]
             return self._format_rows([row])
-        val = self._get_nested_attr(user, name)
+        val = self._get_nested_attr(user, name, native)
         if isinstance(val, (QuerySet, BaseManager)):
-            return ""
-        return self._normalize_value(val)
+            return None if native else ""
+        return val if native else self._normalize_value(val)
+
+
+class Command(UserExporter, BaseCommand):
+    help = _("Exports user data to a CSV file")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--exclude-fields",
+            dest="exclude_fields",
+            default="",
+            help=_("Comma-separated list of fields to exclude from export"),
+        )
+        parser.add_argument(
+            "--filename",
+            dest="filename",
+            default="openwisp_exported_users.csv",
+            help=_(
+                "Filename for the exported CSV, defaults to"
+                ' "openwisp_exported_users.csv"'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        # Get the fields to be excluded from the command-line argument
+        exclude_fields = [
+            t.strip() for t in options.get("exclude_fields").split(",") if t.strip()
+        ]
+        # Remove excluded fields from the export fields (match on the field name)
+        fields = self.get_export_fields(exclude_fields)
+        # Fetch all user data using select_related and prefetch_related
+        queryset = self.get_export_queryset()
+
+        # Prepare a CSV writer
+        filename = options.get("filename")
+        with open(filename, "w", newline="", encoding="utf-8") as csv_file:
+            csv_writer = csv.writer(csv_file)
+            # Write header row using the name of each field
+            csv_writer.writerow(self.get_header_row(fields))
+
+            # Write data rows
+            for user in queryset.iterator(chunk_size=1000):
+                csv_writer.writerow(self.get_row(user, fields))
+        self.stdout.write(
+            self.style.SUCCESS(
+                _("User data exported successfully to {filename}!").format(
+                    filename=filename
+                )
+            )
+        )
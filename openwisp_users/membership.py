@@ -0,0 +1,870 @@
+"""
+Helpers used to cache the organization membership data of users,
+see ``AbstractUser.organizations_dict``.
+"""
+
+import asyncio
+import math
+import random
+import threading
+import time
+import uuid
+import weakref
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import partial
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.functional import cached_property
+from swapper import load_model
+
+from . import settings as app_settings
+from .local_cache import LocalCache, get_hit_ratio, load_channel
+
+MEMBERSHIP_CACHE_TIMEOUT = 86400 * 2  # two days
+# Global membership epoch: every cached membership entry is stamped
+# with the epoch which was current when the entry was computed.
+# Changing the epoch invalidates all the entries at once (lazily,
+# on the next read), which makes operations affecting the members
+# of an entire organization (eg: disabling it) cost one cache write.
+MEMBERSHIP_EPOCH_CACHE_KEY = "openwisp_users_membership_epoch"
+# Rebuilding the cache of a user is single-flight: only the process
+# holding the lock queries the database while the other processes
+# are served the stale entry (if any) or wait for the new one.
+MEMBERSHIP_LOCK_TIMEOUT = 10
+MEMBERSHIP_LOCK_WAIT = 0.5
+_LOCK_WAIT_INTERVAL = 0.05
+# Entries are refreshed before they expire with a probability which
+# increases as the expiration approaches, proportionally to the time
+# needed to compute them ("XFetch" algorithm), so that hot entries
+# never expire. Higher values cause earlier refreshes.
+MEMBERSHIP_EARLY_REFRESH_BETA = 1
+# Incremented every time the membership cache of any user is invalidated
+# by this process, it allows detecting stale memos stored on user
+# instances (see ``AbstractUser._organizations_memo``), including
+# instances which are different from the one which triggered the change.
+_local_version = 0
+
+
+ROLE_ADMIN = 1
+ROLE_OWNER = 2
+_UUID_SIZE = 16
+
+
+def _get_role(options):
+    return (ROLE_ADMIN if options["is_admin"] else 0) | (
+        ROLE_OWNER if options["is_owner"] else 0
+    )
+
+
+class _PackedUUIDs:
+    """
+    Sequence view of UUIDs packed in a bytes object, used for bisect lookups.
+    """
+
+    __slots__ = ("data", "count")
+
+    def __init__(self, data, count):
+        self.data = data
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        start = index * _UUID_SIZE
+        return self.data[start : start + _UUID_SIZE]
+
+
+class CompactOrganizations:
+    """
+    Compact representation of an organizations dict, enabled with the
+    ``OPENWISP_USERS_MEMBERSHIP_CACHE_COMPACT`` setting.
+
+    The data is a single bytes object containing the sorted 16-byte
+    primary keys of the organizations, followed by one role bitmask
+    byte per organization, which is much smaller than a pickled dict
+    and is looked up with a binary search without building any dict.
+    """
+
+    __slots__ = ("data", "_keys")
+
+    def __init__(self, data):
+        self.data = data
+        self._keys = _PackedUUIDs(data, len(data) // (_UUID_SIZE + 1))
+
+    @classmethod
+    def from_dict(cls, organizations):
+        items = sorted(
+            (uuid.UUID(org_pk).bytes, _get_role(options))
+            for org_pk, options in organizations.items()
+        )
+        return cls(
+            b"".join(key for key, role in items) + bytes(role for key, role in items)
+        )
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get_role(self, org_pk):
+        """
+        Returns the role bitmask of the organization, ``None`` if the
+        user is not a member of the organization.
+        """
+        try:
+            key = uuid.UUID(org_pk).bytes
+        except (TypeError, ValueError):
+            return None
+        keys = self._keys
+        index = bisect_left(keys, key)
+        if index == len(keys) or keys[index] != key:
+            return None
+        return self.data[len(keys) * _UUID_SIZE + index]
+
+    def items(self):
+        """
+        Yields the primary key and role bitmask of each organization.
+        """
+        keys = self._keys
+        roles = self.data[len(keys) * _UUID_SIZE :]
+        for index, role in enumerate(roles):
+            yield str(uuid.UUID(bytes=keys[index])), role
+
+    def to_dict(self):
+        return {
+            org_pk: {
+                "is_admin": bool(role & ROLE_ADMIN),
+                "is_owner": bool(role & ROLE_OWNER),
+            }
+            for org_pk, role in self.items()
+        }
+
+
+class OrganizationsMemo:
+    """
+    Request scoped view of the membership data of a user, see
+    ``AbstractUser._organizations_memo``. The primary keys of the
+    organizations are grouped by role in frozensets, which allow
+    constant time lookups.
+    """
+
+    def __init__(self, organizations, version):
+        self.version = version
+        self.organizations = organizations
+
+    @cached_property
+    def managed_pks(self):
+        return tuple(
+            org_pk
+            for org_pk, options in self.organizations.items()
+            if options["is_admin"]
+        )
+
+    @cached_property
+    def owned_pks(self):
+        return tuple(
+            org_pk
+            for org_pk, options in self.organizations.items()
+            if options["is_owner"]
+        )
+
+    @cached_property
+    def _managed(self):
+        return frozenset(self.managed_pks)
+
+    @cached_property
+    def _owned(self):
+        return frozenset(self.owned_pks)
+
+    def is_member(self, org_pk):
+        return org_pk in self.organizations
+
+    def is_manager(self, org_pk):
+        return org_pk in self._managed or org_pk in self._owned
+
+    def is_owner(self, org_pk):
+        return org_pk in self._owned
+
+
+class CompactOrganizationsMemo(OrganizationsMemo):
+    """
+    Queries ``CompactOrganizations`` directly, the organizations dict
+    is built only if it's explicitly requested.
+    """
+
+    def __init__(self, compact, version):
+        self.version = version
+        self.compact = compact
+        self._roles = {}
+
+    @cached_property
+    def organizations(self):
+        return self.compact.to_dict()
+
+    @cached_property
+    def managed_pks(self):
+        return tuple(
+            org_pk for org_pk, role in self.compact.items() if role & ROLE_ADMIN
+        )
+
+    @cached_property
+    def owned_pks(self):
+        return tuple(
+            org_pk for org_pk, role in self.compact.items() if role & ROLE_OWNER
+        )
+
+    def _get_role(self, org_pk):
+        try:
+            return self._roles[org_pk]
+        except KeyError:
+            role = self._roles[org_pk] = self.compact.get_role(org_pk)
+            return role
+
+    def is_member(self, org_pk):
+        return self._get_role(org_pk) is not None
+
+    def is_manager(self, org_pk):
+        return bool(self._get_role(org_pk))
+
+    def is_owner(self, org_pk):
+        return bool((self._get_role(org_pk) or 0) & ROLE_OWNER)
+
+
+def build_organizations_memo(organizations, version):
+    if isinstance(organizations, CompactOrganizations):
+        return CompactOrganizationsMemo(organizations, version)
+    return OrganizationsMemo(organizations, version)
+
+
+def get_local_version():
+    return _local_version
+
+
+def bump_local_version():
+    global _local_version
+    _local_version += 1
+
+
+_local_cache = None
+
+
+def get_local_cache():
+    """
+    Returns the in-process tier of the membership cache, which is
+    checked before the Django cache (``None`` if it's disabled), see
+    ``OPENWISP_USERS_MEMBERSHIP_LOCAL_CACHE_SIZE``.
+    """
+    global _local_cache
+    if not app_settings.MEMBERSHIP_LOCAL_CACHE_SIZE:
+        return None
+    if _local_cache is None:
+        channel = load_channel(app_settings.MEMBERSHIP_INVALIDATION_CHANNEL)
+        # the workers running on other hosts would keep
+        # using revoked memberships until their entries expire
+        if not channel.cross_host:
+            raise ImproperlyConfigured(
+                "OPENWISP_USERS_MEMBERSHIP_LOCAL_CACHE_SIZE requires an "
+                "invalidation channel which reaches the processes of every "
+                "host, eg: CacheChannel using a Redis or Memcached cache."
+            )
+        _local_cache = LocalCache(
+            maxsize=app_settings.MEMBERSHIP_LOCAL_CACHE_SIZE,
+            timeout=app_settings.MEMBERSHIP_LOCAL_CACHE_TIMEOUT,
+            channel=channel,
+            on_invalidate=bump_local_version,
+        )
+    return _local_cache
+
+
+class _ReadOnlyDict(dict):
+    """
+    Dict which can't be changed, the organizations stored in the local
+    cache are shared by all the threads of the process, hence a change
+    made while processing a request would affect the other requests.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("The cached organizations can't be changed.")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+def _freeze(organizations):
+    if not isinstance(organizations, dict):
+        # CompactOrganizations is immutable
+        return organizations
+    return _ReadOnlyDict(
+        (org_pk, _ReadOnlyDict(options)) for org_pk, options in organizations.items()
+    )
+
+
+def _set_local(local_cache, user_pk, organizations, generation=None):
+    local_cache.set(user_pk, _freeze(organizations), generation)
+
+
+class _CacheStats:
+    hits = 0
+    misses = 0
+
+
+_remote_stats = _CacheStats()
+
+
+def get_membership_cache_stats():
+    """
+    Returns the hits, misses and hit ratio of each tier of
+    the membership cache, counted by the current process.
+    """
+    local_cache = get_local_cache()
+    return {
+        "local": local_cache.get_stats() if local_cache else None,
+        "remote": {
+            "hits": _remote_stats.hits,
+            "misses": _remote_stats.misses,
+            "hit_ratio": get_hit_ratio(_remote_stats.hits, _remote_stats.misses),
+        },
+    }
+
+
+def get_user_cache_key(user_pk):
+    return f"user_{user_pk}_organizations"
+
+
+def _new_epoch():
+    # random values are used instead of a counter because if the epoch
+    # is evicted from the cache, a restarted counter could match the
+    # stamp of stale entries
+    return uuid.uuid4().hex
+
+
+def get_membership_epoch():
+    epoch = cache.get(MEMBERSHIP_EPOCH_CACHE_KEY)
+    if epoch is None:
+        epoch = init_membership_epoch()
+    return epoch
+
+
+def init_membership_epoch():
+    """
+    Initializes the membership epoch if it's missing from the cache
+    and returns its current value.
+    """
+    cache.add(MEMBERSHIP_EPOCH_CACHE_KEY, _new_epoch(), None)
+    return cache.get(MEMBERSHIP_EPOCH_CACHE_KEY)
+
+
+async def aget_membership_epoch():
+    epoch = await cache.aget(MEMBERSHIP_EPOCH_CACHE_KEY)
+    if epoch is None:
+        await cache.aadd(MEMBERSHIP_EPOCH_CACHE_KEY, _new_epoch(), None)
+        epoch = await cache.aget(MEMBERSHIP_EPOCH_CACHE_KEY)
+    return epoch
+
+
+def bump_membership_epoch():
+    """
+    Invalidates the membership cache of all users.
+    """
+    cache.set(MEMBERSHIP_EPOCH_CACHE_KEY, _new_epoch(), None)
+    local_cache = get_local_cache()
+    if local_cache:
+        local_cache.clear()
+    bump_local_version()
+
+
+def _invalidate_local(user_pks):
+    local_cache = get_local_cache()
+    if local_cache:
+        local_cache.delete_many(user_pks)
+
+
+def _encode(organizations):
+    if app_settings.MEMBERSHIP_CACHE_COMPACT:
+        return CompactOrganizations.from_dict(organizations).data
+    return organizations
+
+
+def _decode(entry, epoch, stale=False):
+    """
+    Returns the organizations stored in ``entry`` or ``None`` if the
+    entry has been invalidated by an epoch change, unless ``stale``
+    is ``True``.
+    """
+    # entries stored by older versions are plain dicts: treat them as misses
+    if not isinstance(entry, tuple) or (entry[0] != epoch and not stale):
+        return None
+    if isinstance(entry[1], bytes):
+        return CompactOrganizations(entry[1])
+    return entry[1]
+
+
+def _make_entry(organizations, epoch, delta):
+    # ``delta`` is the time spent computing the entry
+    expires = time.time() + MEMBERSHIP_CACHE_TIMEOUT
+    return (epoch, _encode(organizations), expires, delta)
+
+
+def _should_refresh_early(entry):
+    if len(entry) < 4:
+        return False
+    expires, delta = entry[2], entry[3]
+    # 1 - random() is never 0
+    jitter = -math.log(1 - random.random())
+    return time.time() + delta * MEMBERSHIP_EARLY_REFRESH_BETA * jitter >= expires
+
+
+def _get_remote_entry(user_pk):
+    values = cache.get_many([get_user_cache_key(user_pk), MEMBERSHIP_EPOCH_CACHE_KEY])
+    return values.get(get_user_cache_key(user_pk)), values.get(
+        MEMBERSHIP_EPOCH_CACHE_KEY
+    )
+
+
+async def _aget_remote_entry(user_pk):
+    values = await cache.aget_many(
+        [get_user_cache_key(user_pk), MEMBERSHIP_EPOCH_CACHE_KEY]
+    )
+    return values.get(get_user_cache_key(user_pk)), values.get(
+        MEMBERSHIP_EPOCH_CACHE_KEY
+    )
+
+
+def get_cached_organizations(user_pk):
+    """
+    Returns the cached organizations of the user (a dict or a
+    ``CompactOrganizations`` instance) or ``None`` if the entry
+    is missing or has been invalidated by an epoch change.
+    The membership epoch is read within the same cache round trip.
+    """
+    organizations, _ = _get_cached_entry(user_pk)
+    return organizations
+
+
+def _get_cached_entry(user_pk):
+    """
+    Returns the cached organizations of the user (``None`` if
+    not found) and the entry read from the Django cache (``None``
+    if they've been read from the local cache).
+    """
+    organizations, generation = _get_local_entry(user_pk)
+    if organizations is not None:
+        return organizations, None
+    entry, epoch = _get_remote_entry(user_pk)
+    return _process_remote_entry(user_pk, entry, epoch, generation), entry
+
+
+async def _aget_cached_entry(user_pk):
+    organizations, generation = _get_local_entry(user_pk)
+    if organizations is not None:
+        return organizations, None
+    entry, epoch = await _aget_remote_entry(user_pk)
+    return _process_remote_entry(user_pk, entry, epoch, generation), entry
+
+
+def _get_local_entry(user_pk):
+    """
+    Returns the organizations of the user found in the local cache
+    (if any) and the generation of the local cache, which must be
+    read before reading the Django cache (see ``LocalCache.set``).
+    """
+    local_cache = get_local_cache()
+    if not local_cache:
+        return None, None
+    return local_cache.get(user_pk), local_cache.generation
+
+
+def _process_remote_entry(user_pk, entry, epoch, generation):
+    organizations = _decode(entry, epoch) if epoch is not None else None
+    if organizations is None:
+        _remote_stats.misses += 1
+        return None
+    _remote_stats.hits += 1
+    local_cache = get_local_cache()
+    if local_cache:
+        _set_local(local_cache, user_pk, organizations, generation)
+    return organizations
+
+
+def get_organizations(user_pk):
+    """
+    Returns the organizations of the user, which are loaded from
+    the database and cached if they're not found in the cache.
+
+    Only one process at a time (the one which acquires a short lived
+    lock) queries the database for the same user, the others are
+    served the stale entry (if it has been invalidated by an epoch
+    change) or wait for the new entry for at most
+    ``MEMBERSHIP_LOCK_WAIT`` seconds, after which they give up
+    waiting and query the database as well.
+    """
+    organizations, entry = _get_cached_entry(user_pk)
+    if organizations is not None and (
+        entry is None or not _should_refresh_early(entry)
+    ):
+        return organizations
+    lock_key = f"{get_user_cache_key(user_pk)}_lock"
+    if cache.add(lock_key, True, MEMBERSHIP_LOCK_TIMEOUT):
+        try:
+            return _load_and_cache_organizations(user_pk)
+        finally:
+            cache.delete(lock_key)
+    # another process is rebuilding the entry
+    if organizations is None:
+        organizations = _decode(entry, None, stale=True)
+    if organizations is None:
+        organizations = _wait_for_organizations(user_pk)
+    if organizations is None:
+        organizations = _load_and_cache_organizations(user_pk)
+    return organizations
+
+
+async def aget_organizations(user_pk):
+    """
+    Async version of ``get_organizations``, which uses the async
+    APIs of the Django cache and ORM, hence it can be awaited
+    in async views and consumers without blocking the event loop.
+    """
+    organizations, entry = await _aget_cached_entry(user_pk)
+    if organizations is not None and (
+        entry is None or not _should_refresh_early(entry)
+    ):
+        return organizations
+    lock_key = f"{get_user_cache_key(user_pk)}_lock"
+    if await cache.aadd(lock_key, True, MEMBERSHIP_LOCK_TIMEOUT):
+        try:
+            return await _aload_and_cache_organizations(user_pk)
+        finally:
+            await cache.adelete(lock_key)
+    if organizations is None:
+        organizations = _decode(entry, None, stale=True)
+    if organizations is None:
+        organizations = await _await_organizations(user_pk)
+    if organizations is None:
+        organizations = await _aload_and_cache_organizations(user_pk)
+    return organizations
+
+
+def _wait_for_organizations(user_pk):
+    for _ in range(int(MEMBERSHIP_LOCK_WAIT / _LOCK_WAIT_INTERVAL)):
+        time.sleep(_LOCK_WAIT_INTERVAL)
+        entry, epoch = _get_remote_entry(user_pk)
+        organizations = _decode(entry, epoch) if epoch is not None else None
+        if organizations is not None:
+            return organizations
+    return None
+
+
+async def _await_organizations(user_pk):
+    for _ in range(int(MEMBERSHIP_LOCK_WAIT / _LOCK_WAIT_INTERVAL)):
+        await asyncio.sleep(_LOCK_WAIT_INTERVAL)
+        entry, epoch = await _aget_remote_entry(user_pk)
+        organizations = _decode(entry, epoch) if epoch is not None else None
+        if organizations is not None:
+            return organizations
+    return None
+
+
+def _load_and_cache_organizations(user_pk):
+    # the epoch must be read before querying the database
+    epoch = get_membership_epoch()
+    start = time.monotonic()
+    organizations = load_organizations([user_pk])[user_pk]
+    set_cached_organizations(
+        user_pk, organizations, epoch, delta=time.monotonic() - start
+    )
+    return organizations
+
+
+async def _aload_and_cache_organizations(user_pk):
+    epoch = await aget_membership_epoch()
+    start = time.monotonic()
+    organizations = (await aload_organizations([user_pk]))[user_pk]
+    await aset_cached_organizations(
+        user_pk, organizations, epoch, delta=time.monotonic() - start
+    )
+    return organizations
+
+
+def get_many_cached_organizations(user_pks):
+    """
+    Bulk version of ``get_cached_organizations``: returns a dict which
+    maps the primary keys of the users found in the cache to their
+    organizations and the current membership epoch (``None`` if
+    missing or if all the users are found in the local cache),
+    all read within a single cache round trip.
+    """
+    found = {}
+    local_cache = get_local_cache()
+    if local_cache:
+        for user_pk in user_pks:
+            organizations = local_cache.get(user_pk)
+            if organizations is not None:
+                found[user_pk] = organizations
+        if len(found) == len(user_pks):
+            return found, None
+        generation = local_cache.generation
+    keys = {
+        get_user_cache_key(user_pk): user_pk
+        for user_pk in user_pks
+        if user_pk not in found
+    }
+    values = cache.get_many(list(keys) + [MEMBERSHIP_EPOCH_CACHE_KEY])
+    epoch = values.pop(MEMBERSHIP_EPOCH_CACHE_KEY, None)
+    if epoch is None:
+        _remote_stats.misses += len(keys)
+        return found, epoch
+    hits = 0
+    for key, entry in values.items():
+        organizations = _decode(entry, epoch)
+        if organizations is None:
+            continue
+        found[keys[key]] = organizations
+        if local_cache:
+            _set_local(local_cache, keys[key], organizations, generation)
+        hits += 1
+    _remote_stats.hits += hits
+    _remote_stats.misses += len(keys) - hits
+    return found, epoch
+
+
+def set_cached_organizations(user_pk, organizations, epoch, delta=0):
+    """
+    Stores the organizations dict of the user stamped with ``epoch``,
+    which must be read before querying the database, so that entries
+    computed concurrently with an epoch change are detected as stale.
+    """
+    _discard_invalidated([user_pk])
+    cache.set(
+        get_user_cache_key(user_pk),
+        _make_entry(organizations, epoch, delta),
+        MEMBERSHIP_CACHE_TIMEOUT,
+    )
+    local_cache = get_local_cache()
+    if local_cache:
+        _set_local(local_cache, user_pk, organizations)
+
+
+async def aset_cached_organizations(user_pk, organizations, epoch, delta=0):
+    _discard_invalidated([user_pk])
+    await cache.aset(
+        get_user_cache_key(user_pk),
+        _make_entry(organizations, epoch, delta),
+        MEMBERSHIP_CACHE_TIMEOUT,
+    )
+    local_cache = get_local_cache()
+    if local_cache:
+        _set_local(local_cache, user_pk, organizations)
+
+
+def set_many_cached_organizations(organizations_by_user, epoch, delta=0):
+    _discard_invalidated(organizations_by_user)
+    cache.set_many(
+        {
+            get_user_cache_key(user_pk): _make_entry(organizations, epoch, delta)
+            for user_pk, organizations in organizations_by_user.items()
+        },
+        MEMBERSHIP_CACHE_TIMEOUT,
+    )
+    local_cache = get_local_cache()
+    if local_cache:
+        for user_pk, organizations in organizations_by_user.items():
+            _set_local(local_cache, user_pk, organizations)
+
+
+def load_organizations(user_pks):
+    """
+    Builds the organizations dict of the users from the database
+    with a single query, returns a dict which maps the primary
+    keys of the users to their organizations dict.
+    """
+    organizations_by_user = {user_pk: {} for user_pk in user_pks}
+    for row in _get_organization_rows(organizations_by_user.keys()):
+        _add_organization_row(organizations_by_user, *row)
+    return organizations_by_user
+
+
+async def aload_organizations(user_pks):
+    organizations_by_user = {user_pk: {} for user_pk in user_pks}
+    async for row in _get_organization_rows(organizations_by_user.keys()):
+        _add_organization_row(organizations_by_user, *row)
+    return organizations_by_user
+
+
+def _get_organization_rows(user_pks):
+    OrganizationUser = load_model("openwisp_users", "OrganizationUser")
+    return OrganizationUser.objects.filter(
+        user_id__in=list(user_pks), organization__is_active=True
+    ).values_list("user_id", "organization_id", "is_admin", "organizationowner")
+
+
+def _add_organization_row(organizations_by_user, user_pk, org_pk, is_admin, owner_pk):
+    organizations_by_user[user_pk][str(org_pk)] = {
+        "is_admin": is_admin,
+        "is_owner": owner_pk is not None,
+    }
+
+
+def delete_cached_organizations(user_pk):
+    cache.delete(get_user_cache_key(user_pk))
+    _invalidate_local([user_pk])
+    bump_local_version()
+
+
+def delete_many_cached_organizations(user_pks):
+    cache.delete_many([get_user_cache_key(user_pk) for user_pk in user_pks])
+    _invalidate_local(user_pks)
+    bump_local_version()
+
+
+def rebuild_cached_organizations(user_pks, batch_size=1000):
+    """
+    Rebuilds the cached organizations of the users with one query
+    and one cache round trip for each batch of users.
+    """
+    user_pks = list(user_pks)
+    if not user_pks:
+        return
+    epoch = get_membership_epoch()
+    for index in range(0, len(user_pks), batch_size):
+        batch = user_pks[index : index + batch_size]
+        start = time.monotonic()
+        organizations_by_user = load_organizations(batch)
+        delta = time.monotonic() - start
+        set_many_cached_organizations(organizations_by_user, epoch, delta)
+    # the local cache of the other processes may still contain stale data
+    _invalidate_local(user_pks)
+    bump_local_version()
+
+
+class _PendingRebuild(set):
+    """
+    Users changed within the current transaction of a database, whose
+    cache is rebuilt once the transaction is committed.
+
+    Only its ``on_commit`` callback references it strongly: when the
+    transaction is rolled back the callback is discarded, along with
+    the users changed within the transaction.
+
+    ``invalidated`` contains the users whose entry has been deleted and
+    not cached again since, whose further changes within the transaction
+    don't need to delete it again.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.invalidated = set()
+
+
+class _PendingRebuilds(threading.local):
+    # weak references to the pending rebuild of each database alias
+    def __init__(self):
+        self.refs = {}
+
+
+_pending = _PendingRebuilds()
+
+
+def _get_pending_rebuild(using):
+    ref = _pending.refs.get(using)
+    pending = ref() if ref is not None else None
+    if pending is None:
+        pending = _PendingRebuild()
+        _pending.refs[using] = weakref.ref(pending)
+        transaction.on_commit(partial(_rebuild_pending, using, pending), using=using)
+    return pending
+
+
+def _discard_invalidated(user_pks):
+    # the entries cached again (eg: read within the transaction)
+    # must be deleted again by the next change of the users
+    for ref in list(_pending.refs.values()):
+        pending = ref()
+        if pending and pending.invalidated:
+            pending.invalidated.difference_update(user_pks)
+
+
+def _rebuild_pending(using, pending):
+    ref = _pending.refs.get(using)
+    if ref is not None and ref() is pending:
+        del _pending.refs[using]
+    user_pks = set(pending)
+    # callbacks executed by ``TestCase.captureOnCommitCallbacks``
+    # are executed again if the transaction is committed
+    pending.clear()
+    pending.invalidated.clear()
+    if user_pks:
+        rebuild_cached_organizations(user_pks)
+
+
+class _BulkChanges(threading.local):
+    # users whose membership changed within bulk_membership_changes()
+    user_pks = None
+
+
+_bulk = _BulkChanges()
+
+
+def invalidate_user_organizations(user_pk, using=None):
+    """
+    Called when the membership of a user changes: the cache of the
+    user is invalidated right away, while rebuilding it is deferred
+    until the transaction is committed (otherwise concurrent requests
+    could cache data which is not committed yet), when the cache of
+    all the users changed within the transaction is rebuilt at once.
+    Multiple changes affecting the same user within a transaction cause
+    a single invalidation and a single rebuild.
+    """
+    if _bulk.user_pks is not None:
+        _bulk.user_pks.add(user_pk)
+        return
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        rebuild_cached_organizations([user_pk])
+        return
+    pending = _get_pending_rebuild(connection.alias)
+    pending.add(user_pk)
+    if user_pk in pending.invalidated:
+        # the entry hasn't been cached again since it was
+        # deleted, only the memos need to be discarded
+        bump_local_version()
+        return
+    pending.invalidated.add(user_pk)
+    delete_cached_organizations(user_pk)
+
+
+@contextmanager
+def bulk_membership_changes(rebuild=True, using=None):
+    """
+    Context manager which defers the invalidation of the membership
+    cache of the users affected by the changes performed within the
+    block (eg: importing memberships) until the block is exited.
+
+    The cache of all the affected users is then invalidated at once
+    and, if ``rebuild`` is ``True``, rebuilt in batches after the
+    transaction is committed (or right away outside transactions),
+    otherwise the cache is rebuilt lazily when it's read.
+
+    The membership data read within the block may be stale.
+    """
+    if _bulk.user_pks is not None:
+        # nested blocks are handled by the outermost one
+        yield
+        return
+    _bulk.user_pks = set()
+    try:
+        yield
+    finally:
+        user_pks = _bulk.user_pks
+        _bulk.user_pks = None
+        if user_pks:
+            delete_many_cached_organizations(user_pks)
+            if rebuild:
+                transaction.on_commit(
+                    partial(rebuild_cached_organizations, user_pks), using=using
+                )
@@ -1,19 +1,23 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.contrib import messages
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.contrib.auth import SESSION_KEY as AUTH_SESSION_KEY
+from django.contrib.auth import get_user
 from django.shortcuts import redirect
-from django.urls import resolve, reverse_lazy
+from django.urls import URLResolver, get_resolver, resolve, reverse_lazy
 from django.urls.exceptions import Resolver404
+from django.utils.functional import SimpleLazyObject, cached_property
 from django.utils.translation import gettext_lazy as _
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from . import settings as app_settings
 from .api.authentication import BearerAuthentication
 from .auth import (
     ACCOUNT_CHANGE_PASSWORD_PATH,
     API_PASSWORD_CHANGE_URL_NAME,
-    is_password_based_login,
+    is_expired_password_session,
     password_expired_response_payload,
 )
 
@@ -45,73 +49,149 @@ class PasswordExpirationMiddleware:
     admin_login_path = reverse_lazy("admin:login")
     admin_index_path = reverse_lazy("admin:index")
 
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self._exempted_url_names = frozenset(self.exempted_url_names)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not is_password_expiration_enabled():
+            return self.get_response(request)
         session_authenticated_before = AUTH_SESSION_KEY in request.session
         if (
             session_authenticated_before
-            and self._is_expired_password_session(request)
+            and self._is_expired_password_session(request, request.user)
             and not self._is_bearer_api_request(request)
         ):
-            blocked = self._blocked_response(request)
+            blocked = self._blocked_response(request, request.user)
             if blocked is not None:
                 return blocked
         response = self.get_response(request)
         if (
             not session_authenticated_before
             and AUTH_SESSION_KEY in request.session
-            and self._is_expired_password_session(request)
+            and self._is_expired_password_session(request, request.user)
         ):
-            blocked = self._blocked_response(request)
+            blocked = self._blocked_response(request, request.user)
             if blocked is not None:
                 return blocked
         return response
 
-    def _is_bearer_api_request(self, request):
+    async def __acall__(self, request):
+        """
+        Async version of ``__call__``, used in ASGI deployments: the
+        session and the user are loaded with the async APIs of Django,
+        which avoids running the middleware in a worker thread.
+        """
+        if not is_password_expiration_enabled():
+            return await self.get_response(request)
+        session_authenticated_before = await _ahas_session_key(request)
+        if session_authenticated_before:
+            user = await _aget_user(request)
+            if self._is_expired_password_session(
+                request, user
+            ) and not self._is_bearer_api_request(request):
+                blocked = self._blocked_response(request, user)
+                if blocked is not None:
+                    return blocked
+        response = await self.get_response(request)
+        if not session_authenticated_before and await _ahas_session_key(request):
+            user = await _aget_user(request)
+            if self._is_expired_password_session(request, user):
+                blocked = self._blocked_response(request, user)
+                if blocked is not None:
+                    return blocked
+        return response
+
+    def _resolve(self, request):
+        """
+        Resolves the path of the request once, the result
+        is reused by the checks performed by the middleware.
+        """
         try:
-            resolver_match = resolve(request.path_info)
+            return request._password_expiration_resolver_match
+        except AttributeError:
+            pass
+        try:
+            resolver_match = resolve(
+                request.path_info, getattr(request, "urlconf", None)
+            )
         except Resolver404:
-            return False
-        view_class = getattr(resolver_match.func, "cls", None)
-        if view_class is None or not issubclass(view_class, APIView):
-            return False
-        authorization = request.headers.get("Authorization", "")
+            resolver_match = None
+        request._password_expiration_resolver_match = resolver_match
+        return resolver_match
+
+    @cached_property
+    def _bearer_view_classes(self):
+        """
+        Returns two frozensets, collected once per process: the APIView
+        classes of the URLconf supporting Bearer authentication and all
+        the APIView classes of the URLconf.
+        """
+        api_views = frozenset(
+            view_class
+            for view_class in _get_view_classes(get_resolver().url_patterns)
+            if issubclass(view_class, APIView)
+        )
+        bearer_views = frozenset(
+            view_class
+            for view_class in api_views
+            if BearerAuthentication in view_class.authentication_classes
+        )
+        return bearer_views, api_views
+
+    def _supports_bearer_authentication(self, view_class):
+        bearer_views, api_views = self._bearer_view_classes
+        if view_class in api_views:
+            return view_class in bearer_views
+        # views which are not included in the default URLconf
         return (
-            authorization.lower().startswith("bearer ")
+            issubclass(view_class, APIView)
             and BearerAuthentication in view_class.authentication_classes
         )
 
-    def _is_expired_password_session(self, request):
-        return (
-            request.user.is_authenticated
-            and request.user.has_password_expired()
-            and is_password_based_login(request)
+    def _is_bearer_api_request(self, request):
+        authorization = request.headers.get("Authorization", "")
+        if not authorization.lower().startswith("bearer "):
+            return False
+        resolver_match = self._resolve(request)
+        if resolver_match is None:
+            return False
+        view_class = getattr(resolver_match.func, "cls", None)
+        return view_class is not None and self._supports_bearer_authentication(
+            view_class
         )
 
-    def _blocked_response(self, request):
-        try:
-            resolver_match = resolve(request.path_info)
-        except Resolver404:
+    def _is_expired_password_session(self, request, user):
+        return user.is_authenticated and is_expired_password_session(request, user)
+
+    def _blocked_response(self, request, user):
+        resolver_match = self._resolve(request)
+        if resolver_match is None:
             return None
         if (
-            resolver_match.url_name in self.exempted_url_names
-            or resolver_match.view_name in self.exempted_url_names
+            resolver_match.url_name in self._exempted_url_names
+            or resolver_match.view_name in self._exempted_url_names
         ):
             return None
         view_class = getattr(resolver_match.func, "cls", None)
         if view_class is not None and issubclass(view_class, APIView):
             return self._rest_response(request)
-        return self._html_response(request)
+        return self._html_response(request, user)
 
-    def _html_response(self, request):
+    def _html_response(self, request, user):
         messages.warning(
             request,
             _("Your password has expired, please update your password."),
         )
         redirect_path = ACCOUNT_CHANGE_PASSWORD_PATH
-        if request.user.is_staff:
+        if user.is_staff:
             next_path = (
                 request.path
                 if request.path != self.admin_login_path
@@ -127,3 +207,38 @@ class PasswordExpirationMiddleware:
         response.renderer_context = {}
         response.render()
         return response
+
+
+async def _ahas_session_key(request):
+    # SessionBase.ahas_key is not available on Django < 5.1
+    if hasattr(request.session, "ahas_key"):
+        return await request.session.ahas_key(AUTH_SESSION_KEY)
+    return await sync_to_async(request.session.has_key)(AUTH_SESSION_KEY)
+
+
+async def _aget_user(request):
+    user = request.user
+    if not isinstance(user, SimpleLazyObject):
+        # the user has been logged in while processing the request
+        return user
+    # request.auser is not available on Django < 5.0
+    if hasattr(request, "auser"):
+        return await request.auser()
+    return await sync_to_async(get_user)(request)
+
+
+def is_password_expiration_enabled():
+    return bool(
+        app_settings.USER_PASSWORD_EXPIRATION
+        or app_settings.STAFF_USER_PASSWORD_EXPIRATION
+    )
+
+
+def _get_view_classes(url_patterns):
+    for pattern in url_patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _get_view_classes(pattern.url_patterns)
+            continue
+        view_class = getattr(pattern.callback, "cls", None)
+        if isinstance(view_class, type):
+            yield view_class
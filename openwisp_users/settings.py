@@ -18,6 +18,24 @@ PASSWORD_RESET_FORM = getattr(
     "OPENWISP_USERS_PASSWORD_RESET_FORM",
     "openwisp_users.base.forms.PasswordResetForm",
 )
+BEARER_TOKEN_CACHE_TIMEOUT = getattr(
+    settings, "OPENWISP_USERS_BEARER_TOKEN_CACHE_TIMEOUT", 0
+)
+SESAME_TOKEN_CACHE_TIMEOUT = getattr(
+    settings, "OPENWISP_USERS_SESAME_TOKEN_CACHE_TIMEOUT", 0
+)
+LOGIN_LOCKOUT_THRESHOLD = getattr(settings, "OPENWISP_USERS_LOGIN_LOCKOUT_THRESHOLD", 0)
+LOGIN_LOCKOUT_IP_THRESHOLD = getattr(
+    settings, "OPENWISP_USERS_LOGIN_LOCKOUT_IP_THRESHOLD", 0
+)
+LOGIN_LOCKOUT_TIMEOUT = getattr(settings, "OPENWISP_USERS_LOGIN_LOCKOUT_TIMEOUT", 60)
+LOGIN_LOCKOUT_MAX_TIMEOUT = getattr(
+    settings, "OPENWISP_USERS_LOGIN_LOCKOUT_MAX_TIMEOUT", 3600
+)
+BULK_CREATE_MAX_SIZE = getattr(settings, "OPENWISP_USERS_BULK_CREATE_MAX_SIZE", 100)
+BULK_CREATE_HASHING_WORKERS = getattr(
+    settings, "OPENWISP_USERS_BULK_CREATE_HASHING_WORKERS", 4
+)
 AUTH_BACKEND_AUTO_PREFIXES = getattr(
     settings, "OPENWISP_USERS_AUTH_BACKEND_AUTO_PREFIXES", tuple()
 )
@@ -36,6 +54,17 @@ def export_organizations(user):
     return "\n".join(f"({org.organization_id},{org.is_admin})" for org in orgs)
 
 
+def export_organizations_native(user):
+    """
+    Like ``export_organizations``, used by the NDJSON export of the REST API.
+    """
+    orgs = getattr(user, f"{_OPENWISP_USERS_APP_LABEL}_organizationuser").all()
+    return [
+        {"organization_id": org.organization_id, "is_admin": org.is_admin}
+        for org in orgs
+    ]
+
+
 EXPORT_USERS_COMMAND_CONFIG = getattr(
     settings,
     "OPENWISP_USERS_EXPORT_USERS_COMMAND_CONFIG",
@@ -60,12 +89,27 @@ EXPORT_USERS_COMMAND_CONFIG = getattr(
                 "name": "organizations",
                 "header_fields": ["organization_id", "is_admin"],
                 "callable": export_organizations,
+                "native_callable": export_organizations_native,
             },
         ],
         "select_related": [],
         "prefetch_related": [f"{_OPENWISP_USERS_APP_LABEL}_organizationuser"],
     },
 )
+MEMBERSHIP_CACHE_COMPACT = getattr(
+    settings, "OPENWISP_USERS_MEMBERSHIP_CACHE_COMPACT", False
+)
+MEMBERSHIP_LOCAL_CACHE_SIZE = getattr(
+    settings, "OPENWISP_USERS_MEMBERSHIP_LOCAL_CACHE_SIZE", 0
+)
+MEMBERSHIP_LOCAL_CACHE_TIMEOUT = getattr(
+    settings, "OPENWISP_USERS_MEMBERSHIP_LOCAL_CACHE_TIMEOUT", 30
+)
+MEMBERSHIP_INVALIDATION_CHANNEL = getattr(
+    settings,
+    "OPENWISP_USERS_MEMBERSHIP_INVALIDATION_CHANNEL",
+    {"BACKEND": "openwisp_users.local_cache.CacheChannel"},
+)
 USER_PASSWORD_EXPIRATION = getattr(
     settings, "OPENWISP_USERS_USER_PASSWORD_EXPIRATION", 0
 )
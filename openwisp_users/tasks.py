@@ -1,22 +1,27 @@
+import io
+import logging
+
+from allauth.account.models import EmailAddress
 from celery import shared_task
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
 from django.contrib.sites.models import Site
+from django.core.handlers.wsgi import WSGIRequest
 from django.db.models import Q
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import translation
 from django.utils.timezone import now, timedelta
 from django.utils.translation import gettext_lazy as _
-from swapper import load_model
 
 from openwisp_utils.admin_theme.email import send_email
 
 from . import settings as app_settings
+from .membership import bump_membership_epoch
 from .utils import throttle_email_batch
 
 User = get_user_model()
-OrganizationUser = load_model("openwisp_users", "OrganizationUser")
+logger = logging.getLogger(__name__)
 
 
 @shared_task
@@ -87,12 +92,11 @@ def invalidate_org_membership_cache(organization_pk):
     Invalidates organization membership cache of all users of an
     organization when organization.is_active changes
     (organization is disabled or enabled again).
+
+    Kept for backward compatibility: changing the membership
+    epoch invalidates the cache of all users in O(1).
     """
-    qs = OrganizationUser.objects.filter(
-        organization_id=organization_pk
-    ).select_related("user")
-    for org_user in qs.iterator():
-        org_user.user._invalidate_user_organizations_dict()
+    bump_membership_epoch()
 
 
 @shared_task
@@ -103,3 +107,45 @@ def deactivate_expired_users():
 @shared_task
 def expiration_reminder_email():
     return User.expiration_reminder_email()
+
+
+def get_request_environ(request):
+    """
+    Returns the part of the WSGI environ of ``request`` needed to
+    send the verification emails from ``send_email_confirmations``
+    like they're sent within the request (eg: the absolute links).
+    """
+    return {"HTTP_HOST": request.get_host(), "wsgi.url_scheme": request.scheme}
+
+
+@shared_task
+def send_email_confirmations(user_pks, request_environ=None):
+    """
+    Sends the verification emails of the users created in bulk
+    through the REST API, like ``SuperUserListSerializer.create``
+    sends them within the request which created the users.
+    """
+    request = None
+    if request_environ:
+        request = WSGIRequest(
+            {
+                "REQUEST_METHOD": "POST",
+                "PATH_INFO": "/",
+                "wsgi.input": io.BytesIO(),
+                **request_environ,
+            }
+        )
+    email_addresses = EmailAddress.objects.filter(
+        user_id__in=user_pks, verified=False
+    ).select_related("user")
+    email_count = 0
+    for email_address in email_addresses.iterator():
+        try:
+            email_address.send_confirmation(request, signup=True)
+        except Exception as e:
+            logger.exception(
+                f"Got exception {type(e)} while sending verification "
+                f"email to user {email_address.user}, email {email_address.email}"
+            )
+        email_count += 1
+        throttle_email_batch(email_count)
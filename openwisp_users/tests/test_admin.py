@@ -1888,7 +1888,10 @@ class TestUsersAdmin(
         self.client.force_login(self._get_admin())
         user1 = self._create_user(username="user1", email="user1@email.com")
         org1 = self._create_org(name="org1")
-        org_user = self._create_org_user(user=user1, organization=org1, is_admin=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            org_user = self._create_org_user(
+                user=user1, organization=org1, is_admin=True
+            )
 
         with self.subTest("test delete org user which belongs to owner"):
             post_data = {"post": "yes"}
@@ -1907,12 +1910,15 @@ class TestUsersAdmin(
 
         with self.subTest("test delete org user which belongs to no owner"):
             org2 = self._create_org(name="org2")
-            org_u = self._create_org_user(user=user1, organization=org2, is_admin=False)
             post_data = {"post": "yes"}
-            url = reverse(
-                f"admin:{self.app_label}_organizationuser_delete", args=[org_u.pk]
-            )
-            r = self.client.post(url, post_data, follow=True)
+            with self.captureOnCommitCallbacks(execute=True):
+                org_u = self._create_org_user(
+                    user=user1, organization=org2, is_admin=False
+                )
+                url = reverse(
+                    f"admin:{self.app_label}_organizationuser_delete", args=[org_u.pk]
+                )
+                r = self.client.post(url, post_data, follow=True)
             qs = OrganizationUser.objects.filter(organization=org2, user=user1)
             self.assertEqual(r.status_code, 200)
             self.assertContains(r, "was deleted successfully.")
@@ -1935,7 +1941,8 @@ class TestUsersAdmin(
 
         with self.subTest("delete org users with some belonging to owners"):
             org2 = self._create_org(name="org2")
-            org_user2 = self._create_org_user(user=user1, organization=org2)
+            with self.captureOnCommitCallbacks(execute=True):
+                org_user2 = self._create_org_user(user=user1, organization=org2)
             post_data = {
                 "action": "delete_selected_overridden",
                 "_selected_action": [org_user.pk, org_user2.pk],
@@ -1950,7 +1957,7 @@ class TestUsersAdmin(
             self.assertContains(r, msg)
             post_data.update({"post": "yes"})
             # django-reversion adds ~4 queries
-            with self.assertNumQueries(21):
+            with self.assertNumQueries(20):
                 r = self.client.post(url, post_data, follow=True)
             qs = OrganizationUser.objects.filter(pk__in=[org_user.pk, org_user2.pk])
             self.assertEqual(r.status_code, 200)
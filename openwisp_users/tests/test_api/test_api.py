@@ -1,3 +1,9 @@
+import csv
+import json
+import time
+import uuid
+from datetime import datetime
+from io import StringIO
 from unittest.mock import patch
 
 import django
@@ -6,15 +12,22 @@ from django.contrib import auth
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission
 from django.core import mail
-from django.test import TestCase
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.db.models.signals import m2m_changed, post_save
+from django.test import RequestFactory, TestCase
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
 from django.utils.timezone import localdate, timedelta
+from rest_framework.request import Request
 from swapper import load_model
 
-from openwisp_utils.tests import AssertNumQueriesSubTestMixin
+from openwisp_utils.tests import AssertNumQueriesSubTestMixin, catch_signal
 
 from ... import settings as app_settings
 from ...api.serializers import OrganizationUserSerializer
+from ...api.views import UserDetailView, UserExportView
 from ..utils import TestOrganizationMixin
 
 Organization = load_model("openwisp_users", "Organization")
@@ -98,7 +111,8 @@ class TestUsersApi(
             "email": "testorg@test.com",
             "url": "",
         }
-        with self.assertNumQueries(8):
+        # disabling the organization does not query its members
+        with self.assertNumQueries(7):
             r = self.client.put(path, data, content_type="application/json")
         self.assertEqual(r.status_code, 200)
         self.assertEqual(r.data["name"], "test org change")
@@ -122,7 +136,7 @@ class TestUsersApi(
         org1_user1 = self._create_org_user(user=user1, organization=org1)
         path = reverse("users:organization_detail", args=(org1.pk,))
         data = {"owner": {"organization_user": org1_user1.pk}}
-        with self.assertNumQueries(18):
+        with self.assertNumQueries(16):
             r = self.client.patch(path, data, content_type="application/json")
         self.assertEqual(r.status_code, 200)
         self.assertEqual(r.data["owner"]["organization_user"], org1_user1.pk)
@@ -134,7 +148,7 @@ class TestUsersApi(
         self._create_org_owner(organization_user=org1_user1, organization=org1)
         path = reverse("users:organization_detail", args=(org1.pk,))
         data = {"owner": {"organization_user": ""}}
-        with self.assertNumQueries(12):
+        with self.assertNumQueries(10):
             r = self.client.patch(path, data, content_type="application/json")
         self.assertEqual(r.status_code, 200)
         self.assertEqual(r.data["owner"], None)
@@ -150,7 +164,8 @@ class TestUsersApi(
     def test_get_organization_for_org_manager(self):
         user1 = self._create_user(username="user1", email="user1@email.com")
         org1 = self._create_org(name="org1")
-        self._create_org_user(user=user1, organization=org1, is_admin=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._create_org_user(user=user1, organization=org1, is_admin=True)
         view_perm = Permission.objects.filter(codename="view_organization")
         user1.user_permissions.add(*view_perm)
         self.client.force_login(user1)
@@ -178,7 +193,7 @@ class TestUsersApi(
         self.assertEqual(org1.owner.organization_user.id, org1_user1.id)
         path = reverse("users:organization_detail", args=(org1.pk,))
         data = {"owner": {"organization_user": org1_user2.id}}
-        with self.assertNumQueries(27):
+        with self.assertNumQueries(23):
             r = self.client.patch(path, data, content_type="application/json")
         org1.refresh_from_db()
         self.assertEqual(org1.owner.organization_user.id, org1_user2.id)
@@ -190,8 +205,9 @@ class TestUsersApi(
         user2 = self._create_user(username="user2", email="user2@email.com")
         org1 = self._create_org(name="org1")
         org2 = self._create_org(name="org2")
-        self._create_org_user(user=user1, organization=org1, is_admin=True)
-        self._create_org_user(user=user2, organization=org2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._create_org_user(user=user1, organization=org1, is_admin=True)
+            self._create_org_user(user=user2, organization=org2)
         change_perm = Permission.objects.filter(codename="change_organization")
         user1.user_permissions.add(*change_perm)
         self.client.force_login(user1)
@@ -278,7 +294,7 @@ class TestUsersApi(
         self.client.force_login(user1)
         path = reverse("users:change_password", args=(user1.pk,))
         data = {"current_password": "wrong", "new_password": "super1234"}
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(4):
             r = self.client.put(path, data, content_type="application/json")
         self.assertEqual(r.status_code, 400)
         self.assertEqual(
@@ -334,7 +350,7 @@ class TestUsersApi(
         self.client.force_login(org1_manager)
         path = reverse("users:change_password", args=(user2.pk,))
         data = {"old_password": "admin", "new_password": "super1234"}
-        with self.assertNumQueries(7):
+        with self.assertNumQueries(6):
             response = self.client.put(path, data, content_type="application/json")
         self.assertEqual(response.status_code, 404)
 
@@ -379,7 +395,6 @@ class TestUsersApi(
         org1_manager = self._create_user(
             username="org1_manager", password="test123", email="org1_manager@test.com"
         )
-        self._create_org_user(organization=org1, user=org1_manager, is_admin=True)
         administrator = Group.objects.get(name="Administrator")
         org1_manager.groups.add(administrator)
 
@@ -389,7 +404,9 @@ class TestUsersApi(
             email="org1_user@test.com",
             is_staff=True,
         )
-        self._create_org_user(organization=org1, user=org1_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._create_org_user(organization=org1, user=org1_manager, is_admin=True)
+            self._create_org_user(organization=org1, user=org1_user)
         org1_user.groups.add(administrator)
 
         with self.subTest("Change password of org manager by manager"):
@@ -400,7 +417,7 @@ class TestUsersApi(
                 "new_password": "test1234",
                 "confirm_password": "test1234",
             }
-            with self.assertNumQueries(5):
+            with self.assertNumQueries(4):
                 r = self.client.put(path, data, content_type="application/json")
             self.assertEqual(r.status_code, 200)
             self.assertEqual(r.data["status"], "Success")
@@ -415,7 +432,7 @@ class TestUsersApi(
                 "new_password": "test1234",
                 "confirm_password": "test1234",
             }
-            with self.assertNumQueries(8):
+            with self.assertNumQueries(6):
                 r = self.client.put(path, data, content_type="application/json")
             self.assertEqual(r.status_code, 200)
             self.assertEqual(r.data["status"], "Success")
@@ -430,7 +447,7 @@ class TestUsersApi(
                 "new_password": "test1342",
                 "confirm_password": "test1342",
             }
-            with self.assertNumQueries(5):
+            with self.assertNumQueries(4):
                 r = self.client.put(path, data, content_type="application/json")
             self.assertEqual(r.status_code, 200)
             self.assertEqual(r.data["status"], "Success")
@@ -484,7 +501,8 @@ class TestUsersApi(
         org1 = self._create_org(name="org1")
         org2 = self._create_org(name="org2")
         org1_user = self._create_user(username="org1user", email="org1user@mail.om")
-        self._create_org_user(user=org1_user, organization=org1, is_admin=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._create_org_user(user=org1_user, organization=org1, is_admin=True)
         email_perm = Permission.objects.filter(codename__endswith="emailaddress")
         org1_user.user_permissions.add(*email_perm)
         org2_user = self._create_user(username="org2user", email="org2user@mail.om")
@@ -538,6 +556,564 @@ class TestUsersApi(
         self.assertEqual(r.status_code, 200)
         self.assertEqual(r.data["count"], 1)
 
+    def test_user_list_api_queries_per_page_size(self):
+        org = self._get_org()
+        administrator = Group.objects.get(name="Administrator")
+        for index in range(20):
+            user = self._create_user(
+                username=f"user{index}", email=f"user{index}@test.com"
+            )
+            self._create_org_user(organization=org, user=user, is_admin=index % 2)
+            user.groups.add(administrator)
+        path = reverse("users:user_list")
+        for page_size in [1, 10, 20]:
+            with self.subTest(page_size=page_size):
+                with self.assertNumQueries(5):
+                    response = self.client.get(path, {"page_size": page_size})
+                self.assertEqual(response.status_code, 200)
+                results = response.data["results"]
+                self.assertEqual(len(results), page_size)
+                for result in results:
+                    user = User.objects.get(pk=result["id"])
+                    self.assertEqual(
+                        result["organization_users"],
+                        [
+                            {"is_admin": org_user.is_admin, "organization": org.pk}
+                            for org_user in OrganizationUser.objects.filter(user=user)
+                        ],
+                    )
+                    self.assertEqual(
+                        result["groups"], list(user.groups.values_list("pk", flat=True))
+                    )
+
+    def _get_cursor_pages(self, path, **params):
+        pages = []
+        url = path
+        params = {"pagination": "cursor", **params}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("count", response.data)
+            pages.append([item["id"] for item in response.data["results"]])
+            url, params = response.data["next"], None
+        return pages
+
+    def test_user_list_cursor_pagination(self):
+        date_joined = timezone.now()
+        for index in range(12):
+            # users sharing the same date_joined are ordered by id
+            self._create_user(
+                username=f"user{index}",
+                email=f"user{index}@test.com",
+                date_joined=date_joined - timedelta(minutes=index // 3),
+            )
+        path = reverse("users:user_list")
+        expected = [
+            str(pk)
+            for pk in User.objects.order_by("-date_joined", "-id").values_list(
+                "pk", flat=True
+            )
+        ]
+
+        with self.subTest("pages follow the (date_joined, id) ordering"):
+            pages = self._get_cursor_pages(path, page_size=5)
+            self.assertEqual([len(page) for page in pages], [5, 5, 3])
+            self.assertEqual([str(pk) for page in pages for pk in page], expected)
+
+        with self.subTest("no count query is performed"):
+            with self.assertNumQueries(4) as context:
+                response = self.client.get(path, {"pagination": "cursor"})
+            self.assertEqual(response.status_code, 200)
+            for query in context.captured_queries:
+                self.assertNotIn("COUNT(", query["sql"])
+
+        with self.subTest("pages are stable under concurrent inserts"):
+            response = self.client.get(path, {"pagination": "cursor", "page_size": 5})
+            self._create_user(username="new", email="new@test.com")
+            response = self.client.get(response.data["next"])
+            self.assertEqual(
+                [str(item["id"]) for item in response.data["results"]], expected[5:10]
+            )
+
+        with self.subTest("invalid cursor"):
+            for cursor in ["invalid", "WyJpbnZhbGlkIiwgImlkIl0="]:
+                response = self.client.get(path, {"cursor": cursor})
+                self.assertEqual(response.status_code, 404)
+
+        with self.subTest("offset pagination is used by default"):
+            response = self.client.get(path)
+            self.assertEqual(response.data["count"], 14)
+
+    def test_organization_list_cursor_pagination(self):
+        for index in range(4):
+            self._create_org(name=f"org{index}", slug=f"org{index}")
+        path = reverse("users:organization_list")
+        pages = self._get_cursor_pages(path, page_size=2)
+        self.assertEqual(
+            [str(pk) for page in pages for pk in page],
+            [
+                str(pk)
+                for pk in Organization.objects.order_by("-created", "-id").values_list(
+                    "pk", flat=True
+                )
+            ],
+        )
+
+    def test_user_api_sparse_fieldsets(self):
+        user = self._create_user()
+        self._create_org_user(user=user)
+        params = {"fields": "id,username,email"}
+
+        with self.subTest("user list"):
+            with self.assertNumQueries(3) as context:
+                response = self.client.get(reverse("users:user_list"), params)
+            self.assertEqual(response.status_code, 200)
+            for result in response.data["results"]:
+                self.assertEqual(set(result), {"id", "username", "email"})
+            sql = context.captured_queries[-1]["sql"]
+            self.assertIn('"username"', sql)
+            for column in ['"password"', '"bio"', '"notes"']:
+                self.assertNotIn(column, sql)
+
+        with self.subTest("cursor pagination"):
+            # the keyset of the last item is loaded along with the fields
+            with self.assertNumQueries(2) as context:
+                response = self.client.get(
+                    reverse("users:user_list"),
+                    {**params, "pagination": "cursor", "page_size": 1},
+                )
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNotNone(response.data["next"])
+            self.assertEqual(
+                set(response.data["results"][0]), {"id", "username", "email"}
+            )
+            self.assertIn('"date_joined"', context.captured_queries[-1]["sql"])
+
+        with self.subTest("user detail"):
+            path = reverse("users:user_detail", args=(user.pk,))
+            response = self.client.get(path, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                response.data,
+                {"id": str(user.pk), "username": user.username, "email": user.email},
+            )
+
+        with self.subTest("requested relations are returned"):
+            response = self.client.get(
+                reverse("users:user_list"), {"fields": "id,organization_users"}
+            )
+            result = next(
+                result
+                for result in response.data["results"]
+                if result["id"] == str(user.pk)
+            )
+            self.assertEqual(
+                result["organization_users"],
+                [{"is_admin": False, "organization": self._get_org().pk}],
+            )
+
+        with self.subTest("fields are ignored in write requests"):
+            path = reverse("users:user_detail", args=(user.pk,))
+            response = self.client.patch(
+                f"{path}?fields=id",
+                {"first_name": "changed"},
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["first_name"], "changed")
+
+    def test_organization_api_sparse_fieldsets(self):
+        org = self._get_org()
+        params = {"fields": "id,name"}
+        response = self.client.get(reverse("users:organization_list"), params)
+        self.assertEqual(response.status_code, 200)
+        for result in response.data["results"]:
+            self.assertEqual(set(result), {"id", "name"})
+        path = reverse("users:organization_detail", args=(org.pk,))
+        with self.assertNumQueries(2) as context:
+            response = self.client.get(path, params)
+        self.assertEqual(response.data, {"id": str(org.pk), "name": org.name})
+        self.assertNotIn('"description"', context.captured_queries[-1]["sql"])
+
+    def test_user_export_api(self):
+        path = reverse("users:user_export")
+        self._get_user()
+        org1 = self._create_org(name="org1")
+        org2 = self._create_org(name="org2")
+        user1 = self._create_user(username="user1", email="user1@test.com")
+        self._create_org_user(organization=org1, user=user1)
+        self._create_org_user(organization=org2, user=user1, is_admin=True)
+        user2 = self._create_user(username="user2", email="user2@test.com")
+        self._create_org_user(organization=org2, user=user2)
+
+        with self.subTest("NDJSON"):
+            with self.assertNumQueries(3):
+                response = self.client.get(path)
+                self.assertTrue(response.streaming)
+                lines = b"".join(response.streaming_content).decode().splitlines()
+            self.assertEqual(
+                response["Content-Type"], "application/x-ndjson; charset=utf-8"
+            )
+            users = [json.loads(line) for line in lines]
+            self.assertEqual(
+                [user["username"] for user in users],
+                ["administrator", "tester", "user1", "user2"],
+            )
+            self.assertEqual(users[2]["id"], str(user1.pk))
+            self.assertEqual(
+                users[2]["organizations"],
+                [
+                    {"organization_id": str(org1.pk), "is_admin": False},
+                    {"organization_id": str(org2.pk), "is_admin": True},
+                ],
+            )
+            # password hashes are never exported
+            self.assertNotIn("password", users[2])
+
+        with self.subTest("NDJSON values have their JSON types"):
+            User.objects.filter(pk=user1.pk).update(phone_number="+393665243702")
+            response = self.client.get(path)
+            lines = b"".join(response.streaming_content).decode().splitlines()
+            exported = json.loads(lines[2])
+            self.assertIs(exported["is_active"], True)
+            self.assertIs(exported["is_staff"], False)
+            self.assertEqual(exported["birth_date"], "1987-03-23")
+            self.assertIsNone(exported["expiration_date"])
+            self.assertEqual(exported["phone_number"], "+393665243702")
+            self.assertEqual(
+                datetime.fromisoformat(exported["date_joined"]),
+                User.objects.get(pk=user1.pk).date_joined,
+            )
+            self.assertIsInstance(exported["organizations"][0]["is_admin"], bool)
+
+        with self.subTest("CSV"):
+            with patch.object(UserExportView, "chunk_size", 1):
+                response = self.client.get(
+                    path, {"format": "csv", "exclude_fields": "notes,location"}
+                )
+                content = b"".join(response.streaming_content).decode()
+            self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+            self.assertIn(".csv", response["Content-Disposition"])
+            rows = list(csv.reader(StringIO(content)))
+            self.assertEqual(len(rows), 5)
+            self.assertEqual(rows[0][:3], ["id", "username", "email"])
+            self.assertNotIn("password", rows[0])
+            self.assertNotIn("notes", rows[0])
+            self.assertNotIn("location", rows[0])
+            self.assertEqual(rows[4][1], "user2")
+
+        with self.subTest("CSV header is sent when there are no users"):
+            with patch.object(UserExportView, "get_queryset") as get_queryset:
+                get_queryset.return_value = User.objects.none()
+                response = self.client.get(path, {"format": "csv"})
+                rows = list(
+                    csv.reader(StringIO(b"".join(response.streaming_content).decode()))
+                )
+            self.assertEqual(len(rows), 1)
+
+        with self.subTest("organization manager"):
+            manager = self._create_operator_with_user_permissions()
+            self._create_org_user(organization=org2, user=manager, is_admin=True)
+            self.client.force_login(manager)
+            response = self.client.get(path)
+            lines = b"".join(response.streaming_content).decode().splitlines()
+            users = {user["username"]: user for user in map(json.loads, lines)}
+            self.assertEqual(set(users), {"user1", "user2", "operator"})
+            # memberships of other organizations are not exported
+            self.assertEqual(
+                users["user1"]["organizations"],
+                [{"organization_id": str(org2.pk), "is_admin": True}],
+            )
+
+        with self.subTest("unauthenticated"):
+            self.client.logout()
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 401)
+            self.assertFalse(response.streaming)
+
+    def test_user_bulk_create_api(self):
+        path = reverse("users:user_bulk_create")
+        org = self._create_org(name="org1")
+        group = Group.objects.get(name="Operator")
+        data = [
+            {
+                "username": "user1",
+                "email": "User1@test.com",
+                "password": "password123",
+                "organization_users": {"is_admin": True, "organization": org.pk},
+            },
+            {
+                "username": "user2",
+                "email": "user2@test.com",
+                "password": "password456",
+                "groups": [group.pk],
+                "phone_number": "",
+            },
+            {
+                "username": "user3",
+                "email": "user3@test.com",
+                "password": "password789",
+                "email_verified": True,
+            },
+        ]
+
+        with self.subTest("create users"):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(path, data, content_type="application/json")
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(
+                [user["username"] for user in response.data],
+                ["user1", "user2", "user3"],
+            )
+            self.assertEqual(
+                response.data[0]["organization_users"],
+                [{"is_admin": True, "organization": org.pk}],
+            )
+            self.assertEqual(response.data[1]["groups"], [group.pk])
+            self.assertNotIn("password", response.data[0])
+            user1 = User.objects.get(username="user1")
+            self.assertTrue(user1.check_password("password123"))
+            self.assertEqual(user1.password_updated, localdate())
+            self.assertIsNone(User.objects.get(username="user2").phone_number)
+            # the first manager of the organization becomes its owner
+            self.assertTrue(user1.is_owner(org))
+            # verification emails are sent to unverified email addresses
+            self.assertEqual(len(mail.outbox), 2)
+            self.assertEqual(
+                sorted(email.to[0] for email in mail.outbox),
+                ["user1@test.com", "user2@test.com"],
+            )
+            # the links are built from the request, like the single creation
+            self.assertIn("http://testserver/", mail.outbox[0].body)
+            email = EmailAddress.objects.get(user__username="user3")
+            self.assertTrue(email.verified)
+            self.assertTrue(email.primary)
+            self.assertFalse(EmailAddress.objects.get(email="user1@test.com").verified)
+
+        with self.subTest("signals"):
+            data = [
+                {
+                    "username": "signals",
+                    "email": "signals@test.com",
+                    "password": "pwd",
+                    "groups": [group.pk],
+                    "organization_users": {"is_admin": False, "organization": org.pk},
+                }
+            ]
+            with catch_signal(post_save) as post_save_handler, catch_signal(
+                m2m_changed
+            ) as m2m_handler:
+                response = self.client.post(path, data, content_type="application/json")
+            self.assertEqual(response.status_code, 201)
+            created = {
+                type(call.kwargs["instance"]): call.kwargs
+                for call in post_save_handler.call_args_list
+                if call.kwargs["sender"] in (User, OrganizationUser)
+            }
+            self.assertEqual(created[User]["instance"].username, "signals")
+            self.assertTrue(created[User]["created"])
+            self.assertEqual(created[OrganizationUser]["instance"].organization, org)
+            self.assertTrue(created[OrganizationUser]["created"])
+            self.assertEqual(
+                [call.kwargs["action"] for call in m2m_handler.call_args_list],
+                ["pre_add", "post_add"],
+            )
+            self.assertEqual(m2m_handler.call_args.kwargs["pk_set"], {group.pk})
+
+        with self.subTest("invalid items"):
+            user_count = User.objects.count()
+            data = [
+                {"username": "user4", "email": "user4@test.com", "password": "pwd"},
+                {"username": "user1", "email": "user5@test.com", "password": "pwd"},
+                {"username": "user6", "email": "USER4@test.com", "password": "pwd"},
+            ]
+            response = self.client.post(path, data, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(len(response.data), 3)
+            self.assertEqual(response.data[0], {})
+            self.assertIn("username", response.data[1])
+            self.assertIn("email", response.data[2])
+            self.assertEqual(User.objects.count(), user_count)
+
+        with self.subTest("invalid membership"):
+            org_user_data = [
+                {
+                    "username": "user4",
+                    "email": "user4@test.com",
+                    "password": "pwd",
+                    "organization_users": {"is_admin": False, "organization": org.pk},
+                }
+            ]
+            with patch.object(
+                OrganizationUser, "clean", side_effect=ValidationError("invalid")
+            ):
+                response = self.client.post(
+                    path, org_user_data, content_type="application/json"
+                )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("organization_users", response.data[0])
+            self.assertEqual(User.objects.count(), user_count)
+
+        with self.subTest("empty and oversized batches"):
+            response = self.client.post(path, [], content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            with patch.object(app_settings, "BULK_CREATE_MAX_SIZE", 1):
+                response = self.client.post(
+                    path, data[:2], content_type="application/json"
+                )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(User.objects.count(), user_count)
+
+        with self.subTest("values repeated in the batch once normalized"):
+            data = [
+                {
+                    "username": "bob",
+                    "email": "bob@test.com",
+                    "password": "pwd",
+                    "phone_number": "+393665243702",
+                },
+                {
+                    "username": "bob ",
+                    "email": "bob2@test.com",
+                    "password": "pwd",
+                    "phone_number": "+39 366 524 3702",
+                },
+            ]
+            response = self.client.post(path, data, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data[0], {})
+            self.assertEqual(set(response.data[1]), {"username", "phone_number"})
+            self.assertEqual(User.objects.count(), user_count)
+
+        with self.subTest("integrity error"):
+            # eg: a user with the same username created concurrently
+            data = [{"username": "bob", "email": "bob@test.com", "password": "pwd"}]
+            with patch.object(User.objects, "bulk_create", side_effect=IntegrityError):
+                response = self.client.post(path, data, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("non_field_errors", response.data)
+            self.assertEqual(User.objects.count(), user_count)
+
+        with self.subTest("passwords hashed without thread pool"):
+            data = [
+                {"username": "user7", "email": "user7@test.com", "password": "pwd7"},
+                {"username": "user8", "email": "user8@test.com", "password": "pwd8"},
+            ]
+            with patch.object(app_settings, "BULK_CREATE_HASHING_WORKERS", 1):
+                response = self.client.post(path, data, content_type="application/json")
+            self.assertEqual(response.status_code, 201)
+            self.assertTrue(User.objects.get(username="user8").check_password("pwd8"))
+
+        with self.subTest("organization manager"):
+            manager = self._create_operator_with_user_permissions()
+            self._create_org_user(
+                organization=self._get_org(), user=manager, is_admin=True
+            )
+            self.client.force_login(manager)
+            data = [
+                {
+                    "username": "user9",
+                    "email": "user9@test.com",
+                    "password": "pwd9",
+                    "organization_users": {"is_admin": False, "organization": org.pk},
+                }
+            ]
+            response = self.client.post(path, data, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("organization_users", response.data[0])
+            data[0]["organization_users"]["organization"] = self._get_org().pk
+            response = self.client.post(path, data, content_type="application/json")
+            self.assertEqual(response.status_code, 201)
+            self.assertNotIn("is_superuser", response.data[0])
+
+    def test_user_bulk_update_api(self):
+        path = reverse("users:user_bulk_create")
+        org = self._get_org()
+        user1 = self._create_user(username="user1", email="user1@test.com")
+        user2 = self._create_user(username="user2", email="user2@test.com")
+
+        with self.subTest("update users"):
+            data = [
+                {"id": str(user1.pk), "first_name": "One", "is_active": False},
+                {
+                    "id": str(user2.pk),
+                    "organization_users": {"is_admin": True, "organization": org.pk},
+                },
+            ]
+            with catch_signal(post_save) as handler:
+                response = self.client.patch(
+                    path, data, content_type="application/json"
+                )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [user["username"] for user in response.data], ["user1", "user2"]
+            )
+            self.assertEqual(response.data[0]["first_name"], "One")
+            self.assertEqual(
+                response.data[1]["organization_users"],
+                [{"is_admin": True, "organization": org.pk}],
+            )
+            user1.refresh_from_db()
+            self.assertFalse(user1.is_active)
+            self.assertTrue(user2.is_manager(org))
+            # the users are saved one at a time, sending the signals
+            saved = {
+                call.kwargs["instance"].pk
+                for call in handler.call_args_list
+                if call.kwargs["sender"] is User
+            }
+            self.assertEqual(saved, {user1.pk, user2.pk})
+
+        with self.subTest("invalid items"):
+            data = [
+                {"id": str(user1.pk), "first_name": "Changed"},
+                {"first_name": "no id"},
+                {"id": str(uuid.uuid4()), "first_name": "not found"},
+                {"id": "invalid", "first_name": "invalid"},
+                {"id": str(user1.pk), "first_name": "repeated"},
+                {"id": str(user2.pk), "email": "user1@test.com"},
+            ]
+            response = self.client.patch(path, data, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(len(response.data), 6)
+            self.assertEqual(response.data[0], {})
+            for item_errors in response.data[1:5]:
+                self.assertEqual(list(item_errors), ["id"])
+            self.assertIn("email", response.data[5])
+            user1.refresh_from_db()
+            self.assertEqual(user1.first_name, "One")
+
+        with self.subTest("values repeated in the batch"):
+            data = [
+                {"id": str(user1.pk), "username": "same"},
+                {"id": str(user2.pk), "username": "same"},
+            ]
+            response = self.client.patch(path, data, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data[0], {})
+            self.assertIn("username", response.data[1])
+
+        with self.subTest("organization manager"):
+            manager = self._create_operator_with_user_permissions()
+            self._create_org_user(organization=org, user=manager, is_admin=True)
+            admin = User.objects.get(username="administrator")
+            self.client.force_login(manager)
+            data = [
+                {"id": str(user2.pk), "first_name": "Two"},
+                {"id": str(admin.pk), "first_name": "Admin"},
+            ]
+            response = self.client.patch(path, data, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            # superusers can't be changed by organization managers
+            self.assertEqual(list(response.data[1]), ["id"])
+            response = self.client.patch(
+                path, data[:1], content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("user_permissions", response.data[0])
+            user2.refresh_from_db()
+            self.assertEqual(user2.first_name, "Two")
+
     def test_create_user_list_api(self):
         with self.subTest("create user, standard case"):
             mail_sent = len(mail.outbox)
@@ -607,6 +1183,95 @@ class TestUsersApi(
             r = self.client.post(path, data, content_type="application/json")
         self.assertEqual(r.status_code, 400)
 
+    def test_conditional_get_api(self):
+        user = self._create_user()
+        org = self._get_org()
+        group = Group.objects.get(name="Operator")
+        user_path = reverse("users:user_detail", args=(user.pk,))
+        org_path = reverse("users:organization_detail", args=(org.pk,))
+        group_path = reverse("users:group_list")
+
+        def assert_modified(path, change, **params):
+            response = self.client.get(path, params)
+            self.assertEqual(response.status_code, 200)
+            etag = response["ETag"]
+            response = self.client.get(path, params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            response = self.client.get(path, params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+
+        with self.subTest("304 responses are not serialized"):
+            response = self.client.get(user_path)
+            # changes within the same second would not be detected
+            self.assertNotIn("Last-Modified", response)
+            response = self.client.get(
+                user_path, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60)
+            )
+            self.assertEqual(response.status_code, 200)
+            with patch(
+                "openwisp_users.api.serializers.BaseSuperUserSerializer"
+                ".to_representation"
+            ) as to_representation:
+                response = self.client.get(
+                    user_path, HTTP_IF_NONE_MATCH=response["ETag"]
+                )
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b"")
+            self.assertIn("ETag", response)
+            to_representation.assert_not_called()
+
+        with self.subTest("sparse fieldsets have their own ETag"):
+            etag = self.client.get(user_path)["ETag"]
+            response = self.client.get(
+                user_path, {"fields": "id"}, HTTP_IF_NONE_MATCH=etag
+            )
+            self.assertEqual(response.status_code, 200)
+
+        with self.subTest("user changed"):
+            assert_modified(
+                user_path, lambda: User.objects.filter(pk=user.pk).first().save()
+            )
+
+        with self.subTest("membership changed"):
+            assert_modified(
+                user_path, lambda: self._create_org_user(user=user, organization=org)
+            )
+
+        with self.subTest("groups changed"):
+            assert_modified(user_path, lambda: user.groups.add(group))
+            assert_modified(user_path, lambda: group.user_set.clear())
+
+        with self.subTest("permissions changed"):
+            permission = Permission.objects.filter(codename="view_group").first()
+            assert_modified(user_path, lambda: permission.user_set.add(user))
+            assert_modified(group_path, lambda: group.permissions.add(permission))
+
+        with self.subTest("list changed"):
+            assert_modified(
+                reverse("users:user_list"),
+                lambda: self._create_user(username="user2", email="user2@test.com"),
+            )
+            assert_modified(reverse("users:organization_list"), lambda: org.save())
+
+        with self.subTest("organization owner changed"):
+            OrganizationOwner = load_model("openwisp_users", "OrganizationOwner")
+            assert_modified(
+                org_path,
+                lambda: OrganizationOwner.objects.create(
+                    organization=org,
+                    organization_user=OrganizationUser.objects.get(user=user),
+                ),
+            )
+
+        with self.subTest("permissions are checked before answering 304"):
+            etag = self.client.get(org_path)["ETag"]
+            self.client.logout()
+            response = self.client.get(org_path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 401)
+
     def test_user_detail_no_org_user_api(self):
         user = self._get_user()
         path = reverse("users:user_detail", args=(user.pk,))
@@ -724,7 +1389,7 @@ class TestUsersApi(
 
         with self.subTest("test user list"):
             path = reverse("users:user_list")
-            with self.assertNumQueries(9):
+            with self.assertNumQueries(8):
                 r = self.client.get(path)
             self.assertEqual(r.status_code, 200)
             self.assertNotIn("is_superuser", str(r.content))
@@ -743,18 +1408,48 @@ class TestUsersApi(
 
         with self.subTest("test user detail"):
             path = reverse("users:user_detail", args=(org1_manager.pk,))
-            with self.assertNumQueries(8):
+            with self.assertNumQueries(6):
                 r = self.client.get(path)
             self.assertEqual(r.status_code, 200)
 
         with self.subTest("test update user data"):
             path = reverse("users:user_detail", args=(org1_manager.pk,))
             data = {"username": "changetestuser"}
-            with self.assertNumQueries(13):
+            with self.assertNumQueries(11):
                 r = self.client.patch(path, data, content_type="application/json")
             self.assertEqual(r.status_code, 200)
             self.assertEqual(r.data["username"], "changetestuser")
 
+    def test_user_queryset_with_many_managed_organizations(self):
+        manager = self._create_user(
+            username="manager", password="test123", email="manager@test.com"
+        )
+        view = UserDetailView()
+        view.request = Request(RequestFactory().get("/"))
+        view.request.user = manager
+        for index in range(10):
+            org = self._create_org(name=f"org{index}", slug=f"org{index}")
+            self._create_org_user(organization=org, user=manager, is_admin=True)
+            user = self._create_user(
+                username=f"user{index}", email=f"user{index}@test.com"
+            )
+            self._create_org_user(organization=org, user=user)
+            if index not in (0, 9):
+                continue
+            with self.subTest(managed_organizations=index + 1):
+                # the memoized organizations of the user are refreshed
+                manager = User.objects.get(pk=manager.pk)
+                view.request.user = manager
+                manager.organizations_managed
+                with self.assertNumQueries(1) as context:
+                    users = list(view.get_queryset())
+                self.assertEqual(len(users), index + 2)
+                sql = context.captured_queries[0]["sql"]
+                # a single subquery, regardless of the
+                # number of managed organizations
+                self.assertEqual(sql.count("SELECT"), 2)
+                self.assertNotIn(" OR ", sql)
+
     def test_organization_slug_post_custom_validation_api(self):
         path = reverse("users:organization_list")
         data = {"name": "test-org", "slug": "test-org"}
@@ -1,6 +1,13 @@
+import time
+from unittest.mock import patch
+
+from django.apps import apps
+from django.contrib.auth import SESSION_KEY as AUTH_SESSION_KEY
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
-from django.test import RequestFactory, modify_settings
+from django.db.models.signals import post_delete, post_save
+from django.test import RequestFactory, modify_settings, override_settings
+from django.urls import reverse
 from rest_framework.decorators import (
     api_view,
     authentication_classes,
@@ -11,8 +18,21 @@ from rest_framework.response import Response
 from sesame import settings as sesame_settings
 from sesame.utils import get_token as get_one_time_auth_token_for_user
 
-from openwisp_users.api.authentication import BearerAuthentication, SesameAuthentication
-from openwisp_users.auth import create_auth_token, is_password_based_user
+from openwisp_users import settings as app_settings
+from openwisp_users.api.authentication import (
+    BearerAuthentication,
+    SesameAuthentication,
+    get_sesame_token_cache_key,
+    get_token_cache_key,
+)
+from openwisp_users.auth import (
+    SESAME_BACKEND,
+    SESSION_KEY,
+    create_auth_token,
+    is_password_based_login,
+    is_password_based_user,
+)
+from openwisp_utils.tests import catch_signal
 
 from . import APITestCase
 
@@ -112,3 +132,238 @@ class AuthenticationTests(APITestCase):
         self.assertEqual(response.data["password_based"], False)
         user.refresh_from_db()
         self.assertEqual(user.password_based_token, False)
+
+    def test_create_auth_token_queries(self):
+        user = self.operator
+        Token = apps.get_model("authtoken", "Token")
+
+        with self.subTest("new token"):
+            with self.assertNumQueries(7):
+                token = create_auth_token(None, user)
+            self.assertEqual(Token.objects.get(user=user).key, token.key)
+            user.refresh_from_db()
+            self.assertEqual(user.password_based_token, True)
+
+        with self.subTest("existing token is reused"):
+            with self.assertNumQueries(1):
+                self.assertEqual(create_auth_token(None, user).key, token.key)
+
+        with self.subTest("token renewed"):
+            with self.assertNumQueries(4), catch_signal(
+                post_delete
+            ) as deleted, catch_signal(post_save) as saved:
+                new_token = create_auth_token(None, user, renew=True)
+            self.assertNotEqual(new_token.key, token.key)
+            self.assertEqual(Token.objects.get(user=user).key, new_token.key)
+            # signals are sent as if the token had been replaced
+            deleted.assert_called_once()
+            self.assertEqual(deleted.call_args.kwargs["instance"].key, token.key)
+            saved.assert_called_once()
+            self.assertIs(saved.call_args.kwargs["instance"], new_token)
+            self.assertTrue(saved.call_args.kwargs["created"])
+            # the returned token is bound to its database row
+            self.assertFalse(new_token._state.adding)
+            self.assertEqual(new_token._state.db, "default")
+            token = new_token
+
+        with self.subTest("token renewed with provenance change"):
+            request = self.factory.get("/")
+            request.user = user
+            request.session = {SESSION_KEY: False, AUTH_SESSION_KEY: str(user.pk)}
+            with self.assertNumQueries(5):
+                token = create_auth_token(request, user, renew=True)
+            self.assertEqual(Token.objects.get(user=user).key, token.key)
+            user.refresh_from_db()
+            self.assertEqual(user.password_based_token, False)
+
+        with self.subTest("provenance change"):
+            with self.assertNumQueries(4):
+                self.assertEqual(create_auth_token(None, user).key, token.key)
+            user.refresh_from_db()
+            self.assertEqual(user.password_based_token, True)
+
+        with self.subTest("obtain token endpoint"):
+            with self.assertNumQueries(2):
+                response = self.client.post(
+                    reverse("users:user_auth_token"),
+                    data={"username": user.username, "password": "tester"},
+                )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["token"], token.key)
+
+    @patch.object(app_settings, "BEARER_TOKEN_CACHE_TIMEOUT", 60)
+    def test_bearer_authentication_cache(self):
+        @api_view(["GET"])
+        @permission_classes([IsAuthenticated])
+        @authentication_classes([BearerAuthentication])
+        def my_view(request):
+            return Response(
+                {
+                    "username": request.user.username,
+                    "password_based": is_password_based_login(request),
+                }
+            )
+
+        def get(key):
+            request = self.factory.get("/", HTTP_AUTHORIZATION=f"Bearer {key}")
+            return my_view(request)
+
+        user = self.operator
+        token = create_auth_token(None, user)
+
+        with self.subTest("token is resolved from the cache"):
+            with self.assertNumQueries(1):
+                response = get(token.key)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["username"], user.username)
+            with self.assertNumQueries(0):
+                response = get(token.key)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["password_based"], True)
+
+        with self.subTest("invalid token"):
+            response = get("invalid")
+            self.assertEqual(response.status_code, 401)
+
+        with self.subTest("token provenance changes"):
+            request = self.factory.get("/")
+            request.user = user
+            request.session = {SESSION_KEY: False, AUTH_SESSION_KEY: str(user.pk)}
+            with self.captureOnCommitCallbacks(execute=True):
+                create_auth_token(request, user)
+            response = get(token.key)
+            self.assertEqual(response.data["password_based"], False)
+
+        with self.subTest("token renewed"):
+            with self.captureOnCommitCallbacks(execute=True):
+                new_token = create_auth_token(None, user, renew=True)
+            self.assertEqual(get(token.key).status_code, 401)
+            self.assertEqual(get(new_token.key).status_code, 200)
+            token = new_token
+
+        with self.subTest("cache is invalidated when the transaction is committed"):
+            with self.captureOnCommitCallbacks(execute=True):
+                user.is_active = False
+                user.save()
+                self.assertEqual(get(token.key).status_code, 200)
+            self.assertEqual(get(token.key).status_code, 401)
+            with self.captureOnCommitCallbacks(execute=True):
+                user.is_active = True
+                user.save()
+            self.assertEqual(get(token.key).status_code, 200)
+
+        with self.subTest("user deactivated by admin actions"):
+            path = reverse(f"admin:{User._meta.app_label}_user_changelist")
+            self.client.force_login(self._get_admin())
+            for action, status_code in [("make_inactive", 401), ("make_active", 200)]:
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.post(
+                        path,
+                        {
+                            "_selected_action": [user.pk],
+                            "action": action,
+                            "confirmation": "Confirm",
+                        },
+                    )
+                self.assertEqual(get(token.key).status_code, status_code)
+
+        with self.subTest("API key deleted"):
+            ApiKey = apps.get_model(User._meta.app_label, "ApiKey")
+            with self.captureOnCommitCallbacks(execute=True):
+                ApiKey.objects.get(key=token.key).delete()
+            self.assertEqual(get(token.key).status_code, 401)
+
+    def test_bearer_authentication_cache_disabled(self):
+        token = create_auth_token(None, self.operator)
+        auth = BearerAuthentication()
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                auth.authenticate_credentials(token.key)
+        self.assertIsNone(cache.get(get_token_cache_key(token.key)))
+
+    @patch.object(app_settings, "SESAME_TOKEN_CACHE_TIMEOUT", 60)
+    @modify_settings(AUTHENTICATION_BACKENDS={"append": "sesame.backends.ModelBackend"})
+    def test_sesame_authentication_cache(self):
+        @api_view(["GET"])
+        @permission_classes([IsAuthenticated])
+        @authentication_classes([SesameAuthentication])
+        def my_view(request):
+            return Response({"backend": request.user.backend})
+
+        def get(key):
+            request = self.factory.get(
+                "/", HTTP_AUTHORIZATION=f"{sesame_settings.TOKEN_NAME} {key}"
+            )
+            return my_view(request)
+
+        user = self.operator
+        token = get_one_time_auth_token_for_user(user)
+
+        with self.subTest("verified token is cached"):
+            with self.assertNumQueries(1):
+                response = get(token)
+            self.assertEqual(response.status_code, 200)
+            with self.assertNumQueries(0):
+                response = get(token)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["backend"], SESAME_BACKEND)
+
+        with self.subTest("invalid token"):
+            self.assertEqual(get("invalid").status_code, 403)
+
+        with self.subTest("changing the password revokes the cached token"):
+            with self.captureOnCommitCallbacks(execute=True):
+                user.set_password("changed")
+                user.save()
+                # cache is invalidated when the transaction is committed
+                self.assertEqual(get(token).status_code, 200)
+            self.assertEqual(get(token).status_code, 403)
+            token = get_one_time_auth_token_for_user(user)
+            self.assertEqual(get(token).status_code, 200)
+
+        with self.subTest("user deactivated"):
+            with self.captureOnCommitCallbacks(execute=True):
+                user.is_active = False
+                user.save()
+            self.assertEqual(get(token).status_code, 403)
+            with self.captureOnCommitCallbacks(execute=True):
+                user.is_active = True
+                user.save()
+
+        with self.subTest("user deactivated by admin actions"):
+            path = reverse(f"admin:{User._meta.app_label}_user_changelist")
+            self.client.force_login(self._get_admin())
+            token = get_one_time_auth_token_for_user(user)
+            self.assertEqual(get(token).status_code, 200)
+            for action, status_code in [("make_inactive", 403), ("make_active", 200)]:
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.post(
+                        path,
+                        {
+                            "_selected_action": [user.pk],
+                            "action": action,
+                            "confirmation": "Confirm",
+                        },
+                    )
+                self.assertEqual(get(token).status_code, status_code)
+
+        with override_settings(SESAME_MAX_AGE=300):
+            token = get_one_time_auth_token_for_user(user)
+            with self.subTest("token valid for the whole timeout is cached"):
+                self.assertEqual(get(token).status_code, 200)
+                with self.assertNumQueries(0):
+                    self.assertEqual(get(token).status_code, 200)
+
+            with self.subTest("token expiring within the timeout is not cached"):
+                cache.clear()
+                with patch("time.time", return_value=time.time() + 270):
+                    self.assertEqual(get(token).status_code, 200)
+                    self.assertIsNone(cache.get(get_sesame_token_cache_key(token)))
+                with patch("time.time", return_value=time.time() + 301):
+                    self.assertEqual(get(token).status_code, 403)
+
+        with override_settings(SESAME_ONE_TIME=True):
+            with self.subTest("one-time tokens are not cached"):
+                token = get_one_time_auth_token_for_user(user)
+                self.assertEqual(get(token).status_code, 200)
+                self.assertEqual(get(token).status_code, 403)
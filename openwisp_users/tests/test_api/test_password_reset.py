@@ -1,8 +1,10 @@
+import pickle
 import re
 from html import unescape
 from unittest.mock import patch
 from urllib.parse import urlparse
 
+from django.contrib.auth.hashers import check_password
 from django.core import mail
 from django.core.cache import cache
 from django.test import TestCase
@@ -307,3 +309,33 @@ class TestPasswordChangeAPI(TestOrganizationMixin, TestCase):
         self.assertIn("old_password", response.data)
         user.refresh_from_db()
         self.assertEqual(user.check_password("tester"), True)
+
+    def test_password_change_hashes_same_password_once(self):
+        user = self._create_user(username="tester", password="tester")
+        self.client.force_login(user)
+        with patch(
+            "django.contrib.auth.base_user.check_password",
+            wraps=check_password,
+        ) as mocked_check_password:
+            response = self.client.post(
+                self.change_url,
+                {
+                    "old_password": "tester",
+                    "new_password1": "tester",
+                    "new_password2": "tester",
+                },
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("new_password2", response.data)
+        # the current password is verified once, the result is
+        # reused by PasswordReuseValidator for the new password
+        self.assertEqual(mocked_check_password.call_count, 1)
+
+    def test_password_check_memo_discarded_on_password_change(self):
+        user = self._create_user(username="tester", password="tester")
+        self.assertEqual(user.check_password("tester"), True)
+        user.set_password("newpassword123")
+        self.assertEqual(user.check_password("tester"), False)
+        self.assertEqual(user.check_password("newpassword123"), True)
+        self.assertNotIn("_password_checks", pickle.loads(pickle.dumps(user)).__dict__)
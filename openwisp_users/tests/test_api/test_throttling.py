@@ -1,7 +1,10 @@
+import time
 from unittest.mock import patch
 
 from django.core.cache import cache
+from django.test import RequestFactory
 from django.urls import reverse
+from rest_framework.request import Request
 
 from openwisp_users.api.throttling import AuthRateThrottle
 
@@ -27,6 +30,37 @@ class RatelimitTests(APITestCase):
         r = self.client.post(url, data)
         self.assertEqual(r.status_code, 429)
 
+    def test_gcra_throttle(self):
+        AuthRateThrottle.rate = "3/min"
+        request = RequestFactory().post("/", REMOTE_ADDR="10.0.0.1")
+        now = time.time()
+
+        def allow_request(offset):
+            throttle = AuthRateThrottle()
+            with patch.object(throttle, "timer", return_value=now + offset):
+                return throttle.allow_request(Request(request), None), throttle
+
+        with self.subTest("burst of num_requests"):
+            for _ in range(3):
+                self.assertEqual(allow_request(0)[0], True)
+            allowed, throttle = allow_request(0)
+            self.assertEqual(allowed, False)
+            self.assertAlmostEqual(throttle.wait(), 20, delta=0.01)
+
+        with self.subTest("cache entry has constant size"):
+            # the theoretical arrival time of the next request
+            self.assertEqual(cache.get(throttle.key), int(now * 1000) + 60000)
+
+        with self.subTest("requests are replenished at a constant pace"):
+            self.assertEqual(allow_request(20)[0], True)
+            self.assertEqual(allow_request(20)[0], False)
+            self.assertEqual(allow_request(40)[0], True)
+
+        with self.subTest("burst available after idle period"):
+            for _ in range(3):
+                self.assertEqual(allow_request(200)[0], True)
+            self.assertEqual(allow_request(200)[0], False)
+
     def test_auth_rate_throttle_can_be_disabled(self):
         AuthRateThrottle.rate = None
         url = reverse("users:user_auth_token")
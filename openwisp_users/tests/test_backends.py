@@ -1,11 +1,23 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest import mock
 from uuid import UUID
 
-from django.test import TestCase
+import phonenumbers
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
 from django.test.utils import override_settings
 
 from openwisp_users import settings as users_settings
-from openwisp_users.backends import UsersAuthenticationBackend
+from openwisp_users.backends import UsersAuthenticationBackend, _parse_phone_numbers
+from openwisp_users.lockout import (
+    get_lockout_cache_key,
+    get_lockout_deadline_cache_key,
+    get_login_lockout_stats,
+    record_login_failure,
+)
 
 from .utils import TestOrganizationMixin
 
@@ -111,6 +123,12 @@ class TestBackends(TestOrganizationMixin, TestCase):
         with self.subTest("get user with username"):
             self.assertEqual(auth_backend.get_users(user.username)[0], user)
 
+        with self.subTest("users with the same precedence are ordered by pk"):
+            self.assertEqual(
+                auth_backend.get_users(user.username).query.order_by,
+                ("_identifier_precedence", "pk"),
+            )
+
     @override_settings(
         AUTHENTICATION_BACKENDS=("openwisp_users.backends.UsersAuthenticationBackend",),
     )
@@ -157,6 +175,267 @@ class TestBackends(TestOrganizationMixin, TestCase):
             )
             self.assertEqual(auth_backend.get_users("911524370").count(), 0)
 
+    @mock.patch.object(users_settings, "AUTH_BACKEND_AUTO_PREFIXES", ("+39", "+51"))
+    def test_get_phone_numbers(self):
+        _parse_phone_numbers.cache_clear()
+        with mock.patch(
+            "openwisp_users.backends.phonenumbers.parse", wraps=phonenumbers.parse
+        ) as mocked_parse:
+            with self.subTest("usernames and emails are not parsed"):
+                for identifier in ["tester", "tester@test.com", "366-tester", ""]:
+                    self.assertEqual(auth_backend._get_phone_numbers(identifier), ())
+                mocked_parse.assert_not_called()
+
+            with self.subTest("numbers are normalized to E.164"):
+                self.assertEqual(
+                    auth_backend._get_phone_numbers("+39 366.52 43-702"),
+                    ("+393665243702",),
+                )
+                # prefixes are not tried on international numbers
+                mocked_parse.assert_called_once()
+
+            with self.subTest("prefixes and leading zero"):
+                mocked_parse.reset_mock()
+                self.assertEqual(
+                    auth_backend._get_phone_numbers("03665243702"),
+                    (
+                        "+3903665243702",
+                        "+393665243702",
+                        "+513665243702",
+                    ),
+                )
+                self.assertEqual(mocked_parse.call_count, 6)
+
+            with self.subTest("results are memoized"):
+                mocked_parse.reset_mock()
+                auth_backend._get_phone_numbers("03665243702")
+                auth_backend._get_phone_numbers("+39 366.52 43-702")
+                mocked_parse.assert_not_called()
+
+        with self.subTest("prefixes setting changes"):
+            with mock.patch.object(
+                users_settings, "AUTH_BACKEND_AUTO_PREFIXES", ("+39",)
+            ):
+                self.assertEqual(
+                    auth_backend._get_phone_numbers("3665243702"), ("+393665243702",)
+                )
+
+    def test_authenticate_one_password_check(self):
+        identifier = "+237675579231"
+        phone_user = self._create_user(
+            username="tester",
+            email="tester@gmail.com",
+            phone_number=identifier,
+            password="tester",
+        )
+        self._create_user(
+            username=identifier,
+            email="tester1@gmail.com",
+            phone_number="+237675579232",
+            password="tester1",
+        )
+        self._create_user(
+            username="tester@gmail.com",
+            email="tester2@gmail.com",
+            password="tester2",
+        )
+        User = phone_user._meta.model
+
+        with self.subTest("identifier matching multiple users"):
+            with mock.patch.object(
+                User, "check_password", autospec=True, return_value=False
+            ) as mocked_check, self.assertNumQueries(1):
+                self.assertIsNone(auth_backend.authenticate(None, identifier, "wrong"))
+            mocked_check.assert_called_once()
+            self.assertEqual(mocked_check.call_args.args[0], phone_user)
+
+        with self.subTest("phone number takes precedence over username"):
+            self.assertEqual(
+                auth_backend.authenticate(None, identifier, "tester"), phone_user
+            )
+            self.assertIsNone(auth_backend.authenticate(None, identifier, "tester1"))
+
+        with self.subTest("email takes precedence over username"):
+            self.assertEqual(
+                auth_backend.authenticate(None, "tester@gmail.com", "tester"),
+                phone_user,
+            )
+            self.assertIsNone(
+                auth_backend.authenticate(None, "tester@gmail.com", "tester2")
+            )
+
+        with self.subTest("inactive users don't shadow active users"):
+            User.objects.filter(pk=phone_user.pk).update(is_active=False)
+            with mock.patch.object(
+                User, "check_password", autospec=True, return_value=True
+            ) as mocked_check, self.assertNumQueries(1):
+                user = auth_backend.authenticate(None, "tester@gmail.com", "tester2")
+            self.assertEqual(user.username, "tester@gmail.com")
+            mocked_check.assert_called_once()
+            self.assertEqual(
+                auth_backend.authenticate(None, identifier, "tester1").username,
+                identifier,
+            )
+            User.objects.filter(pk=phone_user.pk).update(is_active=True)
+
+        with self.subTest("password is hashed when nothing matches"):
+            with mock.patch.object(
+                User, "set_password", autospec=True
+            ) as mocked_set_password, mock.patch.object(
+                User, "check_password", autospec=True
+            ) as mocked_check, self.assertNumQueries(
+                1
+            ):
+                self.assertIsNone(auth_backend.authenticate(None, "nobody", "tester"))
+            mocked_set_password.assert_called_once()
+            mocked_check.assert_not_called()
+
+    async def test_aauthenticate(self):
+        identifier = "+237675579231"
+        user = await sync_to_async(self._create_user)(
+            username="tester",
+            email="tester@gmail.com",
+            phone_number=identifier,
+            password="tester",
+        )
+        await sync_to_async(self._create_user)(
+            username=identifier,
+            email="tester1@gmail.com",
+            phone_number="+237675579232",
+            password="tester1",
+        )
+
+        with self.subTest("valid credentials"):
+            for username in ["tester", "tester@gmail.com", identifier]:
+                self.assertEqual(
+                    await auth_backend.aauthenticate(None, username, "tester"), user
+                )
+
+        with self.subTest("phone number takes precedence over username"):
+            self.assertIsNone(
+                await auth_backend.aauthenticate(None, identifier, "tester1")
+            )
+
+        with self.subTest("wrong password"):
+            self.assertIsNone(await auth_backend.aauthenticate(None, "tester", "wrong"))
+
+        with self.subTest("password is hashed when nothing matches"):
+            User = user._meta.model
+            threads = []
+            with mock.patch.object(
+                User,
+                "set_password",
+                autospec=True,
+                side_effect=lambda *args: threads.append(threading.get_ident()),
+            ) as mocked_set_password:
+                self.assertIsNone(
+                    await auth_backend.aauthenticate(None, "nobody", "tester")
+                )
+            mocked_set_password.assert_called_once()
+            # the event loop is not blocked by the hash
+            self.assertNotEqual(threads, [threading.get_ident()])
+
+        with self.subTest("inactive user"):
+            user.is_active = False
+            await user.asave()
+            self.assertIsNone(
+                await auth_backend.aauthenticate(None, "tester", "tester")
+            )
+            # the active user with a lower precedence is not shadowed
+            active_user = await auth_backend.aauthenticate(None, identifier, "tester1")
+            self.assertEqual(active_user.username, identifier)
+
+        with self.subTest("missing username"):
+            self.assertIsNone(await auth_backend.aauthenticate(None, None, "tester"))
+
+    @mock.patch.object(users_settings, "LOGIN_LOCKOUT_THRESHOLD", 2)
+    @mock.patch.object(users_settings, "LOGIN_LOCKOUT_IP_THRESHOLD", 5)
+    @mock.patch.object(users_settings, "LOGIN_LOCKOUT_TIMEOUT", 60)
+    @mock.patch.object(users_settings, "LOGIN_LOCKOUT_MAX_TIMEOUT", 3600)
+    def test_login_lockout(self):
+        cache.clear()
+        user = self._create_user(username="tester", password="tester")
+        User = user._meta.model
+        request = RequestFactory().post("/", REMOTE_ADDR="10.0.0.1")
+
+        def authenticate(username, password, ip="10.0.0.1"):
+            request.META["REMOTE_ADDR"] = ip
+            return auth_backend.authenticate(request, username, password)
+
+        with self.subTest("identifier locked out after threshold"):
+            self.assertIsNone(authenticate("tester", "wrong"))
+            self.assertIsNone(authenticate("TESTER", "wrong"))
+            hashes_avoided = get_login_lockout_stats()["hashes_avoided"]
+            with mock.patch.object(
+                User, "check_password", autospec=True
+            ) as mocked_check, self.assertNumQueries(0):
+                self.assertIsNone(authenticate("tester", "tester"))
+            mocked_check.assert_not_called()
+            self.assertEqual(
+                get_login_lockout_stats()["hashes_avoided"], hashes_avoided + 1
+            )
+
+        with self.subTest("lockout expires"):
+            key = get_lockout_cache_key("identifier", "tester")
+            locked_until = cache.get(get_lockout_deadline_cache_key(key))
+            with mock.patch("time.time", return_value=locked_until + 1):
+                self.assertEqual(authenticate("tester", "tester"), user)
+            # the counter is reset by a successful login
+            self.assertIsNone(cache.get(key))
+            self.assertIsNone(cache.get(get_lockout_deadline_cache_key(key)))
+
+        with self.subTest("exponential backoff"):
+            key = get_lockout_cache_key("identifier", "nobody")
+            clock = time.time()
+            lockouts = []
+            for _ in range(5):
+                with mock.patch("time.time", return_value=clock):
+                    self.assertIsNone(authenticate("nobody", "wrong", ip="10.0.0.2"))
+                failures = cache.get(key)
+                locked_until = cache.get(get_lockout_deadline_cache_key(key), 0)
+                lockouts.append(max(locked_until - clock, 0))
+                clock = max(locked_until, clock) + 1
+            self.assertEqual(failures, 5)
+            self.assertEqual(lockouts, [0, 60, 120, 240, 480])
+
+        with self.subTest("IP address locked out after threshold"):
+            for username in ["a", "b", "c", "d", "e"]:
+                self.assertIsNone(authenticate(username, "wrong", ip="10.0.0.3"))
+            with self.assertNumQueries(0):
+                self.assertIsNone(authenticate("tester", "tester", ip="10.0.0.3"))
+            self.assertEqual(authenticate("tester", "tester", ip="10.0.0.4"), user)
+
+        with self.subTest("phone number variants share the same counter"):
+            key = get_lockout_cache_key("identifier", "+393665243702")
+            variants = ["+39 366 524 3702", "+39 366.524.3702", "3665243702"]
+            with mock.patch.object(
+                users_settings, "AUTH_BACKEND_AUTO_PREFIXES", ("+39",)
+            ):
+                for variant in variants:
+                    self.assertEqual(get_lockout_cache_key("identifier", variant), key)
+                    record_login_failure(variant)
+            self.assertEqual(cache.get(key), 3)
+
+        with self.subTest("concurrent failures are all counted"):
+            key = get_lockout_cache_key("identifier", "concurrent")
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                for _ in range(20):
+                    executor.submit(record_login_failure, "concurrent")
+            self.assertEqual(cache.get(key), 20)
+
+    @mock.patch.object(users_settings, "LOGIN_LOCKOUT_THRESHOLD", 1)
+    async def test_alogin_lockout(self):
+        await cache.aclear()
+        await sync_to_async(self._create_user)(username="tester", password="tester")
+        self.assertIsNone(await auth_backend.aauthenticate(None, "tester", "wrong"))
+        with mock.patch.object(
+            UsersAuthenticationBackend, "get_users"
+        ) as mocked_get_users:
+            self.assertIsNone(
+                await auth_backend.aauthenticate(None, "tester", "tester")
+            )
+        mocked_get_users.assert_not_called()
+
     @mock.patch("openwisp_users.backends.UsersAuthenticationBackend.get_users")
     def test_user_auth_without_email(self, mocked_get_users):
         self._create_user(
@@ -2,15 +2,21 @@ import re
 from unittest.mock import patch
 from urllib.parse import urlparse
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user, get_user_model
 from django.core import mail
 from django.test import RequestFactory, TestCase, modify_settings
-from django.urls import reverse
+from django.urls import resolve, reverse
 from django.utils.timezone import now, timedelta
 from rest_framework.authtoken.models import Token
 
 from .. import settings as app_settings
-from ..auth import SESSION_KEY, password_expired_response_payload
+from ..auth import (
+    PASSWORD_EXPIRY_SESSION_KEY,
+    SESSION_KEY,
+    password_expired_response_payload,
+)
+from ..middleware import PasswordExpirationMiddleware
 from .utils import TestOrganizationMixin
 
 User = get_user_model()
@@ -182,6 +188,123 @@ class TestPasswordExpirationMiddleware(TestOrganizationMixin, TestCase):
         admin.refresh_from_db()
         self.assertEqual(admin.check_password("newpassword123"), True)
 
+    def test_password_expiration_disabled(self):
+        self._login_expired_admin()
+        with patch("openwisp_users.middleware.resolve") as mocked_resolve, patch.object(
+            User, "has_password_expired"
+        ) as mocked_has_password_expired:
+            response = self.client.get(reverse("admin:index"))
+        self.assertEqual(response.status_code, 200)
+        mocked_resolve.assert_not_called()
+        mocked_has_password_expired.assert_not_called()
+
+    @patch.object(app_settings, "STAFF_USER_PASSWORD_EXPIRATION", 10)
+    def test_path_resolved_once(self):
+        admin = self._login_expired_admin()
+        token = Token.objects.create(user=admin)
+        with patch(
+            "openwisp_users.middleware.resolve", wraps=resolve
+        ) as mocked_resolve:
+            # the admin does not support Bearer authentication
+            response = self.client.get(
+                reverse("admin:index"), HTTP_AUTHORIZATION=f"Bearer {token.key}"
+            )
+        self.assertEqual(response.status_code, 302)
+        mocked_resolve.assert_called_once()
+
+        with self.subTest("bearer views are collected from the URLconf"):
+            middleware = PasswordExpirationMiddleware(lambda request: None)
+            bearer_views, api_views = middleware._bearer_view_classes
+            user_list_view = resolve(reverse("users:user_list")).func.cls
+            token_view = resolve(reverse("users:user_auth_token")).func.cls
+            self.assertIn(user_list_view, bearer_views)
+            self.assertIn(token_view, api_views)
+            self.assertNotIn(token_view, bearer_views)
+
+    @patch.object(app_settings, "STAFF_USER_PASSWORD_EXPIRATION", 10)
+    def test_expired_password_verdict_cached_in_session(self):
+        admin = self._login_expired_admin()
+        response = self.client.get(reverse("admin:index"))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(PASSWORD_EXPIRY_SESSION_KEY, self.client.session)
+
+        with self.subTest("the verdict is read from the session"):
+            with patch.object(User, "get_password_expiry_date") as mocked:
+                response = self.client.get(reverse("admin:index"))
+            self.assertEqual(response.status_code, 302)
+            mocked.assert_not_called()
+
+        with self.subTest("settings change invalidates the verdict"):
+            with patch.object(app_settings, "STAFF_USER_PASSWORD_EXPIRATION", 365):
+                response = self.client.get(reverse("admin:index"))
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(reverse("admin:index"))
+            self.assertEqual(response.status_code, 302)
+
+        with self.subTest("password change invalidates the verdict"):
+            response = self.client.post(
+                reverse("users:user_password_change"),
+                data={
+                    "old_password": "tester",
+                    "new_password1": "newpassword123",
+                    "new_password2": "newpassword123",
+                },
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(reverse("admin:index"))
+            self.assertEqual(response.status_code, 200)
+
+        with self.subTest("non password based sessions are never blocked"):
+            admin.password_updated = now().date() - timedelta(days=180)
+            admin.save()
+            self.client.force_login(admin)
+            session = self.client.session
+            session[SESSION_KEY] = False
+            session.save()
+            response = self.client.get(reverse("admin:index"))
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(self.client.session[PASSWORD_EXPIRY_SESSION_KEY][1])
+
+    @patch.object(app_settings, "STAFF_USER_PASSWORD_EXPIRATION", 10)
+    async def test_async_expired_password_session(self):
+        admin = await sync_to_async(self._create_admin)(
+            password_updated=now().date() - timedelta(days=180)
+        )
+        await sync_to_async(self.async_client.force_login)(admin)
+
+        with self.subTest("HTML request is redirected"):
+            response = await self.async_client.get(reverse("admin:index"))
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response.url, "/accounts/password/change/?next=/admin/")
+
+        with self.subTest("REST request is blocked"):
+            response = await self.async_client.get(reverse("users:user_list"))
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(response.json()["code"], "password_expired")
+
+        with self.subTest("exempted URL"):
+            response = await self.async_client.get(reverse("account_change_password"))
+            self.assertEqual(response.status_code, 200)
+
+        with self.subTest("password not expired"):
+            admin.password_updated = now().date()
+            await admin.asave()
+            response = await self.async_client.get(reverse("admin:index"))
+            self.assertEqual(response.status_code, 200)
+
+    @patch.object(app_settings, "STAFF_USER_PASSWORD_EXPIRATION", 10)
+    async def test_async_expired_password_login(self):
+        await sync_to_async(self._create_admin)(
+            password_updated=now().date() - timedelta(days=180)
+        )
+        response = await self.async_client.post(
+            reverse("admin:login"),
+            data={"username": "admin", "password": "tester"},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, "/accounts/password/change/?next=/admin/")
+
     @patch.object(app_settings, "USERS_AUTH_API", False)
     def test_payload_omits_api_urls_when_api_is_disabled(self):
         request = RequestFactory().get("/")
@@ -1,10 +1,20 @@
+import os
+import pickle
+import stat
+import tempfile
+import uuid
+from datetime import datetime
+from datetime import timezone as dt_timezone
 from smtplib import SMTPException
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 from allauth.account.models import EmailAddress, get_emailconfirmation_model
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from django.core import mail
-from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import IntegrityError, transaction
 from django.db.models.signals import post_save
 from django.templatetags.l10n import localize
 from django.test import TestCase, override_settings
@@ -15,10 +25,29 @@ from swapper import load_model
 
 from openwisp_utils.tests import catch_signal
 
+from .. import membership
 from .. import settings as app_settings
+from ..local_cache import CacheChannel, FileChannel, LocalCache, LocMemChannel
+from ..membership import (
+    MEMBERSHIP_EPOCH_CACHE_KEY,
+    ROLE_ADMIN,
+    ROLE_OWNER,
+    CompactOrganizations,
+    bulk_membership_changes,
+    bump_membership_epoch,
+    delete_cached_organizations,
+    get_cached_organizations,
+    get_local_cache,
+    get_membership_cache_stats,
+    get_organizations,
+    get_user_cache_key,
+    load_organizations,
+    set_cached_organizations,
+)
 from ..tasks import (
     deactivate_expired_users,
     expiration_reminder_email,
+    invalidate_org_membership_cache,
     password_expiration_email,
 )
 from .utils import TestOrganizationMixin
@@ -134,12 +163,572 @@ class TestUsers(TestOrganizationMixin, TestCase):
         with self.assertNumQueries(0):
             list(user.organizations_dict)
 
-        OrganizationUser.objects.create(user=user, organization=org1)
+        with self.captureOnCommitCallbacks(execute=True):
+            OrganizationUser.objects.create(user=user, organization=org1)
 
         # cache is automatically updated
         with self.assertNumQueries(0):
             list(user.organizations_dict)
 
+    def test_organizations_dict_rebuild_on_commit(self):
+        user1 = self._create_user(username="user1", email="user1@test.com")
+        user2 = self._create_user(username="user2", email="user2@test.com")
+        org1 = self._create_org(name="org1")
+        org2 = self._create_org(name="org2")
+        user1.organizations_dict
+        with patch(
+            "openwisp_users.membership.load_organizations",
+            wraps=load_organizations,
+        ) as mocked:
+            with self.captureOnCommitCallbacks(execute=True):
+                ou = OrganizationUser.objects.create(user=user1, organization=org1)
+                OrganizationUser.objects.create(user=user1, organization=org2)
+                ou.is_admin = True
+                ou.save()
+                OrganizationUser.objects.create(user=user2, organization=org1)
+                with self.subTest("cache is invalidated right away"):
+                    self.assertIsNone(get_cached_organizations(user1.pk))
+                with self.subTest("rebuild is deferred until commit"):
+                    mocked.assert_not_called()
+            with self.subTest("one rebuild for all the changed users"):
+                mocked.assert_called_once()
+                self.assertEqual(set(mocked.call_args.args[0]), {user1.pk, user2.pk})
+        with self.assertNumQueries(0):
+            self.assertTrue(user1.is_manager(org1))
+            self.assertTrue(user1.is_member(org2))
+            self.assertTrue(user2.is_member(org1))
+
+    def test_organizations_dict_invalidated_once_per_transaction(self):
+        user = self._create_user()
+        org1 = self._create_org(name="org1")
+        org2 = self._create_org(name="org2")
+        user.organizations_dict
+        with patch(
+            "openwisp_users.membership.delete_cached_organizations",
+            wraps=delete_cached_organizations,
+        ) as mocked:
+            with self.captureOnCommitCallbacks() as callbacks:
+                ou = OrganizationUser.objects.create(user=user, organization=org1)
+                ou.is_admin = True
+                ou.save()
+                with self.subTest("repeated changes delete the entry once"):
+                    mocked.assert_called_once_with(user.pk)
+                with self.subTest("entry cached again is deleted again"):
+                    self.assertTrue(user.is_manager(org1))
+                    OrganizationUser.objects.create(user=user, organization=org2)
+                    self.assertEqual(mocked.call_count, 2)
+                    self.assertIsNone(get_cached_organizations(user.pk))
+            with self.subTest("one callback per transaction"):
+                rebuilds = [
+                    callback
+                    for callback in callbacks
+                    if getattr(callback, "func", None) is membership._rebuild_pending
+                ]
+                self.assertEqual(len(rebuilds), 1)
+
+    def test_organizations_dict_rollback(self):
+        user1 = self._create_user(username="user1", email="user1@test.com")
+        user2 = self._create_user(username="user2", email="user2@test.com")
+        org = self._create_org()
+        with patch(
+            "openwisp_users.membership.load_organizations",
+            wraps=load_organizations,
+        ) as mocked:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        OrganizationUser.objects.create(user=user1, organization=org)
+                        raise IntegrityError
+                except IntegrityError:
+                    pass
+                OrganizationUser.objects.create(user=user2, organization=org)
+            mocked.assert_called_once()
+            self.assertEqual(set(mocked.call_args.args[0]), {user2.pk})
+
+    def test_bulk_membership_changes(self):
+        users = [
+            self._create_user(username=f"user{i}", email=f"user{i}@test.com")
+            for i in range(3)
+        ]
+        org = self._create_org(name="org1")
+        for user in users:
+            user.organizations_dict
+
+        with self.subTest("batched rebuild"):
+            with patch(
+                "openwisp_users.membership.load_organizations",
+                wraps=load_organizations,
+            ) as mocked:
+                with self.captureOnCommitCallbacks(execute=True):
+                    with bulk_membership_changes():
+                        for user in users:
+                            OrganizationUser.objects.create(user=user, organization=org)
+                        # invalidation is deferred until the block is exited
+                        self.assertEqual(get_cached_organizations(users[0].pk), {})
+                    self.assertIsNone(get_cached_organizations(users[0].pk))
+                mocked.assert_called_once()
+            for user in users:
+                with self.assertNumQueries(0):
+                    self.assertTrue(user.is_member(org))
+
+        with self.subTest("lazy invalidation"):
+            with patch(
+                "openwisp_users.membership.load_organizations",
+                wraps=load_organizations,
+            ) as mocked:
+                with self.captureOnCommitCallbacks(execute=True):
+                    with bulk_membership_changes(rebuild=False):
+                        OrganizationUser.objects.filter(user__in=users).delete()
+                mocked.assert_not_called()
+            for user in users:
+                self.assertIsNone(get_cached_organizations(user.pk))
+                self.assertFalse(user.is_member(org))
+
+    def test_organizations_dict_memo(self):
+        user = self._create_user(username="organizations_pk")
+        org1 = self._create_org(name="org1")
+        org2 = self._create_org(name="org2")
+        OrganizationUser.objects.create(user=user, organization=org1, is_admin=True)
+        user = User.objects.get(pk=user.pk)
+
+        with self.subTest("cache is read only once per instance"):
+            with patch(
+                "openwisp_users.base.models.get_organizations",
+                wraps=get_organizations,
+            ) as mocked:
+                for _ in range(3):
+                    self.assertTrue(user.is_member(org1))
+                    self.assertTrue(user.is_manager(org1))
+                    self.assertTrue(user.is_owner(org1))
+                    self.assertFalse(user.is_member(org2))
+                    self.assertEqual(user.organizations_managed, [str(org1.pk)])
+                    self.assertEqual(user.organizations_owned, [str(org1.pk)])
+                    self.assertTrue(user.is_owner_of_any_organization)
+                    user.organizations_dict
+            mocked.assert_called_once()
+
+        with self.subTest("membership changed through another instance"):
+            OrganizationUser.objects.create(
+                user=User.objects.get(pk=user.pk), organization=org2
+            )
+            self.assertTrue(user.is_member(org2))
+            self.assertFalse(user.is_manager(org2))
+            self.assertEqual(user.organizations_managed, [str(org1.pk)])
+
+        with self.subTest("returned lists cannot alter the memo"):
+            user.organizations_managed.append(str(org2.pk))
+            self.assertEqual(user.organizations_managed, [str(org1.pk)])
+
+    def test_prefetch_organizations(self):
+        org1 = self._create_org(name="org1")
+        org2 = self._create_org(name="org2")
+        disabled_org = self._create_org(name="org3", is_active=False)
+        user1 = self._create_user(username="user1", email="user1@test.com")
+        user2 = self._create_user(username="user2", email="user2@test.com")
+        user3 = self._create_user(username="user3", email="user3@test.com")
+        OrganizationUser.objects.create(user=user1, organization=org1, is_admin=True)
+        OrganizationUser.objects.create(user=user2, organization=org1)
+        OrganizationUser.objects.create(user=user2, organization=org2, is_admin=True)
+        OrganizationUser.objects.create(user=user3, organization=disabled_org)
+        # only the membership of user1 is cached
+        cache.delete_many([get_user_cache_key(user.pk) for user in [user2, user3]])
+        users = list(
+            User.objects.filter(username__startswith="user").order_by("username")
+        )
+
+        with self.subTest("one query for all the cache misses"):
+            with (
+                patch("openwisp_users.membership.cache", wraps=cache) as mocked_cache,
+                self.assertNumQueries(1),
+            ):
+                self.assertEqual(User.objects.prefetch_organizations(users), users)
+            mocked_cache.get_many.assert_called_once()
+            mocked_cache.set_many.assert_called_once()
+            mocked_cache.get.assert_not_called()
+            with self.assertNumQueries(0):
+                self.assertTrue(users[0].is_owner(org1))
+                self.assertTrue(users[1].is_member(org1))
+                self.assertFalse(users[1].is_manager(org1))
+                self.assertTrue(users[1].is_manager(org2))
+                self.assertEqual(users[2].organizations_dict, {})
+            self.assertEqual(
+                users[1].organizations_dict,
+                {
+                    str(org1.pk): {"is_admin": False, "is_owner": False},
+                    str(org2.pk): {"is_admin": True, "is_owner": True},
+                },
+            )
+
+        with self.subTest("all users are cached"):
+            users = list(
+                User.objects.filter(username__startswith="user").order_by("username")
+            )
+            with self.assertNumQueries(0):
+                User.objects.prefetch_organizations(users)
+                self.assertTrue(users[1].is_manager(org2))
+
+        with self.subTest("prefetched data is invalidated"):
+            OrganizationUser.objects.filter(user=user2, organization=org2).delete()
+            self.assertFalse(users[1].is_member(org2))
+
+        with self.subTest("empty list"):
+            with self.assertNumQueries(0):
+                self.assertEqual(User.objects.prefetch_organizations([]), [])
+
+    @patch.object(app_settings, "MEMBERSHIP_CACHE_COMPACT", True)
+    def test_organizations_compact_cache(self):
+        user = self._create_user()
+        org1 = self._create_org(name="org1")
+        org2 = self._create_org(name="org2")
+        org3 = self._create_org(name="org3")
+        with self.captureOnCommitCallbacks(execute=True):
+            OrganizationUser.objects.create(user=user, organization=org1, is_admin=True)
+            OrganizationUser.objects.create(user=user, organization=org2)
+        expected = {
+            str(org1.pk): {"is_admin": True, "is_owner": True},
+            str(org2.pk): {"is_admin": False, "is_owner": False},
+        }
+        cached = cache.get(get_user_cache_key(user.pk))[1]
+        self.assertIsInstance(cached, bytes)
+        self.assertEqual(len(cached), 34)
+        user = User.objects.get(pk=user.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(user.is_member(org1))
+            self.assertTrue(user.is_manager(org1))
+            self.assertTrue(user.is_owner(org1))
+            self.assertTrue(user.is_member(org2.pk))
+            self.assertFalse(user.is_manager(str(org2.pk)))
+            self.assertFalse(user.is_owner(org2))
+            self.assertFalse(user.is_member(org3))
+            self.assertFalse(user.is_manager(org3))
+            self.assertFalse(user.is_member("invalid"))
+            self.assertFalse(user.is_member(None))
+            self.assertEqual(user.organizations_managed, [str(org1.pk)])
+            self.assertEqual(user.organizations_owned, [str(org1.pk)])
+            self.assertTrue(user.is_owner_of_any_organization)
+            self.assertEqual(user.organizations_dict, expected)
+
+        with self.subTest("setting changed while entries are cached"):
+            with patch.object(app_settings, "MEMBERSHIP_CACHE_COMPACT", False):
+                user = User.objects.get(pk=user.pk)
+                with self.assertNumQueries(0):
+                    self.assertEqual(user.organizations_dict, expected)
+
+    def test_compact_organizations(self):
+        organizations = {}
+        for i in range(1000):
+            organizations[str(uuid.uuid4())] = {
+                "is_admin": bool(i % 2),
+                "is_owner": not i % 3,
+            }
+        compact = CompactOrganizations.from_dict(organizations)
+        self.assertEqual(len(compact), 1000)
+        self.assertEqual(compact.to_dict(), organizations)
+        for org_pk, options in organizations.items():
+            role = compact.get_role(org_pk)
+            self.assertEqual(bool(role & ROLE_ADMIN), options["is_admin"])
+            self.assertEqual(bool(role & ROLE_OWNER), options["is_owner"])
+        self.assertIsNone(compact.get_role(str(uuid.uuid4())))
+        # the compact data takes less than half of the space
+        self.assertLess(
+            len(pickle.dumps(compact.data)) * 2, len(pickle.dumps(organizations))
+        )
+        empty = CompactOrganizations.from_dict({})
+        self.assertEqual(len(empty), 0)
+        self.assertIsNone(empty.get_role(str(uuid.uuid4())))
+
+    def test_organizations_dict_stampede(self):
+        org = self._create_org()
+        user = self._create_user()
+        OrganizationUser.objects.create(user=user, organization=org, is_admin=True)
+        expected = {str(org.pk): {"is_admin": True, "is_owner": True}}
+        cache_key = get_user_cache_key(user.pk)
+        lock_key = f"{cache_key}_lock"
+
+        with self.subTest("lock is released after loading"):
+            with self.assertNumQueries(1):
+                self.assertEqual(get_organizations(user.pk), expected)
+            self.assertIsNone(cache.get(lock_key))
+
+        with self.subTest("stale entry is served while another process loads"):
+            bump_membership_epoch()
+            cache.add(lock_key, True)
+            with self.assertNumQueries(0):
+                self.assertEqual(get_organizations(user.pk), expected)
+            cache.delete(lock_key)
+
+        with self.subTest("wait for the process holding the lock"):
+            cache.delete(cache_key)
+            cache.add(lock_key, True)
+
+            def set_entry(*args):
+                set_cached_organizations(
+                    user.pk, expected, membership.get_membership_epoch()
+                )
+
+            with patch("openwisp_users.membership.time.sleep", side_effect=set_entry):
+                with self.assertNumQueries(0):
+                    self.assertEqual(get_organizations(user.pk), expected)
+
+        with self.subTest("give up waiting"):
+            cache.delete(cache_key)
+            with patch("openwisp_users.membership.time.sleep") as mocked_sleep:
+                with self.assertNumQueries(1):
+                    self.assertEqual(get_organizations(user.pk), expected)
+            self.assertEqual(mocked_sleep.call_count, 10)
+            cache.delete(lock_key)
+
+        with self.subTest("early refresh before the expiration"):
+            self.assertEqual(len(cache.get(cache_key)), 4)
+            with self.assertNumQueries(0):
+                get_organizations(user.pk)
+            expires = cache.get(cache_key)[2]
+            with (
+                freeze_time(datetime.fromtimestamp(expires - 1, tz=dt_timezone.utc)),
+                patch("openwisp_users.membership.random.random", return_value=0.9999),
+                patch.object(membership, "MEMBERSHIP_EARLY_REFRESH_BETA", 10**6),
+            ):
+                with self.assertNumQueries(1):
+                    self.assertEqual(get_organizations(user.pk), expected)
+            self.assertGreater(cache.get(cache_key)[2], expires)
+
+    def test_local_cache(self):
+        with self.subTest("LRU eviction"):
+            local_cache = LocalCache(2, 30, LocMemChannel())
+            local_cache.set("a", 1)
+            local_cache.set("b", 2)
+            self.assertEqual(local_cache.get("a"), 1)
+            local_cache.set("c", 3)
+            self.assertIsNone(local_cache.get("b"))
+            self.assertEqual(local_cache.get("a"), 1)
+            self.assertEqual(local_cache.get("c"), 3)
+
+        with self.subTest("entries expire after the timeout"):
+            with freeze_time() as frozen_time:
+                local_cache = LocalCache(2, 30, LocMemChannel())
+                local_cache.set("a", 1)
+                frozen_time.tick(timedelta(seconds=31))
+                self.assertIsNone(local_cache.get("a"))
+
+        with self.subTest("stale values are not stored"):
+            local_cache = LocalCache(2, 30, LocMemChannel())
+            generation = local_cache.generation
+            local_cache.delete_many(["a"])
+            local_cache.set("a", 1, generation)
+            self.assertIsNone(local_cache.get("a"))
+
+        with self.subTest("hit ratio"):
+            self.assertEqual(
+                local_cache.get_stats(),
+                {"hits": 0, "misses": 1, "hit_ratio": 0, "size": 0},
+            )
+
+    def test_file_channel(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "invalidations")
+            on_invalidate = Mock()
+            # local caches of two different processes
+            worker1 = LocalCache(10, 30, FileChannel(path, poll_interval=0))
+            worker2 = LocalCache(
+                10, 30, FileChannel(path, poll_interval=0), on_invalidate
+            )
+            for worker in [worker1, worker2]:
+                worker.set("a", 1)
+                worker.set("b", 2)
+
+            with self.subTest("keys are evicted in every process"):
+                worker1.delete_many(["a"])
+                self.assertIsNone(worker1.get("a"))
+                self.assertIsNone(worker2.get("a"))
+                self.assertEqual(worker2.get("b"), 2)
+                on_invalidate.assert_called_once()
+
+            with self.subTest("clear"):
+                worker1.clear()
+                self.assertIsNone(worker2.get("b"))
+
+            with self.subTest("rotation clears the cache"):
+                worker1.channel.max_size = 10
+                worker2.set("b", 2)
+                worker1.delete_many(["abcdefghijklmnopq"])
+                self.assertIsNone(worker2.get("b"))
+                self.assertLess(os.path.getsize(path), 10)
+                worker2.set("b", 2)
+                worker1.delete_many(["a"])
+                self.assertEqual(worker2.get("b"), 2)
+
+    def test_file_channel_default_path(self):
+        with (
+            tempfile.TemporaryDirectory() as tmpdir,
+            patch("tempfile.gettempdir", return_value=tmpdir),
+        ):
+            private_dir = os.path.join(tmpdir, f"openwisp-users-{os.getuid()}")
+
+            with self.subTest("private directory is created"):
+                channel = FileChannel()
+                self.assertEqual(os.path.dirname(channel.path), private_dir)
+                self.assertEqual(stat.S_IMODE(os.stat(private_dir).st_mode), 0o700)
+                self.assertEqual(FileChannel().path, channel.path)
+
+            with self.subTest("directory accessible by other users"):
+                os.chmod(private_dir, 0o777)
+                with self.assertRaises(ImproperlyConfigured):
+                    FileChannel()
+
+            with self.subTest("symlink to another directory"):
+                os.rmdir(private_dir)
+                os.symlink(tmpdir, private_dir)
+                with self.assertRaises(ImproperlyConfigured):
+                    FileChannel()
+
+    def test_cache_channel(self):
+        worker1 = LocalCache(10, 30, CacheChannel(poll_interval=0))
+        worker2 = LocalCache(10, 30, CacheChannel(poll_interval=0))
+        for worker in [worker1, worker2]:
+            worker.set("a", 1)
+            worker.set("b", 2)
+
+        with self.subTest("keys are evicted in every process"):
+            worker1.delete_many(["a"])
+            self.assertIsNone(worker2.get("a"))
+            self.assertEqual(worker2.get("b"), 2)
+
+        with self.subTest("lost messages clear the cache"):
+            worker2.set("a", 1)
+            worker1.delete_many(["c"])
+            channel = worker1.channel
+            cache.delete(channel._get_message_key(cache.get(channel._counter_key)))
+            self.assertIsNone(worker2.get("a"))
+            self.assertIsNone(worker2.get("b"))
+
+        with self.subTest("evicted counter clears the cache"):
+            worker2.set("b", 2)
+            cache.delete(worker1.channel._counter_key)
+            worker1.delete_many(["c"])
+            self.assertIsNone(worker2.get("b"))
+
+        with self.subTest("backlog too long clears the cache"):
+            worker2.set("b", 2)
+            worker1.channel.max_backlog = worker2.channel.max_backlog = 2
+            for key in ["c", "d", "e"]:
+                worker1.delete_many([key])
+            self.assertIsNone(worker2.get("b"))
+
+    def test_local_cache_requires_cross_host_channel(self):
+        for channel in [
+            {"BACKEND": "openwisp_users.local_cache.LocMemChannel"},
+            # the Django cache of the tests is not shared across hosts
+            {"BACKEND": "openwisp_users.local_cache.CacheChannel"},
+        ]:
+            with (
+                self.subTest(channel["BACKEND"]),
+                patch.object(app_settings, "MEMBERSHIP_LOCAL_CACHE_SIZE", 10),
+                patch.object(app_settings, "MEMBERSHIP_INVALIDATION_CHANNEL", channel),
+                patch.object(membership, "_local_cache", None),
+                self.assertRaises(ImproperlyConfigured),
+            ):
+                get_local_cache()
+
+    def test_organizations_local_cache(self):
+        org = self._create_org()
+        user = self._create_user()
+        with self.captureOnCommitCallbacks(execute=True):
+            OrganizationUser.objects.create(user=user, organization=org, is_admin=True)
+        expected = {str(org.pk): {"is_admin": True, "is_owner": True}}
+        local_cache = LocalCache(10, 30, LocMemChannel())
+        with (
+            patch.object(app_settings, "MEMBERSHIP_LOCAL_CACHE_SIZE", 10),
+            patch.object(membership, "_local_cache", local_cache),
+            patch.object(membership, "_remote_stats", membership._CacheStats()),
+        ):
+            with self.subTest("the remote cache is read once"):
+                with patch(
+                    "openwisp_users.membership.cache.get_many", wraps=cache.get_many
+                ) as mocked:
+                    for _ in range(3):
+                        self.assertTrue(User.objects.get(pk=user.pk).is_manager(org))
+                    self.assertEqual(
+                        User.objects.prefetch_organizations(
+                            [User.objects.get(pk=user.pk)]
+                        )[0].organizations_dict,
+                        user.organizations_dict,
+                    )
+                mocked.assert_called_once()
+
+            with self.subTest("cached organizations can't be changed"):
+                organizations = User.objects.get(pk=user.pk).organizations_dict
+                with self.assertRaises(TypeError):
+                    organizations[str(uuid.uuid4())] = {"is_admin": True}
+                with self.assertRaises(TypeError):
+                    organizations[str(org.pk)]["is_admin"] = False
+                self.assertEqual(pickle.loads(pickle.dumps(organizations)), expected)
+
+            with self.subTest("membership changes evict the entry"):
+                with self.captureOnCommitCallbacks(execute=True):
+                    OrganizationUser.objects.filter(user=user).delete()
+                self.assertFalse(User.objects.get(pk=user.pk).is_member(org))
+
+            with self.subTest("epoch changes clear the local cache"):
+                local_cache.set(user.pk, {str(org.pk): {}})
+                bump_membership_epoch()
+                self.assertIsNone(local_cache.get(user.pk))
+
+            with self.subTest("hit ratio of each tier"):
+                stats = get_membership_cache_stats()
+                self.assertEqual(stats["local"]["hits"], 5)
+                self.assertEqual(stats["local"]["misses"], 3)
+                self.assertEqual(stats["remote"]["hits"], 2)
+                self.assertEqual(stats["remote"]["misses"], 0)
+                self.assertEqual(stats["remote"]["hit_ratio"], 1)
+
+    async def test_async_organizations_dict(self):
+        org = await sync_to_async(self._create_org)()
+        user = await sync_to_async(self._create_user)()
+        await OrganizationUser.objects.acreate(
+            user=user, organization=org, is_admin=True
+        )
+        expected = {str(org.pk): {"is_admin": True, "is_owner": True}}
+        cache_key = get_user_cache_key(user.pk)
+        lock_key = f"{cache_key}_lock"
+        await cache.adelete(cache_key)
+
+        with self.subTest("loaded with the async ORM and cached"):
+            user = await User.objects.aget(pk=user.pk)
+            self.assertEqual(await user.aorganizations_dict(), expected)
+            self.assertEqual(get_cached_organizations(user.pk), expected)
+            self.assertTrue(await user.ais_member(org))
+            self.assertTrue(await user.ais_manager(str(org.pk)))
+            self.assertTrue(await user.ais_owner(org.pk))
+            self.assertFalse(await user.ais_member(str(uuid.uuid4())))
+
+        with self.subTest("the memo is reused"):
+            with patch(
+                "openwisp_users.base.models.aget_organizations"
+            ) as mocked_get_organizations:
+                self.assertTrue(await user.ais_manager(org))
+            mocked_get_organizations.assert_not_called()
+
+        with self.subTest("read from the cache"):
+            user = await User.objects.aget(pk=user.pk)
+            with patch("openwisp_users.membership.aload_organizations") as mocked_load:
+                self.assertEqual(await user.aorganizations_dict(), expected)
+            mocked_load.assert_not_called()
+
+        with self.subTest("wait for the process holding the lock"):
+            await cache.adelete(cache_key)
+            await cache.aadd(lock_key, True)
+
+            async def set_entry(*args):
+                set_cached_organizations(
+                    user.pk, expected, membership.get_membership_epoch()
+                )
+
+            with patch(
+                "openwisp_users.membership.asyncio.sleep", side_effect=set_entry
+            ):
+                self.assertEqual(await membership.aget_organizations(user.pk), expected)
+            await cache.adelete(lock_key)
+
     def test_is_member(self):
         user = self._create_user(username="organizations_pk")
         org1 = self._create_org(name="org1")
@@ -246,6 +835,58 @@ class TestUsers(TestOrganizationMixin, TestCase):
         org.save()
         self.assertEqual(user1.is_member(org), False)
 
+    def test_org_status_change_membership_epoch(self):
+        org = self._create_org(name="testorg1")
+        users = []
+        for i in range(3):
+            user = self._create_user(username=f"user{i}", email=f"user{i}@test.com")
+            self._create_org_user(user=user, organization=org)
+            self.assertEqual(user.is_member(org), True)
+            users.append(user)
+        epoch = cache.get(MEMBERSHIP_EPOCH_CACHE_KEY)
+
+        with self.subTest("disabling the org does not iterate its members"):
+            org.is_active = False
+            # 1 query to fetch the old status, 1 to update the org
+            with self.assertNumQueries(2):
+                org.save()
+            self.assertNotEqual(cache.get(MEMBERSHIP_EPOCH_CACHE_KEY), epoch)
+            # stale entries are detected lazily
+            for user in users:
+                self.assertIsNotNone(cache.get(get_user_cache_key(user.pk)))
+                self.assertEqual(user.is_member(org), False)
+
+        with self.subTest("enabling the org again"):
+            org.is_active = True
+            org.save()
+            for user in users:
+                self.assertEqual(user.is_member(org), True)
+
+        with self.subTest("missing epoch invalidates cached entries"):
+            cache.delete(MEMBERSHIP_EPOCH_CACHE_KEY)
+            user = User.objects.get(pk=users[0].pk)
+            with self.assertNumQueries(1):
+                self.assertEqual(user.is_member(org), True)
+            user = User.objects.get(pk=users[0].pk)
+            with self.assertNumQueries(0):
+                self.assertEqual(user.is_member(org), True)
+
+        with self.subTest("legacy cache entries are ignored"):
+            cache.set(get_user_cache_key(users[0].pk), {})
+            user = User.objects.get(pk=users[0].pk)
+            with self.assertNumQueries(1):
+                self.assertEqual(user.is_member(org), True)
+
+    def test_invalidate_org_membership_cache_task(self):
+        org = self._create_org(name="testorg1")
+        user = self._create_user()
+        self._create_org_user(user=user, organization=org)
+        self.assertEqual(user.is_member(org), True)
+        Organization.objects.filter(pk=org.pk).update(is_active=False)
+        self.assertEqual(user.is_member(org), True)
+        invalidate_org_membership_cache.delay(org.pk)
+        self.assertEqual(user.is_member(org), False)
+
     def test_organizations_managed(self):
         user = self._create_user(username="organizations_pk")
         self.assertEqual(user.organizations_managed, [])
@@ -275,9 +275,12 @@ class TestFilterClasses(AssertNumQueriesSubTestMixin, TestMultitenancyMixin, Tes
 
     def test_get_book_nested_shelf(self):
         administrator = self._create_administrator()
-        self._create_org_user(
-            user=administrator, is_admin=True, organization=self._get_org("org_a")
-        )
+        # the organizations of the user are cached once the transaction is
+        # committed, which doesn't happen on its own within a TestCase
+        with self.captureOnCommitCallbacks(execute=True):
+            self._create_org_user(
+                user=administrator, is_admin=True, organization=self._get_org("org_a")
+            )
         token = self._obtain_auth_token(administrator)
         url = reverse("test_book_nested_shelf")
         with self.assertNumQueries(8):
@@ -287,9 +290,12 @@ class TestFilterClasses(AssertNumQueriesSubTestMixin, TestMultitenancyMixin, Tes
     def test_post_book_nested_shelf(self):
         org1 = self._get_org("org_a")
         administrator = self._create_administrator()
-        self._create_org_user(
-            user=administrator, is_admin=True, organization=self._get_org("org_a")
-        )
+        # the organizations of the user are cached once the transaction is
+        # committed, which doesn't happen on its own within a TestCase
+        with self.captureOnCommitCallbacks(execute=True):
+            self._create_org_user(
+                user=administrator, is_admin=True, organization=self._get_org("org_a")
+            )
         token = self._obtain_auth_token(administrator)
         url = reverse("test_book_nested_shelf")
         data = {
@@ -312,7 +318,8 @@ class TestFilterClasses(AssertNumQueriesSubTestMixin, TestMultitenancyMixin, Tes
     def test_shelf_with_read_only_org_field(self):
         org1 = self._create_org(name="org1")
         operator = self._get_operator()
-        self._create_org_user(user=operator, is_admin=True, organization=org1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._create_org_user(user=operator, is_admin=True, organization=org1)
         self.client.force_login(operator)
         self._create_shelf(name="test-shelf-a", organization=org1)
         path = reverse("test_shelf_list_with_read_only_org")